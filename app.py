@@ -1,89 +1,630 @@
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify, stream_with_context
+from werkzeug.utils import safe_join
 import atexit
 import json
+import mimetypes
 import os
 import sys
 import threading
 import time
+from contextlib import ExitStack
+from datetime import date, datetime, timezone
 from pathlib import Path
 
 import chess
-import chess.engine
 
 # Add the src directory to Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.dr_lupo_analyzer import DrLupoAnalyzer
-from src.challenge_builder import find_stockfish
+from src.admission import AdmissionController, AdmissionRejected, StreamLimiter
+from src.engine_pool import EnginePool
+from src.graph_svg import cached_svg
+from src.leaderboard import DailyLeaderboard, LeaderboardError, utc_today
+from src.live_runs import RunError, RunLimitReached, RunStore
+from src.opening_book import load_book
+from src.positions import PositionCache, position_key
+from src.profiling import NULL_PROFILER
+from src.precompressed import COMPRESSIBLE_TYPES, PrecompressedCache, build_payload, choose_encoding
+from src.scoring import ScoringError, ScoringTable, score_run
+from src.survival_tree import SurvivalTree
+from src.tablebase import open_tablebase
 
-app = Flask(__name__)
+# Static files are served by serve_static below (precompressed, with ETags)
+app = Flask(__name__, static_folder=None)
 
 BEST_MOVE_MARGIN_CP = 49
 
-# ---- Stockfish engine lifecycle (singleton for Survival Mode) ----
-_engine = None
-_engine_lock = threading.Lock()
-
-def get_engine():
-    global _engine
-    if _engine is None:
-        engine_path = find_stockfish()
-        _engine = chess.engine.SimpleEngine.popen_uci(engine_path)
-    return _engine
-
-def restart_engine():
-    """Kill and reopen the engine (call while holding _engine_lock)."""
-    global _engine
-    if _engine is not None:
-        try:
-            _engine.quit()
-        except Exception:
-            pass
-        _engine = None
-    return get_engine()
-
-def shutdown_engine():
-    global _engine
-    if _engine is not None:
-        try:
-            _engine.quit()
-        except Exception:
-            pass
-        _engine = None
+# ---- Stockfish engine lifecycle ----
+# Warm engines are kept between requests: one pool for Survival Mode, one for /analyze.
+# With $LUPO_ENGINE_WORKERS (host:port,...) searches run on engine worker nodes instead.
+ENGINE_WORKERS = os.environ.get("LUPO_ENGINE_WORKERS")
+# Processes sharing the worker nodes (gunicorn.conf.py exports its LUPO_WORKERS)
+APP_PROCESSES = int(os.environ.get("LUPO_WORKERS", 1))
+
+def make_engine_pool(size_env):
+    size = os.environ.get(size_env)
+    if ENGINE_WORKERS:
+        from src.engine_worker import RemoteEnginePool
+        # Without an explicit size, both pools of every process split the nodes' engines
+        return RemoteEnginePool(ENGINE_WORKERS, size=int(size) if size else None, share=2 * APP_PROCESSES)
+    return EnginePool(size=int(size or 1))
+
+_survival_pool = make_engine_pool("LUPO_SURVIVAL_ENGINES")
+_analysis_pool = make_engine_pool("LUPO_ANALYSIS_ENGINES")
+
+def shutdown_engines():
+    _survival_pool.close()
+    _analysis_pool.close()
+
+atexit.register(shutdown_engines)
+
+# Under gunicorn (gunicorn.conf.py) each worker warms its engines in post_fork,
+# with a short search on a typical middlegame, before it accepts requests
+WARMUP_FEN = "r1bq1rk1/pp2bppp/2n1pn2/2pp4/2PP4/2N1PN2/PP1BBPPP/R2QK2R w KQ - 4 8"
+WARMUP_DEPTH = int(os.environ.get("LUPO_WARMUP_DEPTH", 12))
+
+_engine_status = {"ready": False, "warmup_seconds": None, "warmed_at": None, "error": None}
+
+def warm_engines(depth=WARMUP_DEPTH):
+    """Start every engine of both pools and run a short search on each. Returns the status."""
+    board = chess.Board(WARMUP_FEN)
+    start = time.time()
+    try:
+        _survival_pool.warm(board, depth)
+        _analysis_pool.warm(board, depth)
+    except Exception as e:
+        _engine_status.update(ready=False, error=str(e))
+        raise
+    _engine_status.update(ready=True, error=None, warmed_at=time.time(),
+                          warmup_seconds=round(time.time() - start, 2))
+    return dict(_engine_status)
+
+# ---- Admission control for the engine-backed endpoints ----
+# Per-client token buckets and a cap on concurrent searches: one client can't occupy every
+# engine, and spikes are shed with 429/503 + Retry-After instead of queueing without bound.
+MAX_SURVIVAL_DEPTH = int(os.environ.get("LUPO_MAX_SURVIVAL_DEPTH", 20))
+MAX_ANALYZE_DEPTH = int(os.environ.get("LUPO_MAX_ANALYZE_DEPTH", 20))
+# Behind reverse proxies, clients are told apart by X-Forwarded-For instead of the proxy's address.
+# Only the entries appended by our own PROXY_HOPS proxies are trusted (counted from the right):
+# anything further left was sent by the client. LUPO_TRUST_PROXY=1 is kept as one hop.
+PROXY_HOPS = int(os.environ.get("LUPO_PROXY_HOPS", 1 if os.environ.get("LUPO_TRUST_PROXY") == "1" else 0))
+if PROXY_HOPS:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+_survival_admission = AdmissionController(
+    rate=float(os.environ.get("LUPO_SURVIVAL_RATE", 0.5)),
+    burst=int(os.environ.get("LUPO_SURVIVAL_BURST", 10)),
+    max_concurrent=lambda: _survival_pool.size,
+    queue_timeout=float(os.environ.get("LUPO_SURVIVAL_QUEUE_TIMEOUT", 10)),
+)
+# A game analysis keeps the whole analysis pool busy (its moves are spread over every engine)
+_analyze_admission = AdmissionController(
+    rate=float(os.environ.get("LUPO_ANALYZE_RATE", 1 / 60)),
+    burst=int(os.environ.get("LUPO_ANALYZE_BURST", 3)),
+    max_concurrent=int(os.environ.get("LUPO_ANALYZE_CONCURRENCY", 1)),
+    queue_timeout=float(os.environ.get("LUPO_ANALYZE_QUEUE_TIMEOUT", 120)),
+)
+
+def client_id():
+    return request.remote_addr or "unknown"
 
-atexit.register(shutdown_engine)
+def rejected_response(e):
+    response = jsonify({"error": e.reason, "retry_after": e.retry_after})
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def clamp_depth(value, default, maximum):
+    """Client-chosen search depth limited to 1..maximum. Raises ValueError if it isn't an integer."""
+    if value is None:
+        return min(default, maximum)
+    if isinstance(value, (bool, float)):
+        raise ValueError("depth must be an integer")
+    return max(1, min(int(value), maximum))
+
+@app.before_request
+def start_profile():
+    if PROFILING and request.args.get("profile") == "1":
+        from src.profiling import Profiler
+        g.profiler = Profiler()
+        g.profile_root = g.profiler.phase(f"{request.method} {request.path}")
+        g.profile_root.__enter__()
+
+@app.after_request
+def finish_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    g.pop("profile_root").__exit__(None, None, None)
+    name = f"{request.endpoint}-{time.time_ns()}-{os.getpid()}.folded"
+    response.headers["Server-Timing"] = profiler.server_timing()
+    response.headers["X-Lupo-Profile"] = name
+
+    def write():
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.write(PROFILE_DIR / name)
+
+    # Written once the body is sent, so the later phases of a streamed response are included
+    response.call_on_close(write)
+    return response
+
+def request_profiler():
+    """The current request's Profiler, or the no-op one when it isn't being profiled."""
+    return g.get("profiler", NULL_PROFILER)
+
+# Progressive Survival answers: a shallow search (capped at this depth and time per search,
+# ~100ms for the reply + multipv) is sent first, then the full-depth result
+SURVIVAL_SHALLOW_DEPTH = int(os.environ.get("LUPO_SURVIVAL_SHALLOW_DEPTH", 10))
+SURVIVAL_SHALLOW_SECONDS = float(os.environ.get("LUPO_SURVIVAL_SHALLOW_SECONDS", 0.05))
+
+# Per-request profiling: with LUPO_PROFILING=1, a request with ?profile=1 is timed phase by phase.
+# The phases come back in a Server-Timing header, and the collapsed stacks (flame graph input)
+# are written to LUPO_PROFILE_DIR under the name given in X-Lupo-Profile.
+PROFILING = os.environ.get("LUPO_PROFILING") == "1"
+PROFILE_DIR = Path(os.environ.get("LUPO_PROFILE_DIR", Path(__file__).resolve().parent / "data" / "profiles"))
+
+# Optional Syzygy tablebase ($SYZYGY_PATH) — answers simplified positions without the engine.
+# Opened once and shared by Survival and every /analyze analyzer.
+_tablebase = open_tablebase()
+
+# Optional opening book (books/opening_book.bin), mapped once and shared by every /analyze analyzer
+_opening_book = load_book()
+
+# Survival results keyed by position identity, so transpositions skip the engine
+_position_cache = PositionCache(maxsize=50000)
 
 CHALLENGES_DIR = Path(__file__).resolve().parent / "challenges"
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+LEADERBOARD_DB = Path(os.environ.get(
+    "LUPO_LEADERBOARD_DB", Path(__file__).resolve().parent / "data" / "leaderboard.sqlite3"))
+SURVIVAL_TREE_DB = Path(os.environ.get(
+    "LUPO_SURVIVAL_DB", Path(__file__).resolve().parent / "data" / "survival_tree.sqlite3"))
+RUNS_DB = Path(os.environ.get(
+    "LUPO_RUNS_DB", Path(__file__).resolve().parent / "data" / "live_runs.sqlite3"))
+
+# Runs one client address may play on today's Daily Challenge (each is one attempt at every
+# position). Only runs with a committed move count; players behind one NAT share the allowance.
+DAILY_RUNS_PER_CLIENT = int(os.environ.get("LUPO_DAILY_RUNS_PER_CLIENT", 20))
+
+# Live histogram updates are coalesced to at most one event per client per interval
+DAILY_STREAM_MIN_INTERVAL = 0.5
+# Each open stream holds a server thread (8 per gunicorn worker by default), so streams are capped
+# per worker and per client, and ended after a bounded lifetime; EventSource then reconnects
+_daily_streams = StreamLimiter(
+    max_streams=int(os.environ.get("LUPO_DAILY_STREAMS", 4)),
+    max_per_client=int(os.environ.get("LUPO_DAILY_STREAMS_PER_CLIENT", 2)),
+    lifetime=float(os.environ.get("LUPO_DAILY_STREAM_LIFETIME", 300)),
+)
+DAILY_STREAM_RECONNECT_MS = 2000
+
+# ---- Daily Challenge leaderboard (started lazily: it owns a writer thread) ----
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+def get_leaderboard():
+    global _leaderboard
+    with _leaderboard_lock:
+        if _leaderboard is None:
+            LEADERBOARD_DB.parent.mkdir(parents=True, exist_ok=True)
+            _leaderboard = DailyLeaderboard(LEADERBOARD_DB)
+    return _leaderboard
+
+def shutdown_leaderboard():
+    if _leaderboard is not None:
+        _leaderboard.close()
+
+atexit.register(shutdown_leaderboard)
+
+# ---- Survival tree: explored branches shared between players ----
+_survival_tree = None
+_survival_tree_lock = threading.Lock()
+
+def get_survival_tree():
+    global _survival_tree
+    with _survival_tree_lock:
+        if _survival_tree is None:
+            SURVIVAL_TREE_DB.parent.mkdir(parents=True, exist_ok=True)
+            _survival_tree = SurvivalTree(SURVIVAL_TREE_DB)
+    return _survival_tree
+
+def shutdown_survival_tree():
+    if _survival_tree is not None:
+        _survival_tree.close()
+
+atexit.register(shutdown_survival_tree)
+
+# ---- Live Scoring runs: committed moves per position, shared by all workers ----
+_run_store = None
+_run_store_lock = threading.Lock()
+
+def get_run_store():
+    global _run_store
+    with _run_store_lock:
+        if _run_store is None:
+            RUNS_DB.parent.mkdir(parents=True, exist_ok=True)
+            _run_store = RunStore(RUNS_DB)
+    return _run_store
+
+def shutdown_run_store():
+    if _run_store is not None:
+        _run_store.close()
+
+atexit.register(shutdown_run_store)
+
+
+def daily_rotation():
+    """Challenge IDs the Daily Challenge rotates through."""
+    return sorted(p.stem for p in CHALLENGES_DIR.glob("*.json")) if CHALLENGES_DIR.exists() else []
+
+
+def daily_challenge_id(day):
+    """The challenge everyone plays on `day` (rotates through challenges/)."""
+    ids = daily_rotation()
+    if not ids:
+        return None
+    return ids[date.fromisoformat(day).toordinal() % len(ids)]
+
+
+def daily_withheld(challenge_id):
+    """
+    Whether a challenge's evals are kept from Survival Mode today: it is the
+    Daily Challenge and the rotation has others to play instead. A rotation
+    of one challenge would lock Survival out of it for good, so it isn't
+    withheld then (and its Daily leaderboard can't be protected from the evals).
+    """
+    ids = daily_rotation()
+    return len(ids) > 1 and challenge_id == ids[date.fromisoformat(utc_today()).toordinal() % len(ids)]
+
+
+def utc_day_start(day):
+    return datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp()
+
+
+# ---- Precompressed responses: challenge JSON, vendor assets, pages ----
+_precompressed = PrecompressedCache()
+
+CACHE_CONTROL_CHALLENGE = "public, max-age=60"     # rebuilt challenges show up within a minute
+CACHE_CONTROL_STATIC = "public, max-age=86400"
+CACHE_CONTROL_PAGE = "no-cache"                    # always revalidated; unchanged pages cost a 304
+
+def send_payload(payload, mimetype, cache_control):
+    """Respond with the best encoding the client accepts, or 304 if its copy is current."""
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"), payload.variants)
+    etag = payload.etag(encoding)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload.variants[encoding], mimetype=mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def render_page(template_name):
+    """Pages take no template context: render and compress once per template version."""
+    template_path = Path(app.root_path) / app.template_folder / template_name
+    payload = _precompressed.get(
+        f"template:{template_name}", template_path.stat().st_mtime,
+        lambda: build_payload(render_template(template_name).encode("utf-8")))
+    return send_payload(payload, "text/html", CACHE_CONTROL_PAGE)
+
+
+@app.route('/static/<path:filename>')
+def serve_static(filename):
+    path = safe_join(str(STATIC_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Not found"}), 404
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    payload = _precompressed.get_file(path, compressible=mimetype.startswith(COMPRESSIBLE_TYPES))
+    return send_payload(payload, mimetype, CACHE_CONTROL_STATIC)
 
 
 @app.route('/')
 def home():
     """Render the main menu."""
-    return render_template('menu.html')
+    return render_page('menu.html')
 
 
 @app.route('/play/<challenge_id>')
 def play_challenge(challenge_id):
     """Serve the live scoring challenge page."""
-    return render_template('challenge.html')
+    return render_page('challenge.html')
 
 
 @app.route('/survival/<challenge_id>')
 def survival_mode(challenge_id):
     """Serve the Survival Mode page."""
-    return render_template('survival.html')
+    return render_page('survival.html')
 
 
-@app.route('/api/challenge/<challenge_id>')
-def get_challenge(challenge_id):
-    """Return pre-computed challenge JSON."""
+def _challenge_path(challenge_id):
     safe_name = "".join(c for c in challenge_id if c.isalnum() or c in ('_', '-'))
-    path = CHALLENGES_DIR / f"{safe_name}.json"
-    if not path.exists():
-        return jsonify({"error": "Challenge not found"}), 404
+    return CHALLENGES_DIR / f"{safe_name}.json"
+
+
+# Scoring tables per challenge, rebuilt when the JSON file changes
+_scoring_tables = {}
+_scoring_tables_lock = threading.Lock()
+
+def get_scoring_table(challenge_id):
+    """Return (challenge, ScoringTable) for a challenge, or None if it doesn't exist."""
+    path = _challenge_path(challenge_id)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    with _scoring_tables_lock:
+        cached = _scoring_tables.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
     with open(path, encoding="utf-8") as f:
-        data = json.load(f)
-    return jsonify(data)
+        challenge = json.load(f)
+    table = ScoringTable(challenge)
+    with _scoring_tables_lock:
+        _scoring_tables[path] = (mtime, challenge, table)
+    return challenge, table
+
+
+@app.route('/api/survival/challenge/<challenge_id>')
+def get_survival_challenge(challenge_id):
+    """Full challenge JSON for Survival Mode (the file as written, in its stored encodings).
+
+    It carries every eval, so today's Daily Challenge is withheld until the day is
+    over (see daily_withheld).
+    """
+    if daily_withheld(challenge_id):
+        return jsonify({"error": "Today's Daily Challenge opens in Survival Mode tomorrow"}), 403
+    payload = _precompressed.get_file(_challenge_path(challenge_id))
+    if payload is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    return send_payload(payload, "application/json", CACHE_CONTROL_CHALLENGE)
+
+
+@app.route('/api/challenge/<challenge_id>/meta')
+def get_challenge_meta(challenge_id):
+    """Challenge metadata for Live Scoring: everything but the positions' move lists."""
+    loaded = get_scoring_table(challenge_id)
+    if loaded is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    challenge, table = loaded
+    meta = {k: v for k, v in challenge.items() if k != "positions"}
+    meta["num_positions"] = len(table)
+    meta["max_points"] = [p.max_points for p in table.positions]
+    meta["max_score"] = table.max_score
+    return jsonify(meta)
+
+
+@app.route('/api/challenge/<challenge_id>/position/<int:index>')
+def get_challenge_position(challenge_id, index):
+    """One position to play: FEN, legal moves and best-move count — no evals."""
+    loaded = get_scoring_table(challenge_id)
+    if loaded is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    challenge, table = loaded
+    if not 0 <= index < len(table):
+        return jsonify({"error": "Position not found"}), 404
+    pos = challenge["positions"][index]
+    return jsonify({
+        "index": index,
+        "move_number": pos.get("move_number"),
+        "fen": pos["fen"],
+        "legal_moves": list(table.positions[index].evals),
+        "best_move_count": pos["best_move_count"],
+        "max_points": table.positions[index].max_points,
+    })
+
+
+@app.route('/api/challenge/<challenge_id>/run', methods=['POST'])
+def start_run(challenge_id):
+    """Start a Live Scoring run. Moves are checked against it and it is what gets submitted.
+
+    Starting a run is free: the Daily Challenge's per-client limit is applied to
+    its first checked move. The page keeps the run id and resumes the run on reload.
+
+    Returns: {run_id}
+    """
+    if get_scoring_table(challenge_id) is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    return jsonify({"run_id": get_run_store().create(challenge_id, client_id())})
+
+
+@app.route('/api/challenge/<challenge_id>/run/<run_id>')
+def resume_run(challenge_id, run_id):
+    """State of an open run, to resume it: positions played and the score so far.
+
+    Returns: {run_id, positions_played, result}  (result as for /submit, null before the first move)
+    """
+    loaded = get_scoring_table(challenge_id)
+    if loaded is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    try:
+        moves = get_run_store().state(run_id, challenge_id)
+    except RunError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"run_id": run_id, "positions_played": len(moves),
+                    "result": score_run(loaded[1], moves) if moves else None})
+
+
+@app.route('/api/challenge/<challenge_id>/position/<int:index>/check', methods=['POST'])
+def check_challenge_move(challenge_id, index):
+    """Commit one move to a run and return its verdict.
+
+    Input JSON: {run_id, uci}
+    Returns: is_best, best_rank, penalty, is_game_move and open (a retry or
+    bonus move may follow). No evals. The game continuation (game move and
+    opponent reply) is added once the position is closed, or straight away
+    if the move was the game move itself.
+
+    A position takes one main move per run; checking another one fails with 409.
+    """
+    loaded = get_scoring_table(challenge_id)
+    if loaded is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    challenge, table = loaded
+    if not 0 <= index < len(table):
+        return jsonify({"error": "Position not found"}), 404
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('uci'), str) or not isinstance(data.get('run_id'), str):
+        return jsonify({"error": "run_id and uci are required"}), 400
+    limit = {}
+    day = utc_today()
+    if challenge_id == daily_challenge_id(day):
+        limit = {"max_started": DAILY_RUNS_PER_CLIENT, "since": utc_day_start(day)}
+    try:
+        verdict = get_run_store().commit(data['run_id'], challenge_id, table, index, data['uci'], **limit)
+    except RunLimitReached as e:
+        return jsonify({"error": str(e)}), 429
+    except RunError as e:
+        return jsonify({"error": str(e)}), 409
+    except ScoringError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not verdict["open"] or verdict["is_game_move"]:
+        pos = challenge["positions"][index]
+        verdict["next"] = {
+            "game_move_uci": pos.get("game_move_uci"),
+            "fen_after_game_move": pos.get("fen_after_game_move"),
+            "opponent_reply_uci": pos.get("opponent_reply_uci"),
+            "fen_after_opponent": pos.get("fen_after_opponent"),
+        }
+    return jsonify(verdict)
+
+
+def _score_committed_run(challenge_id, table, data):
+    """Close the run named in a submission and score its committed moves. Returns (result, error response)."""
+    run_id = data.get('run_id') if isinstance(data, dict) else None
+    if not isinstance(run_id, str):
+        return None, (jsonify({"error": "run_id is required"}), 400)
+    try:
+        moves = get_run_store().finish(run_id, challenge_id)
+        return score_run(table, moves), None
+    except RunError as e:
+        return None, (jsonify({"error": str(e)}), 409)
+    except ScoringError as e:
+        return None, (jsonify({"error": f"Invalid run: {e}"}), 400)
+
+
+@app.route('/api/challenge/<challenge_id>/submit', methods=['POST'])
+def submit_run(challenge_id):
+    """Score a Live Scoring run server-side, from the moves committed to it.
+
+    Input JSON: {run_id}
+    Returns: the verified score, streaks and per-position points.
+    """
+    loaded = get_scoring_table(challenge_id)
+    if loaded is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    challenge, table = loaded
+
+    result, error = _score_committed_run(challenge_id, table, request.get_json(silent=True))
+    if error:
+        return error
+
+    result["real_player_score"] = challenge.get("real_player_score")
+    result["real_player_best"] = [p.game_move in p.best_ranks for p in table.positions]
+    return jsonify(result)
+
+
+@app.route('/api/daily')
+def daily_info():
+    """Today's Daily Challenge (UTC)."""
+    day = utc_today()
+    return jsonify({"day": day, "challenge_id": daily_challenge_id(day)})
+
+
+@app.route('/api/daily/submit', methods=['POST'])
+def daily_submit():
+    """Submit today's one attempt.
+
+    Input JSON: {player, run_id}  (a run started on today's challenge, see /api/challenge/<id>/run)
+    The streak (consecutive best moves from the start) is computed server-side
+    from the moves committed to the run.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('player'):
+        return jsonify({"error": "player and run_id are required"}), 400
+
+    day = utc_today()
+    challenge_id = daily_challenge_id(day)
+    loaded = get_scoring_table(challenge_id) if challenge_id else None
+    if loaded is None:
+        return jsonify({"error": "No Daily Challenge today"}), 404
+    _, table = loaded
+
+    result, error = _score_committed_run(challenge_id, table, data)
+    if error:
+        return error
+
+    try:
+        entry = get_leaderboard().submit(str(data['player'])[:64], result["streak"], result["score"], day=day)
+    except LeaderboardError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"day": day, "challenge_id": challenge_id, "rank": entry, "result": result})
+
+
+@app.route('/api/daily/histogram')
+def daily_histogram():
+    day = request.args.get('day') or utc_today()
+    return jsonify({"day": day, "histogram": get_leaderboard().histogram(day)})
+
+
+@app.route('/api/daily/rank/<player>')
+def daily_rank(player):
+    day = request.args.get('day') or utc_today()
+    entry = get_leaderboard().rank(player, day)
+    if entry is None:
+        return jsonify({"error": "No submission for this player"}), 404
+    return jsonify(entry)
+
+
+@app.route('/api/daily/top')
+def daily_top():
+    day = request.args.get('day') or utc_today()
+    n = max(1, min(request.args.get('n', 10, type=int), 100))
+    return jsonify({"day": day, "top": get_leaderboard().top(n, day)})
+
+
+@app.route('/api/daily/stream')
+def daily_stream():
+    """Server-Sent Events: the day's histogram, pushed whenever it changes.
+
+    A stream ends after LUPO_DAILY_STREAM_LIFETIME seconds, or when the UTC day
+    rolls over (unless ?day= pins one); EventSource reconnects by itself. Over
+    the open-stream caps the answer is 503 with Retry-After.
+    """
+    following_today = not request.args.get('day')
+    day = request.args.get('day') or utc_today()
+    board = get_leaderboard()
+    held = ExitStack()
+    try:
+        held.enter_context(_daily_streams.hold(client_id()))
+    except AdmissionRejected as e:
+        return rejected_response(e)
+
+    def events():
+        deadline = time.monotonic() + _daily_streams.lifetime
+        yield f"retry: {DAILY_STREAM_RECONNECT_MS}\n\n"
+        version = None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (following_today and utc_today() != day):
+                return
+            new_version = board.wait_for_update(version, timeout=min(15, remaining))
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps({'day': day, 'histogram': board.histogram(day)})}\n\n"
+            time.sleep(DAILY_STREAM_MIN_INTERVAL)
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(held.close)
+    return response
 
 
 @app.route('/challenges')
@@ -108,42 +649,277 @@ def list_challenges():
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """Analyze a Lichess game for the Dr Lupo Challenge."""
+    try:
+        _analyze_admission.check_quota(client_id())
+    except AdmissionRejected as e:
+        return rejected_response(e)
+
     lichess_url = request.form.get('url')
-    engine_depth = int(request.form.get('depth', 16))
+    try:
+        engine_depth = clamp_depth(request.form.get('depth'), 16, MAX_ANALYZE_DEPTH)
+    except ValueError:
+        return jsonify({"error": "Invalid depth"}), 400
     margin_cp = float(request.form.get('margin', 5))  # Changed default to 5cp
     
     if not lichess_url:
         return jsonify({"error": "No URL provided"}), 400
     
-    # Create an analyzer instance
+    # Imported here: the analyzer (and its PGN/HTTP dependencies) is only needed by this route
+    from src.dr_lupo_analyzer import DrLupoAnalyzer
+
+    # Create an analyzer instance (borrows a warm engine from the pool)
+    profiler = request_profiler()
     analyzer = DrLupoAnalyzer(
         engine_depth=engine_depth,
-        margin_cp=margin_cp
+        margin_cp=margin_cp,
+        pool=_analysis_pool,
+        book=_opening_book,
+        tablebase=_tablebase,
+        position_cache=_position_cache,
+        profiler=profiler,
     )
     
-    # Analyze the game
-    results = analyzer.analyze_game(lichess_url)
+    # Analyze the game (waits for a free analysis slot, or is shed if the queue is too long)
+    try:
+        with ExitStack() as stack:
+            with profiler.phase("admission_wait"):
+                stack.enter_context(_analyze_admission.slot())
+            results = analyzer.analyze_game(lichess_url)
+    except AdmissionRejected as e:
+        return rejected_response(e)
     
     if 'error' in results:
         return jsonify(results), 400
-    
-    return jsonify(results)
+
+    if results.get('move_analysis'):
+        with profiler.phase("graph"):
+            results['graph_svg'] = cached_svg(results, margin_cp=margin_cp)
+
+    with profiler.phase("serialize"):
+        return jsonify(results)
+
+
+def _survival_position(fen, all_moves):
+    """Classify best moves (within BEST_MOVE_MARGIN_CP) for a Survival position."""
+    all_moves = sorted(all_moves, key=lambda x: x["eval_cp"], reverse=True)
+    best_eval = all_moves[0]["eval_cp"]
+    best_moves = [m for m in all_moves if (best_eval - m["eval_cp"]) <= BEST_MOVE_MARGIN_CP]
+
+    return {
+        "fen": fen,
+        "best_moves": [{"uci": m["uci"], "san": m["san"], "eval_cp": m["eval_cp"]} for m in best_moves[:3]],
+        "all_moves": all_moves,
+        "best_move_count": min(len(best_moves), 3),
+    }
+
+
+def _survival_response(board, fen_after_player, opp_move, all_moves):
+    """Build the /api/survival/analyze response.
+
+    `board` is the position after the player's move; `all_moves` is the move
+    list after the opponent's reply, or None if that reply ends the game.
+    """
+    opp_san = board.san(opp_move)
+    board.push(opp_move)
+    fen_after_opponent = board.fen()
+    return {
+        "opponent_reply_uci": opp_move.uci(),
+        "opponent_reply_san": opp_san,
+        "fen_after_player": fen_after_player,
+        "fen_after_opponent": fen_after_opponent,
+        "game_over": all_moves is None,
+        "position": _survival_position(fen_after_opponent, all_moves) if all_moves is not None else None,
+    }
+
+
+def _survival_from_tablebase(board):
+    """Answer a Survival move from the tablebase, or None if it isn't covered.
+
+    `board` is the position after the player's move, opponent to move.
+    Returns (opponent_move, all_moves) like the engine path.
+    """
+    opp_scores = _tablebase.score_moves(board)
+    if opp_scores is None:
+        return None
+
+    opp_move = opp_scores[0]["move"]
+    board.push(opp_move)
+    try:
+        if board.is_game_over():
+            all_moves = None
+            avoided = 1
+        else:
+            player_scores = _tablebase.score_moves(board)
+            if player_scores is None:
+                return None
+            all_moves = [{"uci": e["move"].uci(), "san": board.san(e["move"]), "eval_cp": e["eval_cp"]}
+                         for e in player_scores]
+            avoided = 2  # engine.play + the multipv analyse
+    finally:
+        board.pop()
+
+    _tablebase.searches_avoided += avoided
+    return opp_move, all_moves
+
+
+@app.route('/api/stats')
+def stats():
+    """Counters for the engine pools and analysis shortcuts (tablebase, position cache)."""
+    return jsonify({
+        "engines": {"survival": _survival_pool.stats(), "analysis": _analysis_pool.stats()},
+        "tablebase": _tablebase.stats() if _tablebase is not None else None,
+        "positions": _position_cache.stats(),
+        "survival_tree": _survival_tree.stats() if _survival_tree is not None else None,
+        "precompressed": _precompressed.stats(),
+        "admission": {"survival": _survival_admission.stats(), "analyze": _analyze_admission.stats(),
+                      "daily_streams": _daily_streams.stats()},
+    })
+
+
+@app.route('/api/health')
+def health():
+    """Readiness of this worker: 200 once its engines are warm, 503 before (or if warmup failed)."""
+    status = dict(_engine_status)
+    status["pid"] = os.getpid()
+    status["engines"] = {"survival": _survival_pool.stats(), "analysis": _analysis_pool.stats()}
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@app.route('/api/survival/tree/<challenge_id>/stats')
+def survival_tree_stats(challenge_id):
+    """Growth, hit ratio and storage size of a challenge's shared Survival tree."""
+    if get_scoring_table(challenge_id) is None:
+        return jsonify({"error": "Challenge not found"}), 404
+    return jsonify(get_survival_tree().stats(challenge_id))
+
+
+def _survival_tree_board(challenge, path, fen):
+    """Replay `path` from the challenge's first position; None unless it reaches `fen`."""
+    board = chess.Board(challenge["positions"][0]["fen"])
+    try:
+        for uci in path:
+            move = chess.Move.from_uci(uci)
+            if move not in board.legal_moves:
+                return None
+            board.push(move)
+    except ValueError:
+        return None
+    if position_key(board) != position_key(chess.Board(fen)):
+        return None
+    return board
+
+
+def _survival_search(engine, board, limit, profiler=NULL_PROFILER):
+    """Opponent's best reply to `board`, then every legal move after it.
+
+    Returns (opponent_move, all_moves); all_moves is None if the reply ends the game.
+    """
+    with profiler.phase("search_reply"):
+        result = engine.play(board, limit)
+    opp_move = result.move
+    board.push(opp_move)
+    try:
+        if board.is_game_over():
+            return opp_move, None
+        # Use multipv for efficient single-call analysis of all legal moves
+        num_legal = len(list(board.legal_moves))
+        with profiler.phase("search_moves"):
+            infos = engine.analyse(board, limit, multipv=num_legal)
+        all_moves = []
+        with profiler.phase("san"):
+            for info in infos:
+                mv = info["pv"][0]
+                all_moves.append({
+                    "uci": mv.uci(),
+                    "san": board.san(mv),
+                    "eval_cp": info["score"].relative.score(mate_score=100000),
+                })
+        return opp_move, all_moves
+    finally:
+        board.pop()
+
+
+def _survival_verdict(response):
+    """What a Survival answer decides: the opponent's reply and which moves count as best."""
+    position = response["position"]
+    best = frozenset(m["uci"] for m in position["best_moves"]) if position is not None else None
+    return response["opponent_reply_uci"], best
+
+
+def _survival_progressive(board, fen_after_player, depth, store):
+    """Stream a Survival answer as NDJSON: a shallow one right away, then the full-depth one.
+
+    The first line is marked "provisional"; the second is the result the move is graded
+    on, with "verdict_changed" set if the deep search picked another reply or another
+    set of best moves. The slot and engine are taken before the response starts (so a
+    saturated server still answers 429/503) and held until the deep search is done.
+    """
+    import chess.engine
+
+    profiler = request_profiler()
+    shallow_limit = chess.engine.Limit(depth=min(SURVIVAL_SHALLOW_DEPTH, depth), time=SURVIVAL_SHALLOW_SECONDS)
+    with ExitStack() as stack:
+        with profiler.phase("acquire_engine"):
+            stack.enter_context(_survival_admission.slot())
+            engine = stack.enter_context(_survival_pool.acquire())
+        with profiler.phase("shallow"):
+            opp_move, all_moves = _survival_search(engine, board, shallow_limit, profiler)
+        held = stack.pop_all()
+
+    provisional = _survival_response(board.copy(), fen_after_player, opp_move, all_moves)
+    provisional.update(provisional=True, depth=shallow_limit.depth)
+    # The deep search runs while the body streams, after the request's own phases are closed
+    base = profiler.current_stack()
+
+    def lines():
+        yield json.dumps(provisional) + "\n"
+        try:
+            with held, profiler.phase("deep", under=base):
+                opp_move, all_moves = _survival_search(engine, board, chess.engine.Limit(depth=depth), profiler)
+        except chess.engine.EngineTerminatedError:
+            yield json.dumps({"error": "Engine crashed, please retry"}) + "\n"
+            return
+        except chess.engine.EngineError as e:
+            yield json.dumps({"error": f"Engine error: {e}"}) + "\n"
+            return
+        store(opp_move, all_moves)
+        final = _survival_response(board, fen_after_player, opp_move, all_moves)
+        final.update(provisional=False, depth=depth,
+                     verdict_changed=_survival_verdict(final) != _survival_verdict(provisional))
+        yield json.dumps(final) + "\n"
+
+    response = Response(lines(), mimetype="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # A client that disconnects before the deep result must not keep the engine
+    response.call_on_close(held.close)
+    return response
 
 
 @app.route('/api/survival/analyze', methods=['POST'])
 def survival_analyze():
     """On-demand Stockfish analysis for Survival Mode branching.
 
-    Input JSON: {fen, player_move}  (player_move is UCI string)
+    Input JSON: {fen, player_move, challenge_id?, path?, progressive?}
+        player_move is a UCI string; path lists the UCIs leading from the
+        challenge's first position to `fen`. With challenge_id and path, the
+        answer is read from / stored in the challenge's shared Survival tree.
+        With progressive, an answer that needs the engine is streamed as
+        NDJSON: a shallow provisional result, then the full-depth one.
     Returns: opponent best reply + full analysis of the resulting position.
     """
+    import chess.engine  # deferred: only the engine fallback below needs it
+
+    profiler = request_profiler()
     data = request.get_json()
     if not data:
         return jsonify({"error": "JSON body required"}), 400
 
     fen = data.get('fen')
     player_move = data.get('player_move')
-    depth = data.get('depth', 18)
+    try:
+        depth = clamp_depth(data.get('depth'), 18, MAX_SURVIVAL_DEPTH)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid depth"}), 400
 
     if not fen or not player_move:
         return jsonify({"error": "fen and player_move are required"}), 400
@@ -153,84 +929,98 @@ def survival_analyze():
     except ValueError:
         return jsonify({"error": "Invalid FEN"}), 400
 
-    move = chess.Move.from_uci(player_move)
+    try:
+        move = chess.Move.from_uci(player_move)
+    except ValueError:
+        return jsonify({"error": "Illegal move"}), 400
     if move not in board.legal_moves:
         return jsonify({"error": "Illegal move"}), 400
 
-    with _engine_lock:
-      try:
-        engine = get_engine()
-
-        # 1. Push player's move
-        board.push(move)
-        fen_after_player = board.fen()
+    tree = None
+    tree_path = None
+    challenge_id = data.get('challenge_id')
+    path = data.get('path')
+    if challenge_id and isinstance(path, list) and all(isinstance(u, str) for u in path):
+        loaded = get_scoring_table(challenge_id)
+        if loaded is None:
+            return jsonify({"error": "Challenge not found"}), 404
+        if _survival_tree_board(loaded[0], path, fen) is None:
+            return jsonify({"error": "path does not lead to fen"}), 400
+        tree = get_survival_tree()
+        tree_path = path + [player_move]
 
-        # 2. Get opponent's best reply
-        if board.is_game_over():
-            return jsonify({
-                "opponent_reply_uci": None,
-                "opponent_reply_san": None,
-                "fen_after_player": fen_after_player,
-                "fen_after_opponent": fen_after_player,
-                "game_over": True,
-                "position": None,
-            })
-
-        result = engine.play(board, chess.engine.Limit(depth=depth))
-        opp_move = result.move
-        opp_san = board.san(opp_move)
-        opp_uci = opp_move.uci()
-        board.push(opp_move)
-        fen_after_opponent = board.fen()
-
-        # 3. Analyze all legal moves in the resulting position
-        if board.is_game_over():
-            return jsonify({
-                "opponent_reply_uci": opp_uci,
-                "opponent_reply_san": opp_san,
-                "fen_after_player": fen_after_player,
-                "fen_after_opponent": fen_after_opponent,
-                "game_over": True,
-                "position": None,
-            })
-
-        # Use multipv for efficient single-call analysis
-        num_legal = len(list(board.legal_moves))
-        infos = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=num_legal)
-
-        all_moves = []
-        for info in infos:
-            mv = info["pv"][0]
-            score_cp = info["score"].relative.score(mate_score=100000)
-            all_moves.append({
-                "uci": mv.uci(),
-                "san": board.san(mv),
-                "eval_cp": score_cp,
-            })
-
-        all_moves.sort(key=lambda x: x["eval_cp"], reverse=True)
-        best_eval = all_moves[0]["eval_cp"]
-        best_moves = [m for m in all_moves if (best_eval - m["eval_cp"]) <= BEST_MOVE_MARGIN_CP]
-
-        position = {
-            "fen": fen_after_opponent,
-            "best_moves": [{"uci": m["uci"], "san": m["san"], "eval_cp": m["eval_cp"]} for m in best_moves[:3]],
-            "all_moves": all_moves,
-            "best_move_count": min(len(best_moves), 3),
-        }
+    # 1. Push player's move
+    board.push(move)
+    fen_after_player = board.fen()
 
+    # 2. Get opponent's best reply
+    if board.is_game_over():
         return jsonify({
-            "opponent_reply_uci": opp_uci,
-            "opponent_reply_san": opp_san,
+            "opponent_reply_uci": None,
+            "opponent_reply_san": None,
             "fen_after_player": fen_after_player,
-            "fen_after_opponent": fen_after_opponent,
-            "game_over": False,
-            "position": position,
+            "fen_after_opponent": fen_after_player,
+            "game_over": True,
+            "position": None,
         })
-      except chess.engine.EngineTerminatedError:
-        engine = restart_engine()
+
+    def respond(opp_move, all_moves):
+        with profiler.phase("serialize"):
+            return jsonify(_survival_response(board, fen_after_player, opp_move, all_moves))
+
+    # Branches other players already explored are answered from the tree
+    if tree is not None:
+        with profiler.phase("tree"):
+            stored = tree.get(challenge_id, tree_path, depth)
+        if stored is not None:
+            opp_uci, all_moves = stored
+            return respond(chess.Move.from_uci(opp_uci), all_moves)
+
+    # Transpositions (from any challenge or branch) are answered from the cache
+    cached = _position_cache.get("survival", board, depth)
+    if cached is not None:
+        opp_uci, all_moves = cached
+        if tree is not None:
+            tree.put(challenge_id, tree_path, depth, opp_uci, all_moves)
+        return respond(chess.Move.from_uci(opp_uci), all_moves)
+
+    if _tablebase is not None:
+        with profiler.phase("tablebase"):
+            tb_result = _survival_from_tablebase(board)
+        if tb_result is not None:
+            opp_move, all_moves = tb_result
+            _position_cache.put("survival", board, depth, (opp_move.uci(), all_moves))
+            if tree is not None:
+                tree.put(challenge_id, tree_path, depth, opp_move.uci(), all_moves)
+            return respond(opp_move, all_moves)
+
+    def store(opp_move, all_moves):
+        _position_cache.put("survival", board, depth, (opp_move.uci(), all_moves))
+        if tree is not None:
+            tree.put(challenge_id, tree_path, depth, opp_move.uci(), all_moves)
+
+    try:
+        # Only engine searches count against the quota and take a slot: invalid requests and
+        # tree, cache and tablebase answers above are cheap and never wait
+        _survival_admission.check_quota(client_id())
+        if data.get('progressive'):
+            return _survival_progressive(board, fen_after_player, depth, store)
+
+        with ExitStack() as stack:
+            with profiler.phase("acquire_engine"):
+                stack.enter_context(_survival_admission.slot())
+                engine = stack.enter_context(_survival_pool.acquire())
+            opp_move, all_moves = _survival_search(engine, board, chess.engine.Limit(depth=depth), profiler)
+
+        with profiler.phase("store"):
+            store(opp_move, all_moves)
+        return respond(opp_move, all_moves)
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    except chess.engine.EngineTerminatedError:
+        # The pool has dropped the dead engine; the next request starts a fresh one
         return jsonify({"error": "Engine crashed, please retry"}), 503
-      except chess.engine.EngineError as e:
+    except chess.engine.EngineError as e:
         return jsonify({"error": f"Engine error: {e}"}), 500
 
 
@@ -0,0 +1,51 @@
+"""
+Gunicorn configuration — preloaded app, Stockfish warmed in every worker.
+
+The app (routes, templates, tablebase handles) is imported once in the master
+and shared by the forked workers. Engine processes can't be shared across a
+fork, so each worker starts its own in post_fork and runs a short search
+before it accepts requests; the first player then gets steady-state latency.
+GET /api/health answers 200 once the answering worker's engines are warm.
+
+atexit handlers don't run reliably in forked workers, so worker_exit shuts
+the engines, leaderboard writer, Survival tree and run store down
+explicitly.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+
+    LUPO_WORKERS=4 LUPO_SURVIVAL_ENGINES=2 gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = os.environ.get("LUPO_BIND", "0.0.0.0:5000")
+# Exported so the app can split remote engine workers between the processes
+workers = int(os.environ.setdefault("LUPO_WORKERS", "2"))
+# Threaded workers: SSE streams and engine searches hold a thread each
+worker_class = "gthread"
+threads = int(os.environ.get("LUPO_THREADS", 8))
+preload_app = True
+# Covers the warmup in post_fork as well as deep /analyze searches
+timeout = int(os.environ.get("LUPO_WORKER_TIMEOUT", 120))
+
+
+def post_fork(server, worker):
+    import app
+
+    try:
+        status = app.warm_engines()
+    except Exception as e:
+        # Keep serving challenges; /api/health reports the failure
+        server.log.error("Worker %s: engine warmup failed: %s", worker.pid, e)
+        return
+    server.log.info("Worker %s: engines warm in %.2fs", worker.pid, status["warmup_seconds"])
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.shutdown_engines()
+    app.shutdown_leaderboard()
+    app.shutdown_survival_tree()
+    app.shutdown_run_store()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Admission — Per-client quotas and a global search cap for the engine-backed endpoints.
+
+Every engine search holds a Stockfish process for a second or more, so a
+single client sending requests in a loop can keep every engine busy and push
+everyone else's latency up without bound. An AdmissionController puts two
+gates in front of the engines:
+
+    quota   a token bucket per client (IP): `rate` requests per second on
+            average, bursts of up to `burst`. Over quota → 429.
+    slots   at most `max_concurrent` searches run at once; up to `max_queue`
+            more wait, each for at most `queue_timeout` seconds. Queue full
+            or wait too long → 503.
+
+Rejections are raised as AdmissionRejected with a Retry-After estimate and
+are cheap, so a spike is shed in microseconds instead of queueing behind the
+engines. stats() counts admitted, queued and shed requests per reason.
+
+Long-lived streams (Server-Sent Events) hold a server thread each instead of
+an engine; a StreamLimiter caps how many are open, in total and per client,
+and each stream is given a bounded lifetime so the client reconnects.
+
+Quotas and slots are per process; under gunicorn each worker has its own.
+
+Usage:
+    python -m src.admission bench --clients 20 --abusers 2 --seconds 10
+"""
+
+import argparse
+import math
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """A request was shed: 429 (over the client's quota) or 503 (engines saturated)."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """Token-bucket quotas per client plus a bounded queue for a fixed number of search slots."""
+
+    def __init__(self, rate, burst, max_concurrent, max_queue=None, queue_timeout=10.0, max_clients=10000):
+        """
+        Args:
+            rate: Requests per second each client may sustain.
+            burst: Requests a client may send at once after being idle.
+            max_concurrent: Searches running at once (int, or a function returning it,
+                read at every admission so the limit follows an engine pool's size).
+            max_queue: Requests allowed to wait for a slot (default: 4 × max_concurrent).
+            queue_timeout: Seconds a request may wait for a slot before it is shed.
+            max_clients: Client buckets kept; the least recently seen are dropped first.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._max_concurrent = max_concurrent
+        self._resolved = None
+        self._max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client → [tokens, last update]
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self.active = 0
+        self.waiting = 0
+        self._service_time = None  # moving average of seconds per admitted search
+        self.counters = {"admitted": 0, "queued": 0, "over_quota": 0, "queue_full": 0, "queue_timeout": 0,
+                         "peak_active": 0, "peak_waiting": 0, "max_wait_ms": 0}
+
+    @property
+    def max_concurrent(self):
+        if callable(self._max_concurrent):
+            self._resolved = max(1, int(self._max_concurrent()))
+            return self._resolved
+        return self._max_concurrent
+
+    @property
+    def max_queue(self):
+        return self._max_queue if self._max_queue is not None else 4 * self.max_concurrent
+
+    def check_quota(self, client, cost=1):
+        """Take `cost` tokens from the client's bucket, or raise AdmissionRejected (429)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                bucket = [float(self.burst), now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            self._buckets[client] = bucket  # most recently seen last
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            if bucket[0] < cost:
+                self.counters["over_quota"] += 1
+                raise AdmissionRejected(429, "Too many requests", (cost - bucket[0]) / self.rate)
+            bucket[0] -= cost
+
+    def _retry_after(self):
+        # Time for the queue ahead to drain through the slots
+        service = self._service_time or 1.0
+        return service * (self.waiting + 1) / self.max_concurrent
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the search slots for the duration of the block, or raise AdmissionRejected (503)."""
+        max_concurrent = self.max_concurrent  # read outside the lock: a lazy pool may start here
+        with self._lock:
+            if self.active >= max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self.counters["queue_full"] += 1
+                    raise AdmissionRejected(503, "Engines are busy", self._retry_after())
+                self.waiting += 1
+                self.counters["queued"] += 1
+                self.counters["peak_waiting"] = max(self.counters["peak_waiting"], self.waiting)
+                waited_from = time.monotonic()
+                deadline = waited_from + self.queue_timeout
+                try:
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.counters["queue_timeout"] += 1
+                            raise AdmissionRejected(503, "Engines are busy", self._retry_after())
+                        # Woken by a freed slot, or after a second to pick up a larger limit
+                        self._slot_free.wait(min(remaining, 1.0))
+                finally:
+                    self.waiting -= 1
+                wait_ms = (time.monotonic() - waited_from) * 1000
+                self.counters["max_wait_ms"] = max(self.counters["max_wait_ms"], round(wait_ms))
+            self.active += 1
+            self.counters["admitted"] += 1
+            self.counters["peak_active"] = max(self.counters["peak_active"], self.active)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.active -= 1
+                self._service_time = elapsed if self._service_time is None else 0.8 * self._service_time + 0.2 * elapsed
+                self._slot_free.notify()
+
+    def stats(self):
+        # A function limit is reported as last read (None before the first request), never read just for stats
+        max_concurrent = self._resolved if callable(self._max_concurrent) else self._max_concurrent
+        with self._lock:
+            shed = self.counters["over_quota"] + self.counters["queue_full"] + self.counters["queue_timeout"]
+            return {
+                **self.counters,
+                "shed": shed,
+                "active": self.active,
+                "waiting": self.waiting,
+                "clients": len(self._buckets),
+                "avg_search_ms": round(self._service_time * 1000) if self._service_time is not None else None,
+                "limits": {
+                    "rate": self.rate,
+                    "burst": self.burst,
+                    "max_concurrent": max_concurrent,
+                    "max_queue": self.max_queue if max_concurrent is not None else self._max_queue,
+                    "queue_timeout": self.queue_timeout,
+                },
+            }
+
+
+class StreamLimiter:
+    """Caps on open long-lived streams: in total (this process) and per client."""
+
+    def __init__(self, max_streams, max_per_client, lifetime):
+        """
+        Args:
+            max_streams: Streams open at once in this process.
+            max_per_client: Streams open at once per client.
+            lifetime: Seconds a stream stays open before the server ends it
+                (used for the Retry-After of a rejected stream).
+        """
+        self.max_streams = max_streams
+        self.max_per_client = max_per_client
+        self.lifetime = lifetime
+        self._open = {}  # client → [start times]
+        self._lock = threading.Lock()
+        self.counters = {"opened": 0, "rejected": 0, "peak_open": 0}
+
+    @contextmanager
+    def hold(self, client):
+        """Keep one stream open for the duration of the block, or raise AdmissionRejected (503)."""
+        now = time.monotonic()
+        with self._lock:
+            mine = self._open.get(client, [])
+            total = sum(len(starts) for starts in self._open.values())
+            if total >= self.max_streams or len(mine) >= self.max_per_client:
+                self.counters["rejected"] += 1
+                # Until the oldest stream in the way reaches the end of its lifetime
+                starts = mine if len(mine) >= self.max_per_client else [t for ts in self._open.values() for t in ts]
+                raise AdmissionRejected(503, "Too many open streams", min(starts) + self.lifetime - now)
+            self._open.setdefault(client, []).append(now)
+            self.counters["opened"] += 1
+            self.counters["peak_open"] = max(self.counters["peak_open"], total + 1)
+        try:
+            yield
+        finally:
+            with self._lock:
+                starts = self._open[client]
+                starts.remove(now)
+                if not starts:
+                    del self._open[client]
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "open": sum(len(starts) for starts in self._open.values()),
+                    "clients": len(self._open),
+                    "limits": {"max_streams": self.max_streams, "max_per_client": self.max_per_client,
+                               "lifetime": self.lifetime}}
+
+
+# ---- Benchmark: legitimate players next to clients hammering the endpoint ----
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def _simulate(controller, clients, abusers, seconds, search_ms, engines, think_s):
+    """Threads standing in for players (one request per think time) and abusers (no pause)."""
+    engine_slots = threading.Semaphore(engines)
+    latencies = {"player": [], "abuser": []}
+    outcomes = {"player": {"ok": 0, "shed": 0}, "abuser": {"ok": 0, "shed": 0}}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def request(client, kind):
+        t0 = time.monotonic()
+        try:
+            if controller is not None:
+                controller.check_quota(client)
+                with controller.slot(), engine_slots:
+                    time.sleep(search_ms / 1000)
+            else:
+                with engine_slots:
+                    time.sleep(search_ms / 1000)
+            outcome = "ok"
+        except AdmissionRejected:
+            outcome = "shed"
+        with lock:
+            outcomes[kind][outcome] += 1
+            if outcome == "ok":
+                latencies[kind].append((time.monotonic() - t0) * 1000)
+        return outcome
+
+    def player(i):
+        while time.monotonic() < stop:
+            request(f"player-{i}", "player")
+            time.sleep(random.uniform(0.5, 1.5) * think_s)
+
+    def abuser(i):
+        while time.monotonic() < stop:
+            if request(f"abuser-{i}", "abuser") == "shed":
+                time.sleep(0.01)
+
+    threads = ([threading.Thread(target=player, args=(i,)) for i in range(clients)]
+               + [threading.Thread(target=abuser, args=(i,)) for i in range(abusers * 8)])
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, outcomes
+
+
+def bench(clients, abusers, seconds, search_ms, engines, think_s, rate, burst):
+    print(f"{clients} players (one search every ~{think_s}s), {abusers} abusive clients × 8 threads, "
+          f"{engines} engines, {search_ms}ms per search, {seconds}s")
+    print(f"{'':18} {'player p50':>11} {'player p99':>11} {'player ok/shed':>15} {'abuser ok/shed':>15}")
+    for label, controller in (
+        ("no admission", None),
+        ("admission", AdmissionController(rate, burst, max_concurrent=engines, queue_timeout=2.0)),
+    ):
+        latencies, outcomes = _simulate(controller, clients, abusers, seconds, search_ms, engines, think_s)
+        p = latencies["player"]
+        print(f"{label:18} {_percentile(p, 50):9.0f}ms {_percentile(p, 99):9.0f}ms "
+              f"{outcomes['player']['ok']:>8}/{outcomes['player']['shed']:<6} "
+              f"{outcomes['abuser']['ok']:>8}/{outcomes['abuser']['shed']:<6}")
+        if controller is not None:
+            s = controller.stats()
+            print(f"{'':18} shed: {s['over_quota']} over quota, {s['queue_full']} queue full, "
+                  f"{s['queue_timeout']} timed out; peak queue {s['peak_waiting']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo admission control tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("bench", help="Player latency with and without admission control, under abuse")
+    b.add_argument("--clients", type=int, default=20, help="Legitimate players (default: 20)")
+    b.add_argument("--abusers", type=int, default=2, help="Clients sending requests in a loop (default: 2)")
+    b.add_argument("--seconds", type=float, default=10, help="Duration of each run (default: 10)")
+    b.add_argument("--search-ms", type=float, default=100, help="Simulated search time (default: 100)")
+    b.add_argument("--engines", type=int, default=4, help="Engines, = concurrent searches (default: 4)")
+    b.add_argument("--think", type=float, default=2.0, help="Seconds between a player's requests (default: 2)")
+    b.add_argument("--rate", type=float, default=1.0, help="Quota: requests per second per client (default: 1)")
+    b.add_argument("--burst", type=int, default=5, help="Quota: burst size per client (default: 5)")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.clients, args.abusers, args.seconds, args.search_ms, args.engines, args.think,
+              args.rate, args.burst)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,8 @@ and classifies "best moves" within 49cp of the top eval.
 Usage:
     python -m src.challenge_builder https://lichess.org/mfJW36UO#14
     python -m src.challenge_builder https://lichess.org/mfJW36UO#14 --depth 18 --engine path/to/stockfish
+    python -m src.challenge_builder https://lichess.org/mfJW36UO#14 https://lichess.org/XXXXXXXX#12
+    python -m src.challenge_builder https://lichess.org/mfJW36UO --moves 10 --target-difficulty 0.6
 """
 
 import argparse
@@ -21,9 +23,16 @@ from pathlib import Path
 import chess
 import chess.engine
 import chess.pgn
-import requests
+
+from src.opening_book import load_book
+from src.positions import PositionCache
+from src.precompressed import write_precompressed
+from src.profiling import NULL_PROFILER, position_label
+from src.scoring import ScoringTable, game_run, score_run
+from src.tablebase import open_tablebase
 
 BEST_MOVE_MARGIN_CP = 49  # Moves within 49cp of the best are "best moves"
+DEPTH_EVALS_FROM = 8      # Per-depth evals are kept from this depth up to the search depth
 
 
 def find_stockfish():
@@ -45,7 +54,7 @@ def find_stockfish():
     return "stockfish"
 
 
-def fetch_game(url: str):
+def fetch_game(url: str, profiler=NULL_PROFILER):
     """Fetch game PGN from Lichess and parse the start ply from the URL."""
     m = re.search(r"lichess\.org/([a-zA-Z0-9]{8})", url)
     if not m:
@@ -56,19 +65,89 @@ def fetch_game(url: str):
     start_ply = int(ply_match.group(1)) if ply_match else 0
 
     api_url = f"https://lichess.org/game/export/{game_id}?evals=false&clocks=false"
-    resp = requests.get(api_url, headers={"Accept": "application/x-chess-pgn"}, timeout=15)
+    import requests
+    with profiler.phase("fetch"):
+        resp = requests.get(api_url, headers={"Accept": "application/x-chess-pgn"}, timeout=15)
     if resp.status_code != 200:
         raise ValueError(f"Lichess API returned {resp.status_code}")
 
-    game = chess.pgn.read_game(StringIO(resp.text))
+    with profiler.phase("parse_pgn"):
+        game = chess.pgn.read_game(StringIO(resp.text))
     if not game:
         raise ValueError("Could not parse PGN")
 
     return game_id, game, start_ply
 
 
-def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26):
-    """Analyze 26 positions for the player's color and return challenge JSON."""
+def search_with_depth_evals(engine, board, depth, from_depth=DEPTH_EVALS_FROM):
+    """
+    Search `board` once to `depth`, recording the score of every completed depth
+    from the engine's info stream.
+
+    Returns:
+        (score, depth_evals): the final relative Score, and a list of relative
+        cp scores (mate = 100000) for depths from_depth..depth. Depths the
+        engine didn't report repeat the previous depth's score.
+    """
+    by_depth = {}
+    with engine.analysis(board, chess.engine.Limit(depth=depth)) as analysis:
+        for info in analysis:
+            # Bound scores come from aspiration-window fail highs/lows, not completed depths
+            if "score" in info and "depth" in info and not info.get("lowerbound") and not info.get("upperbound"):
+                by_depth[info["depth"]] = info["score"].relative.score(mate_score=100000)
+        score = analysis.info["score"].relative
+
+    depth_evals = []
+    last = next((by_depth[d] for d in sorted(by_depth) if d >= from_depth), score.score(mate_score=100000))
+    for d in range(min(from_depth, depth), depth + 1):
+        last = by_depth.get(d, last)
+        depth_evals.append(last)
+    depth_evals[-1] = score.score(mate_score=100000)
+    return score, depth_evals
+
+
+def search_child(engine, board, depth, position_cache):
+    """(relative Score, depth_evals) of the position after a move, searched only if not cached."""
+    relative = position_cache.get("eval", board, depth)
+    depth_evals = position_cache.get("depth_evals", board, depth)
+    if relative is None:
+        relative, depth_evals = search_with_depth_evals(engine, board, depth)
+        position_cache.put("eval", board, depth, relative)
+        position_cache.put("depth_evals", board, depth, depth_evals)
+    return relative, depth_evals
+
+
+def seed_position_cache(position_cache, challenge):
+    """Preload the per-move evals of an already built challenge, so positions it
+    shares with the challenge being built need no engine search."""
+    depth = challenge["engine_depth"]
+    for pos in challenge["positions"]:
+        board = chess.Board(pos["fen"])
+        for m in pos["all_moves"]:
+            board.push_uci(m["uci"])
+            # Stored from the mover's side; the cache holds the child's side-to-move score
+            position_cache.put("eval", board, depth, chess.engine.Cp(-m["eval_cp"]))
+            board.pop()
+
+
+def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26, book=None,
+                    tablebase=None, position_cache=None, engine=None, search_jobs=1, profiler=NULL_PROFILER):
+    """Analyze 26 positions for the player's color and return challenge JSON.
+
+    If an opening book is given, positions it covers at >= depth are taken
+    from the book instead of being searched; likewise endgames the Syzygy
+    tablebase covers are classified exactly. Positions reached by
+    transposition (within the challenge, or across a batch sharing
+    `position_cache`) are searched only once. A running `engine` can be passed
+    in to keep it warm across challenges; otherwise one is started for this call.
+
+    Searched moves also get `depth_evals`: the move's eval at every depth from
+    DEPTH_EVALS_FROM to `depth`, captured from the same search's info stream.
+
+    A src.profiling.Profiler passed as `profiler` times each position's phases.
+    """
+    if position_cache is None:
+        position_cache = PositionCache()
 
     # Walk to the start ply to determine player color and collect the mainline
     board = chess.Board()
@@ -102,91 +181,136 @@ def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26):
         print(f"Warning: only {len(player_move_indices)} player moves available (wanted {num_moves})")
         num_moves = len(player_move_indices)
 
-    engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+    owns_engine = engine is None
+    if owns_engine:
+        with profiler.phase("engine_start"):
+            engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+    # A remote engine (engine worker nodes) runs concurrent searches on different nodes
+    executor = None
+    if search_jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=search_jobs)
     try:
         for pos_idx in range(num_moves):
-            pm_idx = player_move_indices[pos_idx]
-            # Board is at the position *before* the player's move
-            fen_before = board.fen()
-            played_move = remaining[pm_idx]
-
-            legal_moves = list(board.legal_moves)
-            total = len(legal_moves)
-            move_num_display = pos_idx + 1
-            full_move = board.fullmove_number
-            side = "W" if board.turn == chess.WHITE else "B"
-            print(f"\n[{move_num_display}/{num_moves}] Analyzing position (move {full_move}{side}): {total} legal moves ...")
-
-            # Analyze every legal move
-            all_moves = []
-            t0 = time.time()
-            for j, mv in enumerate(legal_moves):
-                board.push(mv)
-                info = engine.analyse(board, chess.engine.Limit(depth=depth))
-                # Score is from the perspective of the side that just moved (player),
-                # but engine reports from the side-to-move perspective. Negate it.
-                raw_score = info["score"].relative.score(mate_score=100000)
-                eval_cp = -raw_score  # negate: positive = good for the player
-                board.pop()
-                all_moves.append({
-                    "uci": mv.uci(),
-                    "san": board.san(mv),
-                    "eval_cp": eval_cp,
+            with profiler.position(position_label(board)):
+                pm_idx = player_move_indices[pos_idx]
+                # Board is at the position *before* the player's move
+                fen_before = board.fen()
+                played_move = remaining[pm_idx]
+
+                legal_moves = list(board.legal_moves)
+                total = len(legal_moves)
+                move_num_display = pos_idx + 1
+                full_move = board.fullmove_number
+                side = "W" if board.turn == chess.WHITE else "B"
+                print(f"\n[{move_num_display}/{num_moves}] Analyzing position (move {full_move}{side}): {total} legal moves ...")
+
+                # Analyze every legal move (or take them from the opening book / tablebase)
+                all_moves = []
+                t0 = time.time()
+                with profiler.phase("book"):
+                    scored_moves = book.lookup(board, depth) if book is not None else None
+                source = "opening book"
+                if scored_moves is None and tablebase is not None:
+                    with profiler.phase("tablebase"):
+                        scored_moves = tablebase.score_moves(board)
+                    source = "tablebase"
+                    if scored_moves is not None:
+                        tablebase.searches_avoided += total
+                if scored_moves is not None:
+                    print(f"  (from {source})")
+                    with profiler.phase("san"):
+                        for entry in scored_moves:
+                            all_moves.append({
+                                "uci": entry["move"].uci(),
+                                "san": board.san(entry["move"]),
+                                "eval_cp": entry["eval_cp"],
+                            })
+                else:
+                    children = []
+                    for mv in legal_moves:
+                        child = board.copy()
+                        child.push(mv)
+                        children.append(child)
+                    base = profiler.current_stack()
+
+                    def search(child):
+                        with profiler.phase("search", under=base):
+                            return search_child(engine, child, depth, position_cache)
+
+                    if executor is not None:
+                        with profiler.phase("wait_searches"):  # this thread, while the searches run
+                            searched = list(executor.map(search, children))
+                    else:
+                        searched = [search(child) for child in children]
+                    with profiler.phase("san"):
+                        entries = [{"uci": mv.uci(), "san": board.san(mv)} for mv in legal_moves]
+                    for entry, (relative, depth_evals) in zip(entries, searched):
+                        # Score is from the perspective of the side that just moved (player),
+                        # but engine reports from the side-to-move perspective. Negate it.
+                        raw_score = relative.score(mate_score=100000)
+                        entry["eval_cp"] = -raw_score  # negate: positive = good for the player
+                        if depth_evals is not None:
+                            # A cached deeper search covers this depth too: keep its first depths only
+                            entry["depth_evals"] = [-v for v in depth_evals[:depth - min(DEPTH_EVALS_FROM, depth) + 1]]
+                        all_moves.append(entry)
+
+                elapsed = time.time() - t0
+                # Sort: best for the player first (highest eval)
+                all_moves.sort(key=lambda x: x["eval_cp"], reverse=True)
+
+                best_eval = all_moves[0]["eval_cp"]
+                best_moves = [m for m in all_moves if (best_eval - m["eval_cp"]) <= BEST_MOVE_MARGIN_CP]
+                best_count = len(best_moves)
+                # Cap display at 3
+                display_count = min(best_count, 3)
+
+                played_san = board.san(played_move)
+                played_among_best = any(m["uci"] == played_move.uci() for m in best_moves)
+                print(f"  {elapsed:.1f}s — best eval: {best_eval}cp, "
+                      f"best moves (within {BEST_MOVE_MARGIN_CP}cp): {best_count}, "
+                      f"played: {played_san} {'✅' if played_among_best else '❌'}")
+                for bm in best_moves[:5]:
+                    marker = " ← played" if bm["san"] == played_san else ""
+                    print(f"    {bm['san']:>8} {bm['eval_cp']:>+6}cp{marker}")
+
+                # Get opponent's reply (if it exists)
+                opp_reply_idx = pm_idx + 1
+                opponent_reply_uci = None
+                opponent_reply_san = None
+                fen_after_opponent = None
+
+                # Push the actually-played move to advance the board
+                board.push(played_move)
+                fen_after_game_move = board.fen()  # position after player's game move, before opponent reply
+
+                if opp_reply_idx < len(remaining):
+                    opp_move = remaining[opp_reply_idx]
+                    opponent_reply_san = board.san(opp_move)
+                    opponent_reply_uci = opp_move.uci()
+                    board.push(opp_move)
+                    fen_after_opponent = board.fen()
+                else:
+                    fen_after_opponent = board.fen()
+
+                positions_data.append({
+                    "move_number": move_num_display,
+                    "fen": fen_before,
+                    "game_move_san": played_san,
+                    "game_move_uci": played_move.uci(),
+                    "best_moves": [{"uci": m["uci"], "san": m["san"], "eval_cp": m["eval_cp"]} for m in best_moves[:3]],
+                    "best_move_count": display_count,
+                    "all_moves": all_moves,
+                    "fen_after_game_move": fen_after_game_move,
+                    "opponent_reply_uci": opponent_reply_uci,
+                    "opponent_reply_san": opponent_reply_san,
+                    "fen_after_opponent": fen_after_opponent,
                 })
-
-            elapsed = time.time() - t0
-            # Sort: best for the player first (highest eval)
-            all_moves.sort(key=lambda x: x["eval_cp"], reverse=True)
-
-            best_eval = all_moves[0]["eval_cp"]
-            best_moves = [m for m in all_moves if (best_eval - m["eval_cp"]) <= BEST_MOVE_MARGIN_CP]
-            best_count = len(best_moves)
-            # Cap display at 3
-            display_count = min(best_count, 3)
-
-            played_san = board.san(played_move)
-            played_among_best = any(m["uci"] == played_move.uci() for m in best_moves)
-            print(f"  {elapsed:.1f}s — best eval: {best_eval}cp, "
-                  f"best moves (within {BEST_MOVE_MARGIN_CP}cp): {best_count}, "
-                  f"played: {played_san} {'✅' if played_among_best else '❌'}")
-            for bm in best_moves[:5]:
-                marker = " ← played" if bm["san"] == played_san else ""
-                print(f"    {bm['san']:>8} {bm['eval_cp']:>+6}cp{marker}")
-
-            # Get opponent's reply (if it exists)
-            opp_reply_idx = pm_idx + 1
-            opponent_reply_uci = None
-            opponent_reply_san = None
-            fen_after_opponent = None
-
-            # Push the actually-played move to advance the board
-            board.push(played_move)
-            fen_after_game_move = board.fen()  # position after player's game move, before opponent reply
-
-            if opp_reply_idx < len(remaining):
-                opp_move = remaining[opp_reply_idx]
-                opponent_reply_san = board.san(opp_move)
-                opponent_reply_uci = opp_move.uci()
-                board.push(opp_move)
-                fen_after_opponent = board.fen()
-            else:
-                fen_after_opponent = board.fen()
-
-            positions_data.append({
-                "move_number": move_num_display,
-                "fen": fen_before,
-                "game_move_san": played_san,
-                "game_move_uci": played_move.uci(),
-                "best_moves": [{"uci": m["uci"], "san": m["san"], "eval_cp": m["eval_cp"]} for m in best_moves[:3]],
-                "best_move_count": display_count,
-                "all_moves": all_moves,
-                "fen_after_game_move": fen_after_game_move,
-                "opponent_reply_uci": opponent_reply_uci,
-                "opponent_reply_san": opponent_reply_san,
-                "fen_after_opponent": fen_after_opponent,
-            })
     finally:
-        engine.quit()
+        if executor is not None:
+            executor.shutdown()
+        if owns_engine:
+            engine.quit()
 
     # Build game metadata
     white_player = game.headers.get("White", "?")
@@ -194,19 +318,10 @@ def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26):
     game_url = f"https://lichess.org/{game_id}"
 
     # Compute the real player's score using the same scoring rules
-    real_player_score = 0
-    real_player_best_count = 0
-    for pos in positions_data:
-        gm_uci = pos["game_move_uci"]
-        best_ucis = [m["uci"] for m in pos["best_moves"]]
-        best_eval = pos["best_moves"][0]["eval_cp"]
-        if gm_uci in best_ucis:
-            real_player_score += 3
-            real_player_best_count += 1
-        else:
-            gm_eval = next((m["eval_cp"] for m in pos["all_moves"] if m["uci"] == gm_uci), 0)
-            penalty = max(0, best_eval - gm_eval) / 100
-            real_player_score -= penalty
+    with profiler.phase("score_run"):
+        real_player = score_run(ScoringTable({"positions": positions_data}), game_run({"positions": positions_data}))
+    real_player_score = real_player["score"]
+    real_player_best_count = real_player["best_count"]
 
     challenge = {
         "game_id": game_id,
@@ -223,6 +338,7 @@ def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26):
         "player_color": color_name,
         "num_moves": num_moves,
         "engine_depth": depth,
+        "depth_evals_from": min(DEPTH_EVALS_FROM, depth),
         "margin_cp": BEST_MOVE_MARGIN_CP,
         "real_player_score": round(real_player_score, 2),
         "real_player_best_count": real_player_best_count,
@@ -231,33 +347,124 @@ def build_challenge(game_id, game, start_ply, engine_path, depth, num_moves=26):
     return challenge
 
 
+def pick_start_ply(difficulty_index, game_id, target, num_moves, position_cache, default):
+    """Start ply closest to the target difficulty, chosen from already profiled positions."""
+    from src.difficulty import suggest_start_plies
+
+    suggestions = suggest_start_plies(difficulty_index, game_id, target, num_moves)
+    if not suggestions:
+        print(f"No profiled window of {num_moves} positions for {game_id}; keeping start ply {default}")
+        return default
+    best = suggestions[0]
+    print(f"Target difficulty {target}: start ply {best['start_ply']} "
+          f"(mean {best['mean_difficulty']:.3f}, from {best['challenge_path']})")
+    # The window lies inside an already built challenge: reuse its evals instead of searching
+    with open(best["challenge_path"], encoding="utf-8") as f:
+        seed_position_cache(position_cache, json.load(f))
+    return best["start_ply"]
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Build a Dr Lupo Live Scoring challenge from a Lichess game")
-    parser.add_argument("url", help="Lichess game URL (with optional #ply)")
+    parser = argparse.ArgumentParser(description="Build Dr Lupo Live Scoring challenges from Lichess games")
+    parser.add_argument("urls", nargs="+", metavar="url", help="Lichess game URL(s) (with optional #ply)")
     parser.add_argument("--depth", type=int, default=18, help="Stockfish depth (default: 18)")
     parser.add_argument("--engine", default=None, help="Path to Stockfish binary")
     parser.add_argument("--moves", type=int, default=26, help="Number of player moves to analyze (default: 26)")
     parser.add_argument("--output", default=None, help="Output JSON path (default: challenges/<id>_ply<N>.json)")
+    parser.add_argument("--book", default=None, help="Opening book path (default: books/opening_book.bin if present)")
+    parser.add_argument("--syzygy", default=None, help="Directory of Syzygy tablebases (default: $SYZYGY_PATH)")
+    parser.add_argument("--target-difficulty", type=float, default=None,
+                        help="Pick the start ply whose next --moves positions are closest to this mean "
+                             "difficulty (0-1), from the difficulty index")
+    parser.add_argument("--workers", default=None, metavar="HOST:PORT,...",
+                        help="Run searches on engine worker nodes (python -m src.engine_worker), "
+                             "every legal move of a position in parallel")
+    parser.add_argument("--difficulty-index", default=None,
+                        help="Difficulty index path (default: data/difficulty_index.json)")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="Time every phase and position; write a collapsed-stack profile (flame graph "
+                             "input) to PATH and print a summary")
     args = parser.parse_args()
 
+    if args.output and len(args.urls) > 1:
+        parser.error("--output can only be used with a single URL")
+
     engine_path = args.engine or find_stockfish()
-    print(f"Using engine: {engine_path}")
+    pool = None
+    if args.workers:
+        from src.engine_worker import RemoteEnginePool
+        pool = RemoteEnginePool(args.workers)
+        print(f"Using engine workers: {args.workers} ({pool.size} engines)")
+    else:
+        print(f"Using engine: {engine_path}")
     print(f"Depth: {args.depth}")
 
-    game_id, game, start_ply = fetch_game(args.url)
-    print(f"Game: {game_id}, start ply: {start_ply}")
+    book = load_book(args.book)
+    if book is not None:
+        print(f"Opening book: {book.path} ({len(book)} entries)")
+
+    tablebase = open_tablebase(args.syzygy)
+    if tablebase is not None:
+        print(f"Syzygy tablebase: {tablebase.path} (up to {tablebase.max_pieces} pieces)")
+
+    # One cache for the whole batch: transpositions across challenges are searched once
+    position_cache = PositionCache()
 
-    challenge = build_challenge(game_id, game, start_ply, engine_path, args.depth, args.moves)
+    difficulty_index = None
+    if args.target_difficulty is not None:
+        from src.difficulty import load_index
+        difficulty_index = load_index(args.difficulty_index)
+        if difficulty_index is None:
+            parser.error("--target-difficulty needs a difficulty index (python -m src.difficulty profile ...)")
 
     out_dir = Path(__file__).resolve().parent.parent / "challenges"
     out_dir.mkdir(exist_ok=True)
-    out_path = Path(args.output) if args.output else out_dir / f"{game_id}_ply{start_ply}.json"
 
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(challenge, f, indent=2, ensure_ascii=False)
+    profiler = NULL_PROFILER
+    if args.profile:
+        from src.profiling import Profiler
+        profiler = Profiler()
 
-    print(f"\n✅ Challenge saved to {out_path}")
-    print(f"   {challenge['num_moves']} positions, {challenge['player_color']} to play")
+    # One engine for the whole batch: startup cost is paid once and the hash stays warm
+    engine = pool.engine if pool is not None else chess.engine.SimpleEngine.popen_uci(engine_path)
+    try:
+        for url in args.urls:
+            with profiler.phase(f"game {url.rsplit('/', 1)[-1]}"):
+                game_id, game, start_ply = fetch_game(url, profiler)
+                if difficulty_index is not None:
+                    start_ply = pick_start_ply(difficulty_index, game_id, args.target_difficulty, args.moves,
+                                               position_cache, default=start_ply)
+                print(f"Game: {game_id}, start ply: {start_ply}")
+
+                challenge = build_challenge(game_id, game, start_ply, engine_path, args.depth, args.moves,
+                                            book=book, tablebase=tablebase, position_cache=position_cache,
+                                            engine=engine, search_jobs=pool.size if pool is not None else 1,
+                                            profiler=profiler)
+
+                out_path = Path(args.output) if args.output else out_dir / f"{game_id}_ply{start_ply}.json"
+
+                with profiler.phase("serialize"), open(out_path, "w", encoding="utf-8") as f:
+                    json.dump(challenge, f, indent=2, ensure_ascii=False)
+                # Encoded once here, so the web app serves the challenge without compressing it
+                with profiler.phase("precompress"):
+                    write_precompressed(out_path)
+
+                print(f"\n✅ Challenge saved to {out_path}")
+                print(f"   {challenge['num_moves']} positions, {challenge['player_color']} to play")
+    finally:
+        engine.quit()
+        if pool is not None:
+            pool.close()
+
+    stats = position_cache.stats()
+    print(f"\nPositions: {stats['unique_positions']} unique, {stats['shared_positions']} shared "
+          f"({stats['hits']}/{stats['lookups']} searches reused)")
+    if tablebase is not None:
+        print(f"Tablebase: {tablebase.searches_avoided} engine searches avoided")
+    if args.profile:
+        profiler.write(args.profile)
+        profiler.print_report(out=sys.stdout)
+        print(f"Profile saved to {args.profile} (flamegraph.pl / speedscope input)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Challenge Upgrade — Raise the depth of built challenges without rebuilding them.
+
+A challenge position's verdict is its best-move set: the moves within the
+margin (49cp) of the top eval. A deeper search only changes that set if some
+move's gap to the best move moves across the margin, so most positions
+(one clear best move, everything else far behind) can keep their evals.
+
+For each position the stored evals decide what to search again:
+
+    uncertain   some move's gap to the best move is within `window` of the
+                margin. The window is widened by how much the two evals
+                still swung over the last depths of their `depth_evals`.
+    candidates  in an uncertain position, the moves that could end up in the
+                best-move set (gap <= margin + window). The others keep their
+                stored eval, which is far below the margin either way.
+
+Candidates are searched best first by stored eval, so the engine's hash is
+filled along the main line before the weaker moves are searched. Upgraded
+files are written atomically (and their .gz/.br variants re-encoded), and
+the report lists every changed verdict and the searches a full rebuild at
+the new depth would have needed.
+
+Usage:
+    python -m src.challenge_upgrade challenges/*.json --depth 24
+    python -m src.challenge_upgrade challenges/mfJW36UO_ply14.json --depth 22 --window 40 --dry-run
+    python -m src.challenge_upgrade challenges/*.json --depth 24 --workers host1:8765,host2:8765
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import chess
+import chess.engine
+
+from src.challenge_builder import BEST_MOVE_MARGIN_CP, DEPTH_EVALS_FROM, find_stockfish, search_child
+from src.positions import PositionCache
+from src.precompressed import write_precompressed
+from src.scoring import ScoringTable, game_run, score_run
+
+DEFAULT_WINDOW_CP = 30  # assumed eval drift between the stored and the new depth
+SWING_DEPTHS = 4        # recent depths of depth_evals used to widen the window
+
+
+def eval_swing(move):
+    """How much a move's eval still moved over its last recorded depths (0 without depth_evals)."""
+    values = move.get("depth_evals") or []
+    recent = values[-SWING_DEPTHS:]
+    return max(recent) - min(recent) if recent else 0
+
+
+def upgrade_candidates(position, margin_cp=BEST_MOVE_MARGIN_CP, window_cp=DEFAULT_WINDOW_CP):
+    """
+    Moves of a position to search again at a greater depth, best first.
+
+    Returns an empty list if no move's gap to the best move is close enough
+    to the margin for a deeper search to change the best-move set.
+    """
+    moves = sorted(position["all_moves"], key=lambda m: m["eval_cp"], reverse=True)
+    best = moves[0]
+    best_swing = eval_swing(best)
+    candidates = []
+    uncertain = False
+    for m in moves:
+        gap = best["eval_cp"] - m["eval_cp"]
+        window = max(window_cp, best_swing + eval_swing(m))
+        if m is not best and abs(gap - margin_cp) <= window:
+            uncertain = True
+        if gap <= margin_cp + window:
+            candidates.append(m)
+    return candidates if uncertain else []
+
+
+def best_move_set(all_moves, margin_cp):
+    best_eval = max(m["eval_cp"] for m in all_moves)
+    return {m["uci"] for m in all_moves if best_eval - m["eval_cp"] <= margin_cp}
+
+
+def classify(position, all_moves, margin_cp):
+    """Re-sort a position's moves and recompute its best moves, as the builder does."""
+    all_moves.sort(key=lambda x: x["eval_cp"], reverse=True)
+    best_eval = all_moves[0]["eval_cp"]
+    best_moves = [m for m in all_moves if (best_eval - m["eval_cp"]) <= margin_cp]
+    position["all_moves"] = all_moves
+    position["best_moves"] = [{"uci": m["uci"], "san": m["san"], "eval_cp": m["eval_cp"]} for m in best_moves[:3]]
+    position["best_move_count"] = min(len(best_moves), 3)
+
+
+def upgrade_challenge(challenge, engine, depth, window_cp=DEFAULT_WINDOW_CP, position_cache=None, executor=None):
+    """
+    Re-search the uncertain positions of a challenge at `depth`, in place.
+
+    Returns:
+        dict: report with searched/skipped counts, engine seconds and the
+        positions whose best-move set changed
+    """
+    if position_cache is None:
+        position_cache = PositionCache()
+    margin_cp = challenge.get("margin_cp", BEST_MOVE_MARGIN_CP)
+    old_depth = challenge["engine_depth"]
+    report = {"from_depth": old_depth, "to_depth": depth, "positions": len(challenge["positions"]),
+              "positions_searched": 0, "searches": 0, "full_rebuild_searches": 0, "search_seconds": 0.0,
+              "changed": []}
+
+    for index, pos in enumerate(challenge["positions"]):
+        report["full_rebuild_searches"] += len(pos["all_moves"])
+        pos.setdefault("engine_depth", old_depth)
+        candidates = upgrade_candidates(pos, margin_cp, window_cp)
+        if not candidates:
+            continue
+
+        board = chess.Board(pos["fen"])
+        children = []
+        for m in candidates:
+            child = board.copy()
+            child.push_uci(m["uci"])
+            children.append(child)
+
+        t0 = time.time()
+        if executor is not None:
+            searched = list(executor.map(lambda child: search_child(engine, child, depth, position_cache), children))
+        else:
+            searched = [search_child(engine, child, depth, position_cache) for child in children]
+        report["search_seconds"] += time.time() - t0
+        report["positions_searched"] += 1
+        report["searches"] += len(candidates)
+
+        before = best_move_set(pos["all_moves"], margin_cp)
+        game_move_was_best = pos.get("game_move_uci") in before
+        upgraded = {}
+        for m, (relative, depth_evals) in zip(candidates, searched):
+            entry = {"uci": m["uci"], "san": m["san"], "eval_cp": -relative.score(mate_score=100000)}
+            if depth_evals is not None:
+                entry["depth_evals"] = [-v for v in depth_evals[:depth - min(DEPTH_EVALS_FROM, depth) + 1]]
+            upgraded[m["uci"]] = entry
+        classify(pos, [upgraded.get(m["uci"], m) for m in pos["all_moves"]], margin_cp)
+        pos["engine_depth"] = depth
+
+        after = best_move_set(pos["all_moves"], margin_cp)
+        if after != before:
+            report["changed"].append({
+                "position": index,
+                "move_number": pos["move_number"],
+                "fen": pos["fen"],
+                "added": sorted(after - before),
+                "removed": sorted(before - after),
+                "game_move_was_best": game_move_was_best,
+                "game_move_is_best": pos.get("game_move_uci") in after,
+            })
+
+    challenge["engine_depth"] = depth
+    challenge["upgraded_from_depth"] = challenge.get("upgraded_from_depth", old_depth)
+    real_player = score_run(ScoringTable(challenge), game_run(challenge))
+    challenge["real_player_score"] = round(real_player["score"], 2)
+    challenge["real_player_best_count"] = real_player["best_count"]
+    report["search_seconds"] = round(report["search_seconds"], 2)
+    return report
+
+
+def write_challenge(path, challenge):
+    """Replace a challenge file atomically, then re-encode its precompressed variants."""
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(challenge, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    write_precompressed(path)
+
+
+def print_report(path, report):
+    print(f"{path}: depth {report['from_depth']} → {report['to_depth']}, "
+          f"{report['positions_searched']}/{report['positions']} positions searched again, "
+          f"{report['searches']}/{report['full_rebuild_searches']} move searches "
+          f"({report['search_seconds']:.1f}s)")
+    for change in report["changed"]:
+        verdict = ""
+        if change["game_move_was_best"] != change["game_move_is_best"]:
+            verdict = f" — game move now {'best' if change['game_move_is_best'] else 'not best'}"
+        print(f"    move {change['move_number']}: +{','.join(change['added']) or '-'} "
+              f"-{','.join(change['removed']) or '-'}{verdict}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade built challenges to a greater depth, searching "
+                                                 "only the positions whose verdict could change")
+    parser.add_argument("challenges", nargs="+", help="Challenge JSON files")
+    parser.add_argument("--depth", type=int, required=True, help="New Stockfish depth")
+    parser.add_argument("--engine", default=None, help="Path to Stockfish binary")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW_CP,
+                        help=f"Eval drift assumed between the depths, in cp (default: {DEFAULT_WINDOW_CP})")
+    parser.add_argument("--workers", default=None, metavar="HOST:PORT,...",
+                        help="Run searches on engine worker nodes (python -m src.engine_worker)")
+    parser.add_argument("--dry-run", action="store_true", help="Search and report, but don't write the files")
+    parser.add_argument("--report", default=None, help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    pool = None
+    executor = None
+    if args.workers:
+        from concurrent.futures import ThreadPoolExecutor
+        from src.engine_worker import RemoteEnginePool
+        pool = RemoteEnginePool(args.workers)
+        executor = ThreadPoolExecutor(max_workers=pool.size)
+        engine = pool.engine
+        print(f"Using engine workers: {args.workers} ({pool.size} engines)")
+    else:
+        engine_path = args.engine or find_stockfish()
+        engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+        print(f"Using engine: {engine_path}")
+
+    # One cache for the whole run: positions shared between challenges are searched once
+    position_cache = PositionCache()
+    reports = {}
+    try:
+        for path in args.challenges:
+            with open(path, encoding="utf-8") as f:
+                challenge = json.load(f)
+            if challenge["engine_depth"] >= args.depth:
+                print(f"{path}: already at depth {challenge['engine_depth']}, skipped")
+                continue
+            report = upgrade_challenge(challenge, engine, args.depth, args.window, position_cache, executor)
+            if not args.dry_run:
+                write_challenge(path, challenge)
+            reports[path] = report
+            print_report(path, report)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        engine.quit()
+        if pool is not None:
+            pool.close()
+
+    searches = sum(r["searches"] for r in reports.values())
+    full = sum(r["full_rebuild_searches"] for r in reports.values())
+    seconds = sum(r["search_seconds"] for r in reports.values())
+    changed = sum(len(r["changed"]) for r in reports.values())
+    print(f"\n{len(reports)} challenge(s) upgraded{' (dry run, nothing written)' if args.dry_run else ''}: "
+          f"{changed} verdict(s) changed")
+    if full:
+        saved = full - searches
+        estimate = f", ~{seconds / searches * saved:.0f}s at this run's pace" if searches else ""
+        print(f"Searched {searches}/{full} moves: {saved} searches saved ({saved / full:.0%}){estimate}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Difficulty — Per-position difficulty profile computed from stored challenge evals.
+
+Every challenge position already carries the eval of each legal move, so how
+hard a position is can be measured without another engine search:
+
+    best_count       moves within the margin of the best move (1 = only move)
+    gap_cp           eval gap between the best and the second-best move
+    game_loss_cp     how much the move actually played in the game gave up
+    emergence_depth  shallowest depth from which the best move stays on top
+                     (needs the builder's per-depth `depth_evals`)
+
+These are combined into a difficulty score in [0, 1]:
+
+    0.5 * 1 / best_count  +  0.3 * min(gap_cp, 300) / 300  +  0.2 * emergence
+
+where emergence is the emergence depth scaled to 0 (top from the first
+recorded depth) .. 1 (only at the final depth). Positions without per-depth
+evals use 0.6 * 1 / best_count + 0.4 * min(gap_cp, 300) / 300.
+
+The profiler loads every position of every challenge into padded NumPy
+arrays (positions × moves) and computes the features in one vectorized pass,
+then writes a per-position index. From the index, start plies can be chosen
+by target difficulty (a window of consecutive positions whose mean is
+closest to the target) without searching anything.
+
+Usage:
+    python -m src.difficulty profile challenges/*.json
+    python -m src.difficulty suggest mfJW36UO --target 0.6 --moves 10
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_MARGIN_CP = 49
+DEFAULT_INDEX_PATH = Path(__file__).resolve().parent.parent / "data" / "difficulty_index.json"
+
+GAP_CAP_CP = 300       # gaps beyond this are all "only move" territory
+EVAL_CLIP_CP = 2000    # mate scores are clipped so they don't swamp the gaps
+WEIGHT_ONLY = 0.6
+WEIGHT_GAP = 0.4
+# With per-depth evals available
+WEIGHT_ONLY_DEPTH = 0.5
+WEIGHT_GAP_DEPTH = 0.3
+WEIGHT_EMERGENCE = 0.2
+
+
+def eval_matrix(positions):
+    """
+    Pad the positions' evals into one array.
+
+    Returns:
+        (evals, counts): evals is float[P, M] sorted best first per row, padded
+        with NaN; counts is int[P], the number of legal moves per position.
+    """
+    counts = np.array([len(p["all_moves"]) for p in positions], dtype=np.int32)
+    width = max(int(counts.max()) if len(counts) else 0, 2)
+    evals = np.full((len(positions), width), np.nan)
+    for i, p in enumerate(positions):
+        evals[i, :counts[i]] = [m["eval_cp"] for m in p["all_moves"]]
+    evals = np.clip(evals, -EVAL_CLIP_CP, EVAL_CLIP_CP)
+    # Sort descending with the NaN padding kept at the end of each row
+    evals = -np.sort(np.where(np.isnan(evals), np.inf, -evals), axis=1)
+    evals[np.isinf(evals)] = np.nan
+    return evals, counts
+
+
+def depth_tensor(positions, from_depths, final_depths):
+    """
+    Per-depth evals of every move, aligned by absolute depth.
+
+    Returns:
+        float[P, M, D+1] indexed [position, move, depth], NaN where no eval was
+        recorded. Moves are in stored order (all_moves is sorted best first).
+    """
+    width = max(max(len(p["all_moves"]) for p in positions), 2)
+    max_depth = int(max(final_depths))
+    curves = np.full((len(positions), width, max_depth + 1), np.nan)
+    for i, p in enumerate(positions):
+        lo = int(from_depths[i])
+        for j, m in enumerate(p["all_moves"]):
+            values = m.get("depth_evals")
+            if values:
+                curves[i, j, lo:lo + len(values)] = values
+    return np.clip(curves, -EVAL_CLIP_CP, EVAL_CLIP_CP)
+
+
+def emergence_depths(positions, from_depths, final_depths):
+    """
+    Shallowest depth from which each position's best move is (and stays) the
+    top choice. NaN for positions whose moves lack per-depth evals, or whose
+    best move's curve stops short of the position's final depth (an upgrade
+    that didn't re-search it would otherwise leave a NaN gap that reads as
+    "never on top").
+    """
+    curves = depth_tensor(positions, from_depths, final_depths)
+    counts = np.array([len(p["all_moves"]) for p in positions])
+    moves_mask = np.arange(curves.shape[1])[None, :] < counts[:, None]
+    recorded = ~np.isnan(curves)
+    complete = np.all(recorded.any(axis=2) | ~moves_mask, axis=1)  # every legal move has a curve
+    reaches_final = recorded[np.arange(len(positions)), 0, final_depths.astype(int)]
+    complete &= reaches_final
+
+    top = np.nanmax(np.where(recorded, curves, -np.inf), axis=1)  # [P, D]
+    is_top = curves[:, 0, :] >= top                               # best move on top at depth d
+    depths = np.arange(curves.shape[2])[None, :]
+    in_range = (depths >= from_depths[:, None]) & (depths <= final_depths[:, None])
+    is_top = is_top | ~in_range
+    # stays[d]: on top at d and at every deeper depth
+    stays = np.flip(np.logical_and.accumulate(np.flip(is_top, axis=1), axis=1), axis=1)
+    emergence = np.maximum(np.argmax(stays & in_range, axis=1), from_depths)
+    return np.where(complete, emergence, np.nan)
+
+
+def position_features(positions, margin_cp=DEFAULT_MARGIN_CP, from_depths=None, final_depths=None):
+    """
+    Vectorized difficulty features for a list of challenge positions.
+
+    `from_depths` / `final_depths` give each position's per-depth eval range
+    (the challenge's depth_evals_from and the position's engine_depth, which
+    challenge_upgrade only raises for re-searched positions); without them
+    the emergence depth is not computed.
+
+    Returns:
+        dict of arrays (one entry per position): best_count, gap_cp,
+        game_loss_cp, emergence_depth, difficulty.
+    """
+    evals, counts = eval_matrix(positions)
+    best = evals[:, 0]
+
+    best_count = np.sum(best[:, None] - evals <= margin_cp, axis=1)  # NaN compares False
+    second = np.where(counts > 1, evals[:, 1], best - GAP_CAP_CP)  # a single legal move is forced
+    gap = best - second
+
+    game_evals = np.array([
+        next((m["eval_cp"] for m in p["all_moves"] if m["uci"] == p.get("game_move_uci")), np.nan)
+        for p in positions])
+    game_loss = best - np.clip(game_evals, -EVAL_CLIP_CP, EVAL_CLIP_CP)
+
+    only = 1.0 / np.maximum(best_count, 1)
+    sharpness = np.minimum(gap, GAP_CAP_CP) / GAP_CAP_CP
+    difficulty = WEIGHT_ONLY * only + WEIGHT_GAP * sharpness
+
+    emergence = np.full(len(positions), np.nan)
+    if from_depths is not None and final_depths is not None:
+        from_depths = np.asarray(from_depths)
+        final_depths = np.asarray(final_depths)
+        emergence = emergence_depths(positions, from_depths, final_depths)
+        span = np.maximum(final_depths - from_depths, 1)
+        scaled = (emergence - from_depths) / span
+        difficulty = np.where(
+            np.isnan(emergence), difficulty,
+            WEIGHT_ONLY_DEPTH * only + WEIGHT_GAP_DEPTH * sharpness + WEIGHT_EMERGENCE * np.nan_to_num(scaled))
+    return {
+        "best_count": best_count,
+        "gap_cp": gap,
+        "game_loss_cp": game_loss,
+        "emergence_depth": emergence,
+        "difficulty": difficulty,
+    }
+
+
+def profile_challenges(paths, margin_cp=DEFAULT_MARGIN_CP):
+    """Profile every position of the given challenge files. Returns the index dict."""
+    challenges = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            challenges.append((Path(path), json.load(f)))
+
+    positions = [p for _, c in challenges for p in c["positions"]]
+    if not positions:
+        return {"margin_cp": margin_cp, "positions": []}
+    from_depths = [c.get("depth_evals_from", c["engine_depth"]) for _, c in challenges for _ in c["positions"]]
+    # Upgraded challenges raise engine_depth, but only re-searched positions have curves that deep
+    final_depths = [p.get("engine_depth", c["engine_depth"]) for _, c in challenges for p in c["positions"]]
+    features = position_features(positions, margin_cp, from_depths, final_depths)
+
+    entries = []
+    i = 0
+    for path, challenge in challenges:
+        for index, pos in enumerate(challenge["positions"]):
+            entry = {
+                "challenge_id": path.stem,
+                "challenge_path": str(path),
+                "game_id": challenge["game_id"],
+                "position": index,
+                "ply": challenge["start_ply"] + 2 * index,
+                "fen": pos["fen"],
+            }
+            for name, values in features.items():
+                value = values[i]
+                if np.issubdtype(values.dtype, np.integer):
+                    entry[name] = int(value)
+                else:
+                    entry[name] = None if np.isnan(value) else round(float(value), 4)
+            entries.append(entry)
+            i += 1
+    return {"margin_cp": margin_cp, "positions": entries}
+
+
+def write_index(index, path=None):
+    path = Path(path or DEFAULT_INDEX_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_index(path=None):
+    """Load a difficulty index, or None if there is none."""
+    path = Path(path or DEFAULT_INDEX_PATH)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def suggest_start_plies(index, game_id, target, num_moves):
+    """
+    Rank start plies of a profiled game by how close the mean difficulty of the
+    next `num_moves` positions is to `target`.
+
+    Returns:
+        list: [{"start_ply", "challenge_path", "mean_difficulty", "distance"}],
+        closest first. Windows never extend past the profiled positions.
+    """
+    by_challenge = {}
+    for e in index["positions"]:
+        if e["game_id"] == game_id:
+            by_challenge.setdefault(e["challenge_path"], []).append(e)
+
+    suggestions = []
+    for challenge_path, entries in by_challenge.items():
+        entries.sort(key=lambda e: e["position"])
+        if len(entries) < num_moves:
+            continue
+        difficulty = np.array([e["difficulty"] for e in entries])
+        # Mean of every window of num_moves consecutive positions, via a cumulative sum
+        sums = np.concatenate(([0.0], np.cumsum(difficulty)))
+        means = (sums[num_moves:] - sums[:-num_moves]) / num_moves
+        for offset, mean in enumerate(means):
+            suggestions.append({
+                "start_ply": entries[offset]["ply"],
+                "challenge_path": challenge_path,
+                "mean_difficulty": round(float(mean), 4),
+                "distance": round(abs(float(mean) - target), 4),
+            })
+    suggestions.sort(key=lambda s: (s["distance"], s["start_ply"]))
+    return suggestions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo position difficulty profiler")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    profile = sub.add_parser("profile", help="Profile challenge positions and write the index")
+    profile.add_argument("challenges", nargs="+", help="Challenge JSON files")
+    profile.add_argument("--margin", type=int, default=DEFAULT_MARGIN_CP,
+                         help=f"Best-move margin in cp (default: {DEFAULT_MARGIN_CP})")
+    profile.add_argument("--output", default=None, help=f"Index path (default: {DEFAULT_INDEX_PATH})")
+
+    suggest = sub.add_parser("suggest", help="Suggest start plies for a target difficulty")
+    suggest.add_argument("game_id", help="Lichess game ID")
+    suggest.add_argument("--target", type=float, required=True, help="Target mean difficulty (0-1)")
+    suggest.add_argument("--moves", type=int, default=10, help="Positions per challenge (default: 10)")
+    suggest.add_argument("--index", default=None, help=f"Index path (default: {DEFAULT_INDEX_PATH})")
+    suggest.add_argument("--top", type=int, default=5, help="Number of suggestions (default: 5)")
+    args = parser.parse_args()
+
+    if args.command == "profile":
+        index = profile_challenges(args.challenges, args.margin)
+        path = write_index(index, args.output)
+        positions = index["positions"]
+        print(f"Profiled {len(positions)} positions from {len(args.challenges)} challenge(s) → {path}")
+        if positions:
+            difficulty = np.array([p["difficulty"] for p in positions])
+            print(f"Difficulty: mean {difficulty.mean():.3f}, "
+                  f"p10 {np.percentile(difficulty, 10):.3f}, p90 {np.percentile(difficulty, 90):.3f}")
+            hardest = max(positions, key=lambda p: p["difficulty"])
+            print(f"Hardest:    {hardest['challenge_id']} #{hardest['position'] + 1} "
+                  f"({hardest['difficulty']:.3f}, {hardest['best_count']} best, gap {hardest['gap_cp']:.0f}cp)")
+    elif args.command == "suggest":
+        index = load_index(args.index)
+        if index is None:
+            print("No difficulty index — run `python -m src.difficulty profile` first", file=sys.stderr)
+            return 1
+        suggestions = suggest_start_plies(index, args.game_id, args.target, args.moves)
+        if not suggestions:
+            print(f"No profiled window of {args.moves} positions for {args.game_id}", file=sys.stderr)
+            return 1
+        for s in suggestions[:args.top]:
+            print(f"ply {s['start_ply']:>3}  mean difficulty {s['mean_difficulty']:.3f}  ({s['challenge_path']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
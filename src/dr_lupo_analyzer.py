@@ -8,22 +8,44 @@ Analyzes a Lichess game to determine if the player has completed the Dr Lupo Cha
 """
 
 import argparse
+import json
 import re
 import sys
+import threading
 import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 from io import StringIO
 
 import chess
-import chess.engine
-import chess.pgn
-import requests
+
+# chess.engine, chess.pgn and requests are imported where they are used, so that
+# `--help`, the web app's JSON routes and worker boot don't pay for them
+from src.opening_book import load_book
+from src.positions import PositionCache
+from src.profiling import NULL_PROFILER, position_label
+from src.tablebase import open_tablebase
+
+# Ways to score a played move outside the top 5 (see DrLupoAnalyzer._played_move_score)
+FALLBACK_SEARCHES = ("root", "child")
 
 
 class DrLupoAnalyzer:
-    """Analyzer for the Dr Lupo Challenge."""
+    """Analyzer for the Dr Lupo Challenge.
+
+    By default each analysis starts and quits its own Stockfish process. To keep
+    engines warm across analyses, inject a long-lived `engine` or an EnginePool
+    `pool`, or use the analyzer as a context manager:
 
-    def __init__(self, engine_path=None, engine_depth=16, margin_cp=25):
+        with DrLupoAnalyzer(engine_depth=16) as analyzer:
+            for url in urls:
+                analyzer.analyze_game(url)
+    """
+
+    def __init__(self, engine_path=None, engine_depth=16, margin_cp=25, book_path=None, book=None,
+                 tablebase_path=None, tablebase=None, position_cache=None, engine=None, pool=None,
+                 move_workers=None, fallback_search="root", profiler=None):
         """
         Initialize the analyzer.
         
@@ -31,12 +53,91 @@ class DrLupoAnalyzer:
             engine_path: Path to Stockfish engine. If None, will try to find it.
             engine_depth: Engine analysis depth.
             margin_cp: Margin of error in centipawns (default: 25).
+            book_path: Path to an opening book. If None, the default book is used when present.
+            book: An open OpeningBook shared with the caller; it is never closed by the
+                analyzer, and book_path is ignored.
+            tablebase_path: Directory of Syzygy tables. If None, $SYZYGY_PATH is used when set.
+            tablebase: An open Tablebase shared with the caller (e.g. the web app's); it is
+                never closed by the analyzer, and tablebase_path is ignored.
+            position_cache: PositionCache shared with other analyzers. If None, a private one is used.
+            engine: A running engine owned by the caller; it is never quit by the analyzer.
+            pool: An EnginePool to borrow an engine from for each game.
+            move_workers: Pool engines one game's moves are spread over (default: the pool size).
+            fallback_search: How a played move outside the top 5 is scored: "root" searches
+                only that move from the same root (searchmoves); "child" searches the
+                position after it, as a separate search.
+            profiler: A src.profiling.Profiler to time phases and positions with.
         """
         self.engine_path = engine_path or self._find_stockfish()
         self.engine_depth = engine_depth
         self.margin_cp = margin_cp  # Already in centipawns
-        self.engine = None
+        self.engine = engine
+        self.pool = pool
+        self.move_workers = move_workers or (pool.size if pool is not None else 1)
+        if fallback_search not in FALLBACK_SEARCHES:
+            raise ValueError(f"fallback_search must be one of {FALLBACK_SEARCHES}")
+        self.fallback_search = fallback_search
+        # Engine time per search type (top-5 and fallback), summed over every game
+        self.search_stats = {f"{kind}_{field}": 0 for kind in ("top5", "fallback")
+                             for field in ("searches", "seconds", "nodes")}
+        self._stats_lock = threading.Lock()
+        self.profiler = profiler or NULL_PROFILER
+        self._owns_engine = False
+        self._owns_book = book is None
+        self.book = book if book is not None else load_book(book_path)
+        self._owns_tablebase = tablebase is None
+        self.tablebase = tablebase if tablebase is not None else open_tablebase(tablebase_path)
+        # Lookups answered by this analyzer (a shared book or tablebase counts every analyzer's)
+        self._book_hits = 0
+        self._tb_avoided = 0
+        self.position_cache = position_cache if position_cache is not None else PositionCache()
     
+    def __enter__(self):
+        """Start a private engine that stays alive until the analyzer is closed."""
+        if self.engine is None and self.pool is None:
+            import chess.engine
+            self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+            self._owns_engine = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Quit the engine and close the book and tablebase if this analyzer opened them."""
+        if self._owns_engine and self.engine:
+            self.engine.quit()
+        if self._owns_engine:
+            self.engine = None
+            self._owns_engine = False
+        if self._owns_book and self.book is not None:
+            self.book.close()
+            self.book = None
+        if self._owns_tablebase and self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
+
+    @contextmanager
+    def _engine_session(self):
+        """Make self.engine available for one game: injected, pooled, or started just for it."""
+        if self.engine is not None:
+            yield self.engine
+        elif self.pool is not None:
+            with self.pool.acquire() as engine:
+                self.engine = engine
+                try:
+                    yield engine
+                finally:
+                    self.engine = None
+        else:
+            import chess.engine
+            self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+            try:
+                yield self.engine
+            finally:
+                self.engine.quit()
+                self.engine = None
+
     def _find_stockfish(self):
         """Try to find Stockfish on the system."""
         # Common paths for Stockfish
@@ -66,7 +167,8 @@ class DrLupoAnalyzer:
         """Fetch game PGN from Lichess API."""
         url = f"https://lichess.org/game/export/{game_id}?evals=false&clocks=false"
         headers = {"Accept": "application/x-chess-pgn"}
-        
+
+        import requests
         response = requests.get(url, headers=headers)
         if response.status_code != 200:
             raise ValueError(f"Failed to fetch game: {response.status_code}")
@@ -126,57 +228,82 @@ class DrLupoAnalyzer:
         
         return False, None, None, None, None
     
-    def _analyze_move(self, board, played_move):
+    def _analyze_move(self, board, played_move, engine=None):
         """
         Analyze a position and determine if the played move was the best move.
         
         Args:
             board: Chess position to analyze
             played_move: The move that was played
+            engine: Engine to search with (default: self.engine)
             
         Returns:
             tuple: (is_best, best_move, score_diff, played_move_rank, all_top_moves)
         """
-        # Get the top moves from the engine
-        result = self.engine.analyse(
-            board, 
-            chess.engine.Limit(depth=self.engine_depth),
-            multipv=5  # Get top 5 moves for better context
-        )
+        import chess.engine
+
+        engine = engine or self.engine
+
+        # Early positions are usually in the opening book — no search needed
+        if self.book is not None:
+            with self.profiler.phase("book"):
+                book_moves = self.book.lookup(board, self.engine_depth, mate_score=10000)
+            if book_moves is not None:
+                with self._stats_lock:
+                    self._book_hits += 1
+                return self._verdict_from_scores(board, played_move, book_moves)
+
+        # Simplified endgames are answered exactly by the tablebase
+        if self.tablebase is not None:
+            with self.profiler.phase("tablebase"):
+                tb_moves = self.tablebase.score_moves(board)
+            if tb_moves is not None:
+                self.tablebase.searches_avoided += 1
+                with self._stats_lock:
+                    self._tb_avoided += 1
+                return self._verdict_from_scores(board, played_move, tb_moves)
+
+        # Get the top moves from the engine (positions reached by transposition are searched once)
+        result = self.position_cache.get("multipv5", board, self.engine_depth)
+        if result is None:
+            infos = self._timed_analyse(
+                "top5", engine, board,
+                chess.engine.Limit(depth=self.engine_depth),
+                multipv=5  # Get top 5 moves for better context
+            )
+            result = [(info["pv"][0], info["score"].relative) for info in infos]
+            self.position_cache.put("multipv5", board, self.engine_depth, result)
         
         # Get the best move and its score
-        best_move = result[0]["pv"][0]
-        best_score = result[0]["score"].relative.score(mate_score=10000)
+        best_move = result[0][0]
+        best_score = result[0][1].score(mate_score=10000)
         
         # Find the evaluation and rank of the played move
         played_score = None
         played_move_rank = None
         all_top_moves = []
         
-        for i, analysis in enumerate(result):
-            move = analysis["pv"][0]
-            score = analysis["score"].relative.score(mate_score=10000)
-            move_san = board.san(move)
-            
-            all_top_moves.append({
-                "move": move_san,
-                "score": score,
-                "rank": i + 1
-            })
-            
-            if move == played_move:
-                played_score = score
-                played_move_rank = i + 1
+        with self.profiler.phase("san"):
+            for i, (move, relative_score) in enumerate(result):
+                score = relative_score.score(mate_score=10000)
+                move_san = board.san(move)
+
+                all_top_moves.append({
+                    "move": move_san,
+                    "score": score,
+                    "rank": i + 1
+                })
+
+                if move == played_move:
+                    played_score = score
+                    played_move_rank = i + 1
         
         # If we couldn't find the played move in the top moves, analyze it directly
         if played_score is None:
-            board_copy = board.copy()
-            board_copy.push(played_move)
-            played_result = self.engine.analyse(
-                board_copy,
-                chess.engine.Limit(depth=self.engine_depth)
-            )
-            played_score = -played_result["score"].relative.score(mate_score=10000)
+            played_score = self._played_move_score(engine, board, played_move)
+            if self.fallback_search == "root":
+                # It wasn't among the top moves, so it can't score above the last of them
+                played_score = min(played_score, all_top_moves[-1]["score"])
             played_move_rank = len(result) + 1  # Rank it below the analyzed top moves
             
             # Add the played move to the list
@@ -193,7 +320,161 @@ class DrLupoAnalyzer:
         is_best = abs(score_diff) <= self.margin_cp
         
         return is_best, best_move, score_diff, played_move_rank, all_top_moves
+
+    def _played_move_score(self, engine, board, played_move):
+        """Score (mover's side) of a played move that isn't in the multipv=5 list."""
+        import chess.engine
+
+        limit = chess.engine.Limit(depth=self.engine_depth)
+        board_copy = board.copy()
+        board_copy.push(played_move)
+        if self.fallback_search == "child":
+            child_score = self.position_cache.get("eval", board_copy, self.engine_depth)
+            if child_score is None:
+                played_result = self._timed_analyse("fallback", engine, board_copy, limit)
+                child_score = played_result["score"].relative
+                self.position_cache.put("eval", board_copy, self.engine_depth, child_score)
+            return -child_score.score(mate_score=10000)
+
+        # Search only the played move from the same root, at the same depth as the top 5.
+        # Cached under the position it leads to, holding the root's score.
+        root_score = self.position_cache.get("root_move", board_copy, self.engine_depth)
+        if root_score is None:
+            played_result = self._timed_analyse("fallback", engine, board, limit, root_moves=[played_move])
+            root_score = played_result["score"].relative
+            self.position_cache.put("root_move", board_copy, self.engine_depth, root_score)
+        return root_score.score(mate_score=10000)
+
+    def _timed_analyse(self, kind, engine, board, limit, **kwargs):
+        """engine.analyse, with its time and nodes added to search_stats ("top5" or "fallback")."""
+        with self.profiler.phase(f"search_{kind}"):
+            t0 = time.perf_counter()
+            result = engine.analyse(board, limit, **kwargs)
+            elapsed = time.perf_counter() - t0
+        info = result[0] if isinstance(result, list) else result
+        with self._stats_lock:
+            self.search_stats[f"{kind}_searches"] += 1
+            self.search_stats[f"{kind}_seconds"] += elapsed
+            self.search_stats[f"{kind}_nodes"] += info.get("nodes", 0)
+        return result
+
+    def _verdict_from_scores(self, board, played_move, scored_moves):
+        """Build the _analyze_move result from precomputed evals (book or tablebase),
+        mirroring the multipv=5 output. `scored_moves` covers every legal move, best first."""
+        best_move = scored_moves[0]["move"]
+        best_score = scored_moves[0]["eval_cp"]
+
+        all_top_moves = []
+        played_score = None
+        played_move_rank = None
+        for i, entry in enumerate(scored_moves[:5]):
+            all_top_moves.append({
+                "move": board.san(entry["move"]),
+                "score": entry["eval_cp"],
+                "rank": i + 1
+            })
+            if entry["move"] == played_move:
+                played_score = entry["eval_cp"]
+                played_move_rank = i + 1
+
+        if played_score is None:
+            played_score = next(e["eval_cp"] for e in scored_moves if e["move"] == played_move)
+            played_move_rank = len(all_top_moves) + 1
+            all_top_moves.append({
+                "move": board.san(played_move),
+                "score": played_score,
+                "rank": played_move_rank
+            })
+
+        score_diff = best_score - played_score
+        is_best = abs(score_diff) <= self.margin_cp
+        return is_best, best_move, score_diff, played_move_rank, all_top_moves
     
+    def _collect_targets(self, game, player_color, start_move, moves_to_analyze):
+        """
+        The positions before each of the player's moves after the sacrifice, in
+        move order. They are fixed once the game is parsed, so they can all be
+        analyzed independently.
+
+        Returns:
+            list: (board before the move, move) pairs, at most `moves_to_analyze`
+        """
+        # Start fresh with a new board
+        board = chess.Board()
+        targets = []
+        current_move = 1
+        sacrifice_reached = False
+
+        # Play through the game and collect the positions after the sacrifice
+        for node in game.mainline():
+            # Get the move
+            move = node.move
+
+            # Check if the move is legal
+            if not move in board.legal_moves:
+                print(f"Warning: Illegal move {board.san(move)} in position {board.fen()}")
+                continue
+
+            # Make the move on our board
+            board.push(move)
+
+            # Update move counter (increment after White's move)
+            if board.turn == chess.WHITE:
+                current_move += 1
+
+            # Skip past the sacrifice move (use > to exclude the sacrifice itself)
+            if current_move > start_move and not sacrifice_reached:
+                sacrifice_reached = True
+                continue
+
+            # Moves BY the player who sacrificed (board.turn != player means player just moved)
+            if sacrifice_reached and board.turn != player_color and len(targets) < moves_to_analyze:
+                # Get the position before the player's move
+                prev_board = board.copy()
+                prev_board.pop()  # Remove the last move
+                targets.append((prev_board, move))
+
+            # Check if the game ended prematurely
+            if board.is_game_over():
+                break
+
+            # Stop if we've collected enough moves
+            if len(targets) >= moves_to_analyze:
+                break
+
+        return targets
+
+    def _analyze_targets(self, targets):
+        """
+        Run _analyze_move on every target. With a pool, the positions are spread
+        over up to `move_workers` of its engines; verdicts come back in move order.
+        """
+        workers = min(self.move_workers, len(targets))
+        if self.engine is None and self.pool is not None and workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            base = self.profiler.current_stack()
+
+            def analyze(target):
+                board, move = target
+                with self.profiler.position(position_label(board), under=base), ExitStack() as stack:
+                    with self.profiler.phase("acquire_engine"):
+                        engine = stack.enter_context(self.pool.acquire())
+                    return self._analyze_move(board, move, engine=engine)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(analyze, targets))
+
+        # Borrow one engine for this game (started here only if none is injected or pooled)
+        with ExitStack() as stack:
+            with self.profiler.phase("acquire_engine"):
+                stack.enter_context(self._engine_session())
+            verdicts = []
+            for board, move in targets:
+                with self.profiler.position(position_label(board)):
+                    verdicts.append(self._analyze_move(board, move))
+            return verdicts
+
     def analyze_moves_after_sacrifice(self, game, player_color, start_move):
         """
         Analyze the 26 moves after the queen sacrifice.
@@ -206,106 +487,58 @@ class DrLupoAnalyzer:
         Returns:
             dict: Analysis results
         """
-        # Start fresh with a new board
-        board = chess.Board()
-        move_count = 0
+        moves_to_analyze = 26
+        book_hits_at_start = self._book_hits
+        tb_avoided_at_start = self._tb_avoided
+
+        with self.profiler.phase("collect_targets"):
+            targets = self._collect_targets(game, player_color, start_move, moves_to_analyze)
+        with self.profiler.phase("analyze_moves"):
+            verdicts = self._analyze_targets(targets)
+
+        # Streaks depend on move order, so they are counted only once every verdict is in
         best_move_count = 0
         current_streak = 0
         max_streak = 0
         analysis_results = []
-        current_move = 1
-        sacrifice_reached = False
-        moves_to_analyze = 26
-        
-        # Initialize the engine
-        self.engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
-        
-        try:
-            # Play through the game and analyze after the sacrifice
-            for node in game.mainline():
-                # Get the move
-                move = node.move
-                
-                # Check if the move is legal
-                if not move in board.legal_moves:
-                    print(f"Warning: Illegal move {board.san(move)} in position {board.fen()}")
-                    continue
-                
-                # Make the move on our board
-                board.push(move)
-                
-                # Update move counter (increment after White's move)
-                if board.turn == chess.WHITE:
-                    current_move += 1
-                
-                # Skip past the sacrifice move (use > to exclude the sacrifice itself)
-                if current_move > start_move and not sacrifice_reached:
-                    sacrifice_reached = True
-                    continue
-                
-                # Analyze moves BY the player who sacrificed (board.turn != player means player just moved)
-                if sacrifice_reached and board.turn != player_color:
-                    # Before the player's next move, check if we should analyze their previous move
-                    if move_count < moves_to_analyze:
-                        # Get the position before the player's move
-                        prev_board = board.copy()
-                        prev_board.pop()  # Remove the last move
-                        
-                        # Find the move the player made and analyze it
-                        for legal_move in prev_board.legal_moves:
-                            if legal_move == move:
-                                is_best, best_move, score_diff, move_rank, top_moves = self._analyze_move(prev_board, move)
-                                
-                                # Track stats
-                                if is_best:
-                                    best_move_count += 1
-                                    current_streak += 1
-                                    max_streak = max(max_streak, current_streak)
-                                else:
-                                    current_streak = 0
-                                
-                                # Save analysis with detailed move info
-                                analysis_results.append({
-                                    "move_number": prev_board.fullmove_number,
-                                    "move": prev_board.san(move),
-                                    "is_best": is_best,
-                                    "best_move": prev_board.san(best_move) if best_move else None,
-                                    "score_diff": score_diff,
-                                    "move_rank": move_rank,
-                                    "top_moves": top_moves
-                                })
-                                
-                                move_count += 1
-                                break
-                
-                # Check if the game ended prematurely
-                if board.is_game_over():
-                    break
-                
-                # Stop if we've analyzed enough moves
-                if move_count >= moves_to_analyze:
-                    break
-            
-            # Calculate accuracy
-            accuracy = (best_move_count / min(move_count, moves_to_analyze)) * 100 if move_count > 0 else 0
-            
-            # Check if the challenge was completed
-            challenge_completed = best_move_count == moves_to_analyze and move_count >= moves_to_analyze
-            
-            return {
-                "challenge_completed": challenge_completed,
-                "accuracy": accuracy,
-                "best_moves": best_move_count,
-                "total_moves_analyzed": move_count,
-                "max_consecutive_best": max_streak,
-                "move_analysis": analysis_results
-            }
-            
-        finally:
-            # Always close the engine
-            if self.engine:
-                self.engine.quit()
-                self.engine = None
+        with self.profiler.phase("san"):
+            for (prev_board, move), (is_best, best_move, score_diff, move_rank, top_moves) in zip(targets, verdicts):
+                # Track stats
+                if is_best:
+                    best_move_count += 1
+                    current_streak += 1
+                    max_streak = max(max_streak, current_streak)
+                else:
+                    current_streak = 0
+
+                # Save analysis with detailed move info
+                analysis_results.append({
+                    "move_number": prev_board.fullmove_number,
+                    "move": prev_board.san(move),
+                    "is_best": is_best,
+                    "best_move": prev_board.san(best_move) if best_move else None,
+                    "score_diff": score_diff,
+                    "move_rank": move_rank,
+                    "top_moves": top_moves
+                })
+        move_count = len(analysis_results)
+
+        # Calculate accuracy
+        accuracy = (best_move_count / min(move_count, moves_to_analyze)) * 100 if move_count > 0 else 0
+
+        # Check if the challenge was completed
+        challenge_completed = best_move_count == moves_to_analyze and move_count >= moves_to_analyze
+
+        return {
+            "challenge_completed": challenge_completed,
+            "accuracy": accuracy,
+            "best_moves": best_move_count,
+            "total_moves_analyzed": move_count,
+            "max_consecutive_best": max_streak,
+            "book_hits": self._book_hits - book_hits_at_start,
+            "tablebase_searches_avoided": self._tb_avoided - tb_avoided_at_start,
+            "move_analysis": analysis_results
+        }
     
     def analyze_game(self, lichess_url):
         """
@@ -317,58 +550,78 @@ class DrLupoAnalyzer:
         Returns:
             dict: Analysis results
         """
+        import chess.pgn
+
         try:
             # Extract game ID and fetch PGN
             game_id = self._extract_game_id(lichess_url)
-            pgn_text = self._fetch_game_pgn(game_id)
-            
-            # Parse the PGN
-            game = chess.pgn.read_game(StringIO(pgn_text))  # Use StringIO from io module
-            if not game:
-                return {"error": "Failed to parse game PGN"}
-            
-            # Extract game metadata
-            headers = dict(game.headers)
+            with self.profiler.phase(f"game {game_id}"):
+                with self.profiler.phase("fetch"):
+                    pgn_text = self._fetch_game_pgn(game_id)
+
+                # Parse the PGN
+                with self.profiler.phase("parse_pgn"):
+                    game = chess.pgn.read_game(StringIO(pgn_text))  # Use StringIO from io module
+                if not game:
+                    return {"error": "Failed to parse game PGN"}
+
+                return self.analyze_pgn_game(game, lichess_url, game_id)
+
+        except Exception as e:
+            return {"error": str(e)}
+
+    def analyze_pgn_game(self, game, game_url, game_id):
+        """
+        Analyze an already-parsed game for the Dr Lupo Challenge.
+        
+        Args:
+            game: chess.pgn.Game
+            game_url: URL (or other reference) reported back in the results
+            game_id: Game identifier reported back in the results
             
-            # Detect queen sacrifice
+        Returns:
+            dict: Analysis results
+        """
+        # Extract game metadata
+        headers = dict(game.headers)
+        
+        # Detect queen sacrifice
+        with self.profiler.phase("detect_sacrifice"):
             sacrifice_found, player_color, move_number, position_fen, sacrifice_move_san = (
                 self._detect_queen_sacrifice(game)
             )
-            
-            if not sacrifice_found:
-                return {
-                    "game_url": lichess_url,
-                    "game_id": game_id,
-                    "white": headers.get("White", "Unknown"),
-                    "black": headers.get("Black", "Unknown"),
-                    "queen_sacrificed": False,
-                    "error": "No queen sacrifice found in the first 10 moves."
-                }
-            
-            # Analyze moves after sacrifice
-            analysis = self.analyze_moves_after_sacrifice(
-                game, player_color, move_number
-            )
-            
-            # Prepare the result
-            player_name = headers.get("White", "Unknown") if player_color == chess.WHITE else headers.get("Black", "Unknown")
-            
+        
+        if not sacrifice_found:
             return {
-                "game_url": lichess_url,
+                "game_url": game_url,
                 "game_id": game_id,
                 "white": headers.get("White", "Unknown"),
                 "black": headers.get("Black", "Unknown"),
-                "player": player_name,
-                "queen_sacrificed": True,
-                "sacrifice_move": move_number,
-                "sacrifice_position_fen": position_fen,
-                "sacrifice_move_san": sacrifice_move_san,
-                "player_color": "white" if player_color == chess.WHITE else "black",
-                **analysis
+                "queen_sacrificed": False,
+                "error": "No queen sacrifice found in the first 10 moves."
             }
-            
-        except Exception as e:
-            return {"error": str(e)}
+        
+        # Analyze moves after sacrifice
+        analysis = self.analyze_moves_after_sacrifice(
+            game, player_color, move_number
+        )
+        
+        # Prepare the result
+        player_name = headers.get("White", "Unknown") if player_color == chess.WHITE else headers.get("Black", "Unknown")
+        
+        return {
+            "game_url": game_url,
+            "game_id": game_id,
+            "white": headers.get("White", "Unknown"),
+            "black": headers.get("Black", "Unknown"),
+            "player": player_name,
+            "queen_sacrificed": True,
+            "sacrifice_move": move_number,
+            "sacrifice_position_fen": position_fen,
+            "sacrifice_move_san": sacrifice_move_san,
+            "player_color": "white" if player_color == chess.WHITE else "black",
+            **analysis
+        }
 
 
 # --- Dr Lupo Challenge v2: Badges, Visuals, Graph ---
@@ -616,37 +869,231 @@ def print_visual_results(results, elapsed_time, show_verbose=False):
     print()
 
 
+def iter_game_sources(inputs):
+    """
+    Lazily yield (game_url, game_id, game) for every input.
+
+    Inputs may be Lichess URLs, bare game IDs, PGN files, or "-" for PGN on stdin.
+    PGN games are read one at a time with chess.pgn.read_game; games given by
+    URL/ID are yielded with game=None and fetched by the worker that analyzes them.
+    """
+    import chess.pgn
+
+    for item in inputs:
+        if item == "-" or Path(item).is_file():
+            name = "stdin" if item == "-" else Path(item).stem
+            f = sys.stdin if item == "-" else open(item, encoding="utf-8", errors="replace")
+            try:
+                index = 0
+                while True:
+                    game = chess.pgn.read_game(f)
+                    if game is None:
+                        break
+                    index += 1
+                    site = game.headers.get("Site", "")
+                    match = re.search(r"lichess\.org/([a-zA-Z0-9]{8})", site)
+                    game_id = match.group(1) if match else f"{name}#{index}"
+                    yield site if site.startswith("http") else game_id, game_id, game
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        else:
+            url = item if "lichess.org" in item else f"https://lichess.org/{item}"
+            yield url, None, None
+
+
+def analyze_batch(inputs, out, jobs=1, workers=None, **analyzer_kwargs):
+    """
+    Screen many games for Lupo attempts and write one NDJSON line per game.
+
+    Runs `jobs` analyzers in parallel threads over one EnginePool, so Stockfish
+    processes stay alive across games, and all of them share one PositionCache
+    so common transpositions are searched once. Results are written in input order.
+    With `workers` (engine worker nodes), the searches run on those nodes instead.
+
+    Returns:
+        dict: Batch summary (games, sacrifices found, errors, elapsed seconds)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    local = threading.local()
+    position_cache = PositionCache()
+    profiler = analyzer_kwargs.get("profiler") or NULL_PROFILER
+    engine_path = analyzer_kwargs.pop("engine_path", None)
+    # One book and tablebase for every thread's analyzer
+    book = load_book(analyzer_kwargs.pop("book_path", None))
+    tablebase = open_tablebase(analyzer_kwargs.pop("tablebase_path", None))
+    if workers:
+        from src.engine_worker import RemoteEnginePool
+        pool = RemoteEnginePool(workers, size=jobs)
+    else:
+        from src.engine_pool import EnginePool
+        pool = EnginePool(engine_path, size=jobs)
+
+    def worker(source):
+        analyzer = getattr(local, "analyzer", None)
+        if analyzer is None:
+            # Games already run in parallel here, so each one keeps to a single engine
+            analyzer = DrLupoAnalyzer(position_cache=position_cache, pool=pool, move_workers=1,
+                                      book=book, tablebase=tablebase, **analyzer_kwargs)
+            local.analyzer = analyzer
+
+        game_url, game_id, game = source
+        if game is None:
+            return analyzer.analyze_game(game_url)
+        try:
+            with profiler.phase(f"game {game_id}"):
+                return analyzer.analyze_pgn_game(game, game_url, game_id)
+        except Exception as e:
+            return {"game_url": game_url, "game_id": game_id, "error": str(e)}
+
+    summary = {"games": 0, "queen_sacrifices": 0, "errors": 0}
+    start_time = time.time()
+
+    def write(result):
+        summary["games"] += 1
+        if result.get("queen_sacrificed"):
+            summary["queen_sacrifices"] += 1
+        elif "error" in result and "queen_sacrificed" not in result:
+            summary["errors"] += 1
+        with profiler.phase("serialize"):
+            line = json.dumps(result, ensure_ascii=False)
+        out.write(line + "\n")
+        out.flush()
+        if result.get("queen_sacrificed"):
+            status = f"queen sacrifice, best streak {result['max_consecutive_best']}"
+        else:
+            status = result.get("error", "no queen sacrifice")
+        print(f"  [{summary['games']}] {result.get('game_id') or result.get('game_url', '?')}: {status}",
+              file=sys.stderr)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Keep only a small window of games in flight so huge PGN files stream
+            pending = deque()
+            sources = iter_game_sources(inputs)
+            while True:
+                # PGN parsing happens as the next game is pulled from the source
+                with profiler.phase("parse_pgn"):
+                    source = next(sources, None)
+                if source is None:
+                    break
+                pending.append(executor.submit(worker, source))
+                while len(pending) >= 2 * jobs:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+    finally:
+        pool.close()
+        if book is not None:
+            book.close()
+        if tablebase is not None:
+            tablebase.close()
+
+    summary["elapsed"] = round(time.time() - start_time, 1)
+    summary["positions"] = position_cache.stats()
+    return summary
+
+
+def write_profile(profiler, path):
+    profiler.write(path)
+    profiler.print_report()
+    print(f"🔥 Profile saved to: {path} (flamegraph.pl / speedscope input)", file=sys.stderr)
+
+
 def main():
     """Command-line interface for the Dr Lupo Challenge analyzer."""
     parser = argparse.ArgumentParser(
         description="🎮 Dr Lupo Challenge Analyzer v2 👑",
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="Example: python -m src.dr_lupo_analyzer https://lichess.org/XXXXXXXX --verbose"
+        epilog="Examples:\n"
+               "  python -m src.dr_lupo_analyzer https://lichess.org/XXXXXXXX --verbose\n"
+               "  python -m src.dr_lupo_analyzer games.pgn --jobs 4 --ndjson results.ndjson\n"
+               "  curl -s https://lichess.org/api/games/user/NAME | python -m src.dr_lupo_analyzer - --jobs 4"
     )
-    parser.add_argument("url", help="URL to a Lichess game")
+    parser.add_argument("games", nargs="+", metavar="game",
+                        help="Lichess URL or game ID, PGN file, or - for PGN on stdin")
     parser.add_argument("--engine", help="Path to Stockfish engine")
     parser.add_argument("--depth", type=int, default=16, help="Engine analysis depth (default: 16)")
     parser.add_argument("--margin", type=float, default=25,
                       help="Margin of error in centipawns (default: 25)")
+    parser.add_argument("--book", help="Path to an opening book (default: books/opening_book.bin if present)")
+    parser.add_argument("--syzygy", help="Directory of Syzygy tablebases (default: $SYZYGY_PATH)")
     parser.add_argument("--verbose", "-v", action="store_true", help="Show detailed move-by-move analysis")
     parser.add_argument("--no-graph", action="store_true", help="Skip graph generation")
-    parser.add_argument("--output", "-o", default="dr_lupo_analysis.png", help="Graph output path (default: dr_lupo_analysis.png)")
+    parser.add_argument("--graph-format", choices=("svg", "png"), default="svg",
+                        help="svg: fast built-in renderer; png: matplotlib (default: svg)")
+    parser.add_argument("--output", "-o", default=None,
+                        help="Graph output path (default: dr_lupo_analysis.svg / .png)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Engines used in parallel: one per game in multi-game mode, "
+                             "spread over the moves of a single game otherwise (default: 1)")
+    parser.add_argument("--workers", metavar="HOST:PORT,...",
+                        help="Run searches on engine worker nodes (python -m src.engine_worker) "
+                             "instead of local Stockfish")
+    parser.add_argument("--ndjson", metavar="PATH",
+                        help="Write one JSON result per line to PATH (- for stdout); implies multi-game mode")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Time every phase and position; write a collapsed-stack profile (flame graph "
+                             "input) to PATH and print a summary")
 
     args = parser.parse_args()
 
-    print(f"\n⏳ Analyzing game: {args.url}")
-    print(f"   Engine depth: {args.depth} | Margin: {args.margin}cp")
-    print(f"   This may take a minute...\n")
+    profiler = None
+    if args.profile:
+        from src.profiling import Profiler
+        profiler = Profiler()
 
-    analyzer = DrLupoAnalyzer(
+    analyzer_kwargs = dict(
         engine_path=args.engine,
         engine_depth=args.depth,
-        margin_cp=args.margin
+        margin_cp=args.margin,
+        book_path=args.book,
+        tablebase_path=args.syzygy,
+        profiler=profiler,
     )
 
+    single = len(args.games) == 1 and args.games[0] != "-" and not Path(args.games[0]).is_file()
+    if not single or args.ndjson:
+        out = sys.stdout if args.ndjson in (None, "-") else open(args.ndjson, "w", encoding="utf-8")
+        print(f"⏳ Screening games with {args.jobs} engine(s) | depth {args.depth} | margin {args.margin}cp",
+              file=sys.stderr)
+        try:
+            summary = analyze_batch(args.games, out, jobs=args.jobs, workers=args.workers, **analyzer_kwargs)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"✅ {summary['games']} games, {summary['queen_sacrifices']} queen sacrifices, "
+              f"{summary['errors']} errors in {summary['elapsed']}s", file=sys.stderr)
+        if profiler is not None:
+            write_profile(profiler, args.profile)
+        return 0
+
+    url = args.games[0] if "lichess.org" in args.games[0] else f"https://lichess.org/{args.games[0]}"
+
+    print(f"\n⏳ Analyzing game: {url}")
+    pool = None
+    if args.workers:
+        # Spread the moves over every engine of the worker nodes unless --jobs says otherwise
+        from src.engine_worker import RemoteEnginePool
+        pool = RemoteEnginePool(args.workers, size=args.jobs if args.jobs > 1 else None)
+    elif args.jobs > 1:
+        from src.engine_pool import EnginePool
+        pool = EnginePool(args.engine, size=args.jobs)
+    analyzer = DrLupoAnalyzer(pool=pool, **analyzer_kwargs)
+    print(f"   Engine depth: {args.depth} | Margin: {args.margin}cp | Engines: {analyzer.move_workers}")
+    print(f"   This may take a minute...\n")
+
     start_time = time.time()
-    results = analyzer.analyze_game(args.url)
+    try:
+        results = analyzer.analyze_game(url)
+    finally:
+        analyzer.close()
+        if pool is not None:
+            pool.close()
     elapsed_time = time.time() - start_time
+    if profiler is not None and (not results.get("queen_sacrificed") or args.no_graph):
+        write_profile(profiler, args.profile)  # nothing timed after this point
 
     if "error" in results:
         print(f"❌ Error: {results['error']}")
@@ -666,13 +1113,22 @@ def main():
 
     # Generate graph
     if not args.no_graph:
-        graph_path = generate_graph(results, output_path=args.output, margin_cp=args.margin)
+        output_path = args.output or f"dr_lupo_analysis.{args.graph_format}"
+        with analyzer.profiler.phase("graph"):
+            if args.graph_format == "svg":
+                from src.graph_svg import write_svg
+                graph_path = write_svg(results, output_path=output_path, margin_cp=args.margin)
+            else:
+                graph_path = generate_graph(results, output_path=output_path, margin_cp=args.margin)
         if graph_path:
             print(f"📈 Graph saved to: {graph_path}")
             # Try to open the graph
             import os
             os.startfile(graph_path) if sys.platform == "win32" else None
 
+        if profiler is not None:
+            write_profile(profiler, args.profile)
+
     return 0
 
 
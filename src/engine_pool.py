@@ -0,0 +1,173 @@
+"""
+Engine Pool — Long-lived Stockfish processes shared across analyses.
+
+Starting Stockfish and loading its NNUE network costs a fixed amount of time
+per process, and quitting it throws the hash table away. A pool keeps a fixed
+number of engines running; callers borrow one for the duration of a search
+(or a whole game) and hand it back warm.
+
+Engines are started lazily on first use, so a pool can be created at import
+time (e.g. before gunicorn forks) without spawning processes in the parent.
+
+Usage:
+    with EnginePool(size=2) as pool:
+        with pool.acquire() as engine:
+            engine.analyse(board, chess.engine.Limit(depth=16))
+"""
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_ENGINE_OPTIONS = {"Hash": 64}
+
+
+class EnginePool:
+    """A fixed-size set of UCI engines handed out one caller at a time."""
+
+    def __init__(self, engine_path=None, size=1, options=None):
+        self.engine_path = engine_path  # resolved on first start if None
+        self.size = size
+        self.options = DEFAULT_ENGINE_OPTIONS if options is None else options
+        self._idle = []  # most recently used last, handed out first: its hash is the warmest
+        self._engines = []
+        self._lock = threading.Lock()
+        # Notified when an engine is returned or a slot frees up (a dead engine was discarded)
+        self._available = threading.Condition(self._lock)
+        self._closed = False
+        self.started = 0
+        self.restarts = 0
+
+    def _start_engine(self):
+        import chess.engine  # deferred: pools are created at import time of the web app
+
+        if self.engine_path is None:
+            from src.challenge_builder import find_stockfish
+            self.engine_path = find_stockfish()
+        engine = chess.engine.SimpleEngine.popen_uci(self.engine_path)
+        try:
+            options = {name: value for name, value in self.options.items() if name in engine.options}
+            if options:
+                engine.configure(options)
+        except Exception:
+            engine.quit()
+            raise
+        self.started += 1
+        return engine
+
+    def _checkout(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Engine pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                # Reserve the slot first so concurrent callers can't overshoot `size`
+                if len(self._engines) < self.size:
+                    self._engines.append(None)
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._available.wait(remaining)
+        try:
+            engine = self._start_engine()
+        except Exception:
+            with self._lock:
+                self._engines.remove(None)
+                self._available.notify()
+            raise
+        with self._lock:
+            self._engines[self._engines.index(None)] = engine
+        return engine
+
+    def _checkin(self, engine):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(engine)
+                self._available.notify()
+                return
+        try:
+            engine.quit()
+        except Exception:
+            pass
+
+    def _discard(self, engine):
+        """Drop a dead engine; a waiting (or the next) checkout starts a replacement."""
+        with self._lock:
+            if engine in self._engines:
+                self._engines.remove(engine)
+            self.restarts += 1
+            self._available.notify()
+        try:
+            engine.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow an engine. Raises queue.Empty if none frees up within `timeout`."""
+        import chess.engine
+
+        engine = self._checkout(timeout)
+        try:
+            yield engine
+        except chess.engine.EngineTerminatedError:
+            self._discard(engine)
+            engine = None
+            raise
+        finally:
+            if engine is not None:
+                self._checkin(engine)
+
+    def warm(self, board=None, depth=None):
+        """
+        Start every engine now instead of on first use. With `board` and `depth`,
+        each engine also runs a short search, so the NNUE network and the first
+        search's allocations are paid for before the first real request.
+        """
+        import chess.engine
+
+        engines = []
+        try:
+            for _ in range(self.size):
+                engines.append(self._checkout(timeout=None))
+            if board is not None and depth:
+                for engine in engines:
+                    engine.analyse(board, chess.engine.Limit(depth=depth))
+        finally:
+            for engine in engines:
+                self._checkin(engine)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            engines = [e for e in self._engines if e is not None]
+            self._engines = []
+            self._idle = []
+            self._available.notify_all()
+        for engine in engines:
+            try:
+                engine.quit()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for e in self._engines if e is not None)
+            idle = len(self._idle)
+        return {
+            "size": self.size,
+            "running": running,
+            "idle": idle,
+            "started": self.started,
+            "restarts": self.restarts,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+Engine Worker — Stockfish searches served over HTTP, and a pool that dispatches to them.
+
+A worker node wraps a local EnginePool and answers JSON search jobs:
+
+    GET  /health    {"ok", "engines", "busy", "jobs", "pid"}      (heartbeat)
+    POST /analyse   {"fen", "moves", "limit": {"depth"|"nodes"|"time"},
+                     "multipv"?, "root_moves"?, "stream"?}
+                 → {"infos": [info, ...], "stream"?: [info, ...]}
+
+Positions are sent as the root FEN plus the moves played from it, so the
+engine sees the game history (repetitions). Scores are relative to the side
+to move: {"cp": n} or {"mate": n}. Search limits are capped by the worker
+(--max-depth, --max-nodes, --max-time) and a job must set at least one.
+
+Every request carries "Authorization: Bearer <token>" with the shared secret
+from $LUPO_WORKER_TOKEN; the worker answers 401 without it. Workers listen
+on 127.0.0.1 unless given --host, and refuse to listen on another interface
+without a token.
+
+RemoteEnginePool has the same acquire()/warm()/stats()/close() interface as
+EnginePool, so the analyzer, the challenge builder and the web app can hand
+their searches to a list of worker nodes instead of local engines. A
+heartbeat thread marks nodes dead after missed health checks; a job running
+on a node that dies (or drops the connection) is reassigned to a live one.
+
+Usage:
+    LUPO_WORKER_TOKEN=secret python -m src.engine_worker --host 0.0.0.0 --engines 2   # on each worker node
+    python -m src.dr_lupo_analyzer games.pgn --workers host1:8765,host2:8765 --jobs 4
+    LUPO_ENGINE_WORKERS=host1:8765,host2:8765 gunicorn -c gunicorn.conf.py app:app
+"""
+
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import chess
+
+DEFAULT_PORT = 8765
+DEFAULT_HOST = "127.0.0.1"
+LIMIT_FIELDS = ("depth", "nodes", "time", "mate")
+# Upper bounds a worker applies to the limits of incoming jobs; larger values are clamped
+DEFAULT_LIMIT_CAPS = {"depth": 40, "nodes": 200_000_000, "time": 60.0, "mate": 20}
+MAX_JOB_BYTES = 1 << 20
+INFO_FIELDS = ("depth", "seldepth", "nodes", "nps", "time", "multipv", "lowerbound", "upperbound")
+
+
+# ---- Protocol ----
+
+def encode_info(info):
+    """python-chess InfoDict → JSON-safe dict (score relative to the side to move)."""
+    data = {k: info[k] for k in INFO_FIELDS if k in info}
+    if "pv" in info:
+        data["pv"] = [move.uci() for move in info["pv"]]
+    if "score" in info:
+        score = info["score"].relative
+        data["score"] = {"mate": score.mate()} if score.is_mate() else {"cp": score.score()}
+    return data
+
+
+def decode_info(data, board):
+    """JSON dict from a worker → InfoDict as python-chess returns it for `board`."""
+    import chess.engine
+
+    info = {k: data[k] for k in INFO_FIELDS if k in data}
+    if "pv" in data:
+        info["pv"] = [chess.Move.from_uci(uci) for uci in data["pv"]]
+    if "score" in data:
+        score = data["score"]
+        relative = chess.engine.Mate(score["mate"]) if "mate" in score else chess.engine.Cp(score["cp"])
+        info["score"] = chess.engine.PovScore(relative, board.turn)
+    return info
+
+
+def encode_job(board, limit, multipv=None, root_moves=None, stream=False):
+    root = board.root()
+    job = {
+        "fen": root.fen(),
+        "moves": [move.uci() for move in board.move_stack],
+        "limit": {k: getattr(limit, k) for k in LIMIT_FIELDS if getattr(limit, k) is not None},
+    }
+    if multipv is not None:
+        job["multipv"] = multipv
+    if root_moves is not None:
+        job["root_moves"] = [move.uci() for move in root_moves]
+    if stream:
+        job["stream"] = True
+    return job
+
+
+def decode_limit(data, caps=DEFAULT_LIMIT_CAPS):
+    """Job "limit" dict → chess.engine.Limit, each field clamped to `caps`. Raises ValueError."""
+    import chess.engine
+
+    if not isinstance(data, dict):
+        raise ValueError("limit must be an object")
+    fields = {}
+    for key in LIMIT_FIELDS:
+        value = data.get(key)
+        if value is None:
+            continue
+        number_types = (int, float) if key == "time" else (int,)
+        if isinstance(value, bool) or not isinstance(value, number_types) or value <= 0:
+            raise ValueError(f"limit {key} must be a positive {'number' if key == 'time' else 'integer'}")
+        fields[key] = min(value, caps[key])
+    if not fields:
+        # An empty Limit is an infinite search
+        raise ValueError(f"limit needs one of {', '.join(LIMIT_FIELDS)}")
+    return chess.engine.Limit(**fields)
+
+
+def decode_job(job, caps=DEFAULT_LIMIT_CAPS):
+    board = chess.Board(job["fen"])
+    for uci in job.get("moves", []):
+        board.push_uci(uci)
+    limit = decode_limit(job["limit"], caps)
+    multipv = job.get("multipv")
+    if multipv is not None and (isinstance(multipv, bool) or not isinstance(multipv, int) or multipv < 1):
+        raise ValueError("multipv must be a positive integer")
+    root_moves = [chess.Move.from_uci(uci) for uci in job["root_moves"]] if job.get("root_moves") else None
+    return board, limit, multipv, root_moves, bool(job.get("stream"))
+
+
+# ---- Worker node ----
+
+def run_job(engine, job, caps=DEFAULT_LIMIT_CAPS):
+    """Run one decoded search job on a local engine; returns the JSON response."""
+    board, limit, multipv, root_moves, stream = decode_job(job, caps)
+    if stream:
+        # Every info line with a score, for callers that record per-depth evals
+        infos = []
+        with engine.analysis(board, limit, root_moves=root_moves) as analysis:
+            for info in analysis:
+                if "score" in info and "depth" in info:
+                    infos.append(encode_info(info))
+            final = analysis.info
+        return {"infos": [encode_info(final)], "stream": infos}
+    result = engine.analyse(board, limit, multipv=multipv, root_moves=root_moves)
+    infos = result if isinstance(result, list) else [result]
+    return {"infos": [encode_info(info) for info in infos]}
+
+
+class WorkerNode:
+    """The worker daemon: a local EnginePool behind a threaded HTTP server."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, engine_path=None, engines=1, options=None,
+                 token=None, limit_caps=None):
+        from src.engine_pool import EnginePool
+
+        self.token = token if token is not None else os.environ.get("LUPO_WORKER_TOKEN")
+        if not self.token and not _is_loopback(host):
+            raise ValueError(f"Refusing to listen on {host} without a token: set LUPO_WORKER_TOKEN")
+        self.limit_caps = dict(DEFAULT_LIMIT_CAPS, **(limit_caps or {}))
+        self.pool = EnginePool(engine_path, size=engines, options=options)
+        self.jobs = 0
+        self.failures = 0
+        self.busy = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    def _handler_class(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass  # one line per search would drown the worker's own output
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self):
+                if not node.token:
+                    return True
+                sent = self.headers.get("Authorization", "")
+                return hmac.compare_digest(sent.encode(), f"Bearer {node.token}".encode())
+
+            def do_GET(self):
+                if not self._authorized():
+                    return self._reply(401, {"error": "unauthorized"})
+                if self.path != "/health":
+                    return self._reply(404, {"error": "not found"})
+                self._reply(200, node.health())
+
+            def do_POST(self):
+                if not self._authorized():
+                    self.close_connection = True  # the request body is left unread
+                    return self._reply(401, {"error": "unauthorized"})
+                if self.path != "/analyse":
+                    return self._reply(404, {"error": "not found"})
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_JOB_BYTES:
+                    self.close_connection = True
+                    return self._reply(413, {"error": f"job must be at most {MAX_JOB_BYTES} bytes"})
+                try:
+                    job = json.loads(self.rfile.read(length))
+                except ValueError:
+                    return self._reply(400, {"error": "invalid JSON"})
+                status, payload = node.handle(job)
+                self._reply(status, payload)
+
+        return Handler
+
+    def health(self):
+        with self._lock:
+            return {"ok": True, "engines": self.pool.size, "busy": self.busy, "jobs": self.jobs,
+                    "failures": self.failures, "pid": os.getpid()}
+
+    def handle(self, job):
+        import chess.engine
+
+        with self._lock:
+            self.busy += 1
+        try:
+            with self.pool.acquire() as engine:
+                payload = run_job(engine, job, self.limit_caps)
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": f"bad job: {e}"}
+        except chess.engine.EngineTerminatedError as e:
+            # The pool has dropped the dead engine; the client reassigns the job
+            with self._lock:
+                self.failures += 1
+            return 503, {"error": f"engine terminated: {e}"}
+        except chess.engine.EngineError as e:
+            return 500, {"error": f"engine error: {e}"}
+        finally:
+            with self._lock:
+                self.busy -= 1
+        with self._lock:
+            self.jobs += 1
+        return 200, payload
+
+    def serve_forever(self):
+        self.pool.warm()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.pool.close()
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# ---- Client side ----
+
+class WorkerUnavailable(Exception):
+    """A worker node didn't answer (connection refused, dropped, timed out, or 503)."""
+
+
+def parse_workers(spec):
+    """'host1:8765,host2' → ['http://host1:8765', 'http://host2:8765']"""
+    urls = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "://" not in item:
+            item = "http://" + item
+        if item.count(":") < 2:
+            item = f"{item}:{DEFAULT_PORT}"
+        urls.append(item.rstrip("/"))
+    return urls
+
+
+def _http_json(url, payload=None, timeout=None, token=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", str(e))
+        except ValueError:
+            message = str(e)
+        if e.code in (401, 503):
+            # A node that rejects our token is as good as down
+            raise WorkerUnavailable(message) from e
+        import chess.engine
+        raise chess.engine.EngineError(message) from e
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise WorkerUnavailable(str(e)) from e
+
+
+def _submit(fn, *args):
+    """Run fn(*args) in its own daemon thread; a call to a hung node is abandoned, never joined."""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class _BufferedAnalysis:
+    """What engine.analysis() returns, filled from a worker's recorded info stream."""
+
+    def __init__(self, infos, final):
+        self._infos = infos
+        self.info = final
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __iter__(self):
+        return iter(self._infos)
+
+
+class RemoteEngine:
+    """Stands in for a chess.engine.SimpleEngine; every search runs on some worker node."""
+
+    options = {}
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def analyse(self, board, limit, multipv=None, root_moves=None, **kwargs):
+        response = self.pool.dispatch(encode_job(board, limit, multipv, root_moves))
+        infos = [decode_info(info, board) for info in response["infos"]]
+        return infos if multipv is not None else infos[0]
+
+    def analysis(self, board, limit, root_moves=None, **kwargs):
+        response = self.pool.dispatch(encode_job(board, limit, root_moves=root_moves, stream=True))
+        return _BufferedAnalysis([decode_info(info, board) for info in response["stream"]],
+                                 decode_info(response["infos"][0], board))
+
+    def play(self, board, limit, root_moves=None, **kwargs):
+        import chess.engine
+
+        info = self.analyse(board, limit, root_moves=root_moves)
+        pv = info.get("pv") or [None]
+        return chess.engine.PlayResult(pv[0], pv[1] if len(pv) > 1 else None, info)
+
+    def quit(self):
+        pass
+
+
+class RemoteEnginePool:
+    """EnginePool over worker nodes: heartbeats, least-busy dispatch, reassignment of failed jobs."""
+
+    def __init__(self, workers, size=None, share=1, heartbeat_interval=2.0, dead_after=3, job_timeout=600,
+                 token=None):
+        """
+        Args:
+            workers: Worker URLs or a "host:port,host:port" string.
+            size: Searches in flight at once. Default: the engines of the live nodes divided
+                by `share` (at least 1), recomputed at every heartbeat.
+            share: Pools drawing on the same nodes (e.g. gunicorn workers × pools per worker),
+                so that together they don't run more searches than the nodes have engines.
+            heartbeat_interval: Seconds between health checks of each node.
+            dead_after: Missed health checks before a node is taken out of rotation.
+            job_timeout: Seconds a single search may take before its node is given up on.
+            token: Shared secret sent to the nodes (default: $LUPO_WORKER_TOKEN).
+        """
+        urls = parse_workers(workers) if isinstance(workers, str) else list(workers)
+        if not urls:
+            raise ValueError("No engine workers given")
+        self.nodes = [{"url": url, "alive": False, "engines": 0, "in_flight": 0, "missed": 0,
+                       "jobs": 0, "failures": 0, "last_seen": None} for url in urls]
+        self._size = size
+        self._fixed_size = size is not None
+        self.share = max(1, share)
+        self.heartbeat_interval = heartbeat_interval
+        self.dead_after = dead_after
+        self.job_timeout = job_timeout
+        self.token = token if token is not None else os.environ.get("LUPO_WORKER_TOKEN")
+        self.engine = RemoteEngine(self)
+        self.reassigned = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._node_alive = threading.Condition(self._lock)
+        self._slot_free = threading.Condition(self._lock)
+        self._in_use = 0
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    # Nothing is started until first use, so a pool can be created before gunicorn forks
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._heartbeat is not None:
+                return
+            self._check_nodes()
+            with self._lock:
+                if self._size is None:
+                    self._size = 1  # no node answered yet; resized once one does
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            self._heartbeat.start()
+
+    @property
+    def size(self):
+        self._ensure_started()
+        return self._size
+
+    def _check_nodes(self):
+        for node in self.nodes:
+            try:
+                health = _http_json(node["url"] + "/health", timeout=max(self.heartbeat_interval, 1.0),
+                                    token=self.token)
+            except Exception:
+                with self._lock:
+                    node["missed"] += 1
+                    if node["missed"] >= self.dead_after:
+                        node["alive"] = False
+                continue
+            with self._lock:
+                node.update(alive=True, missed=0, engines=health.get("engines", 1), last_seen=time.time())
+                self._node_alive.notify_all()
+        with self._lock:
+            self._resize()
+
+    def _resize(self):
+        """Follow the live nodes' engines (unless the size was given). Called with _lock held."""
+        if self._fixed_size:
+            return
+        engines = sum(node["engines"] for node in self.nodes if node["alive"])
+        if engines:
+            # While every node is down the last size is kept: searches wait in _pick_node anyway
+            self._size = max(1, engines // self.share)
+            self._slot_free.notify_all()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            self._check_nodes()
+
+    def _pick_node(self, exclude, timeout):
+        """The live node with the most free engines, waiting up to `timeout` for one."""
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                candidates = [n for n in self.nodes if n["alive"] and n["url"] not in exclude]
+                if not candidates:
+                    # Every node was tried: give the ones still alive another go
+                    candidates = [n for n in self.nodes if n["alive"]]
+                if candidates:
+                    node = min(candidates, key=lambda n: n["in_flight"] / max(n["engines"], 1))
+                    node["in_flight"] += 1
+                    return node
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._node_alive.wait(min(remaining, self.heartbeat_interval))
+
+    def _mark_dead(self, node):
+        with self._lock:
+            node["alive"] = False
+            node["missed"] = self.dead_after
+            node["failures"] += 1
+
+    def dispatch(self, job):
+        """Run a job on a live node; reassigned to another node if that one fails or dies."""
+        import chess.engine
+
+        self._ensure_started()
+        tried = set()
+        for _ in range(2 * len(self.nodes) + 1):
+            node = self._pick_node(tried, timeout=self.job_timeout)
+            if node is None:
+                break
+            tried.add(node["url"])
+            future = _submit(_http_json, node["url"] + "/analyse", job, self.job_timeout, self.token)
+            try:
+                # Wake up every heartbeat to notice a node that died mid-search
+                while not wait([future], timeout=self.heartbeat_interval).done:
+                    if not node["alive"]:
+                        raise WorkerUnavailable(f"{node['url']} stopped answering heartbeats")
+                response = future.result()
+            except WorkerUnavailable:
+                self._mark_dead(node)
+                with self._lock:
+                    self.reassigned += 1
+                continue
+            finally:
+                with self._lock:
+                    node["in_flight"] -= 1
+            with self._lock:
+                node["jobs"] += 1
+            return response
+        raise chess.engine.EngineTerminatedError("No live engine worker could run the search")
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrow a search slot. Raises queue.Empty if none frees up within `timeout`."""
+        import queue
+
+        self._ensure_started()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            # The size can change at any heartbeat, so it is rechecked after every wakeup
+            while self._in_use >= self._size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._slot_free.wait(remaining)
+            self._in_use += 1
+        try:
+            yield self.engine
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._slot_free.notify()
+
+    def warm(self, board=None, depth=None):
+        """Contact every node now; with `board` and `depth`, run one short search per slot."""
+        import chess.engine
+
+        self._ensure_started()
+        if not any(node["alive"] for node in self.nodes):
+            raise RuntimeError(f"No engine worker answered: {', '.join(n['url'] for n in self.nodes)}")
+        if board is not None and depth:
+            futures = [_submit(self.engine.analyse, board, chess.engine.Limit(depth=depth))
+                       for _ in range(self._size)]
+            for future in futures:
+                future.result()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._node_alive.notify_all()
+
+    def stats(self):
+        with self._lock:
+            alive = [n for n in self.nodes if n["alive"]]
+            return {
+                "size": self._size,
+                "running": sum(n["engines"] for n in alive),
+                "idle": max(0, self._size - self._in_use) if self._size is not None else None,
+                "reassigned": self.reassigned,
+                "workers": [{k: n[k] for k in ("url", "alive", "engines", "in_flight", "jobs", "failures")}
+                            for n in self.nodes],
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo engine worker: Stockfish searches over HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help=f"Interface to listen on (default: {DEFAULT_HOST}; others need $LUPO_WORKER_TOKEN)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument("--engines", type=int, default=1, help="Stockfish processes on this node (default: 1)")
+    parser.add_argument("--engine", default=None, help="Path to Stockfish (auto-detected by default)")
+    parser.add_argument("--hash", type=int, default=64, help="Hash size per engine in MB (default: 64)")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_LIMIT_CAPS["depth"],
+                        help=f"Cap on a job's depth (default: {DEFAULT_LIMIT_CAPS['depth']})")
+    parser.add_argument("--max-nodes", type=int, default=DEFAULT_LIMIT_CAPS["nodes"],
+                        help=f"Cap on a job's nodes (default: {DEFAULT_LIMIT_CAPS['nodes']})")
+    parser.add_argument("--max-time", type=float, default=DEFAULT_LIMIT_CAPS["time"],
+                        help=f"Cap on a job's time in seconds (default: {DEFAULT_LIMIT_CAPS['time']:g})")
+    args = parser.parse_args()
+
+    caps = {"depth": args.max_depth, "nodes": args.max_nodes, "time": args.max_time}
+    try:
+        node = WorkerNode(args.host, args.port, args.engine, args.engines, options={"Hash": args.hash},
+                          limit_caps=caps)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    print(f"Engine worker on {args.host}:{args.port} with {args.engines} engine(s)", file=sys.stderr)
+    try:
+        node.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Fallback Bench — Engine time spent on played moves outside the top 5.
+
+When the played move isn't in the multipv=5 list, the analyzer scores it
+with one more search. "child" (the old way) searches the position after the
+move from scratch; "root" searches the same root restricted to the played
+move (searchmoves), so it scores it at the same depth as the top 5.
+
+Every game of the corpus is analyzed in both modes, each on its own engine
+and cache, and the bench reports engine time and nodes per mode, plus how
+often the two modes disagree on the verdict.
+
+Usage:
+    python -m src.fallback_bench games.pgn --depth 16
+    curl -s https://lichess.org/api/games/user/NAME | python -m src.fallback_bench - --max-games 50
+"""
+
+import argparse
+import sys
+import time
+
+from src.dr_lupo_analyzer import FALLBACK_SEARCHES, DrLupoAnalyzer, iter_game_sources
+
+
+def fallback_moves(result):
+    """Analysed moves that needed a fallback search (ranked below the top 5), keyed by (move number, SAN)."""
+    return {(m["move_number"], m["move"]): m for m in result.get("move_analysis", []) if m["move_rank"] > 5}
+
+
+def bench(inputs, engine_path=None, depth=16, margin_cp=25, max_games=None):
+    """
+    Analyze every game in both fallback modes.
+
+    Returns:
+        dict: per-mode search_stats, games/positions counted, verdict agreement
+    """
+    analyzers = {mode: DrLupoAnalyzer(engine_path=engine_path, engine_depth=depth, margin_cp=margin_cp,
+                                      fallback_search=mode)
+                 for mode in FALLBACK_SEARCHES}
+    summary = {"games": 0, "sacrifice_games": 0, "positions": 0, "fallback_positions": 0, "unmatched": 0,
+               "verdicts_differ": 0, "score_diff_delta_sum": 0, "score_diff_delta_max": 0}
+    start_time = time.time()
+    try:
+        for analyzer in analyzers.values():
+            analyzer.__enter__()
+        for game_url, game_id, game in iter_game_sources(inputs):
+            if game is None:
+                print(f"  skipping {game_url}: the bench reads PGN only", file=sys.stderr)
+                continue
+            if max_games is not None and summary["games"] >= max_games:
+                break
+            summary["games"] += 1
+            results = {mode: analyzer.analyze_pgn_game(game, game_url, game_id)
+                       for mode, analyzer in analyzers.items()}
+            if not results["root"].get("queen_sacrificed"):
+                continue
+            summary["sacrifice_games"] += 1
+            summary["positions"] += results["root"]["total_moves_analyzed"]
+            root_moves, child_moves = fallback_moves(results["root"]), fallback_moves(results["child"])
+            # A move that needed a fallback in only one mode can't be compared
+            summary["unmatched"] += len(root_moves.keys() ^ child_moves.keys())
+            for key in root_moves.keys() & child_moves.keys():
+                root_move, child_move = root_moves[key], child_moves[key]
+                summary["fallback_positions"] += 1
+                summary["verdicts_differ"] += root_move["is_best"] != child_move["is_best"]
+                delta = abs(root_move["score_diff"] - child_move["score_diff"])
+                summary["score_diff_delta_sum"] += delta
+                summary["score_diff_delta_max"] = max(summary["score_diff_delta_max"], delta)
+            print(f"  [{summary['games']}] {game_id}: {len(root_moves)} fallback(s)",
+                  file=sys.stderr)
+    finally:
+        for analyzer in analyzers.values():
+            analyzer.close()
+
+    summary["elapsed"] = round(time.time() - start_time, 1)
+    summary["modes"] = {mode: dict(analyzer.search_stats) for mode, analyzer in analyzers.items()}
+    return summary
+
+
+def print_summary(summary):
+    print(f"\nGames: {summary['games']} ({summary['sacrifice_games']} with a queen sacrifice), "
+          f"{summary['positions']} positions, {summary['fallback_positions']} outside the top 5")
+    print(f"{'mode':8} {'top-5 s':>9} {'fallbacks':>10} {'fallback s':>11} {'ms each':>8} {'nodes each':>11}")
+    for mode, stats in summary["modes"].items():
+        n = stats["fallback_searches"]
+        print(f"{mode:8} {stats['top5_seconds']:9.1f} {n:10} {stats['fallback_seconds']:11.2f} "
+              f"{stats['fallback_seconds'] * 1000 / n if n else 0:8.0f} "
+              f"{stats['fallback_nodes'] // n if n else 0:11,}")
+
+    child, root = summary["modes"]["child"], summary["modes"]["root"]
+    if child["fallback_seconds"]:
+        saved = child["fallback_seconds"] - root["fallback_seconds"]
+        total = child["top5_seconds"] + child["fallback_seconds"]
+        print(f"\nRoot fallback saves {saved:.2f}s of fallback time "
+              f"({saved / child['fallback_seconds']:.0%}), {saved / total:.1%} of all engine time")
+    if summary["fallback_positions"]:
+        print(f"Verdict differs in {summary['verdicts_differ']}/{summary['fallback_positions']} fallback positions; "
+              f"score diff moves by {summary['score_diff_delta_sum'] / summary['fallback_positions']:.0f}cp "
+              f"on average (max {summary['score_diff_delta_max']}cp)")
+    if summary["unmatched"]:
+        print(f"{summary['unmatched']} move(s) needed a fallback in one mode only (not compared)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fallback searches for moves outside the top 5")
+    parser.add_argument("games", nargs="+", help="PGN files, or - for PGN on stdin")
+    parser.add_argument("--engine", help="Path to Stockfish engine")
+    parser.add_argument("--depth", type=int, default=16, help="Engine analysis depth (default: 16)")
+    parser.add_argument("--margin", type=float, default=25, help="Margin of error in centipawns (default: 25)")
+    parser.add_argument("--max-games", type=int, default=None, help="Stop after N games")
+    args = parser.parse_args()
+
+    summary = bench(args.games, engine_path=args.engine, depth=args.depth, margin_cp=args.margin,
+                    max_games=args.max_games)
+    print_summary(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
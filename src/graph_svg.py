@@ -0,0 +1,192 @@
+"""
+Graph SVG — The analysis graph rendered straight to SVG, without matplotlib.
+
+Same chart as generate_graph (move rank bars, eval-diff line on a second
+axis, tolerance zone, best-streak shading, badge title), written as SVG text
+from `move_analysis`. Rendering takes about a millisecond and needs only the
+standard library, so the web app can return graphs inline with /analyze.
+
+Renders are cached in memory by a hash of the fields the chart is drawn from.
+
+Usage:
+    from src.graph_svg import cached_svg
+    svg = cached_svg(results, margin_cp=25)
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+BG = "#1a1a2e"
+PLOT_BG = "#16213e"
+GREEN = "#2ecc71"
+RED = "#e74c3c"
+ORANGE = "#f39c12"
+
+CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "renders": 0}
+
+
+def graph_key(results, margin_cp):
+    """Hash of everything the graph is drawn from."""
+    fields = {
+        "moves": [(m["move_number"], m["move"], m["move_rank"], m["score_diff"], m["is_best"])
+                  for m in results["move_analysis"]],
+        "summary": [results.get(k) for k in ("accuracy", "best_moves", "total_moves_analyzed",
+                                             "max_consecutive_best", "challenge_completed")],
+        "margin_cp": margin_cp,
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def render_svg(results, margin_cp=5):
+    """Render the analysis graph as an SVG document (str), or None if there are no moves."""
+    from src.dr_lupo_analyzer import determine_badge
+
+    moves = results["move_analysis"]
+    if not moves:
+        return None
+
+    n = len(moves)
+    slot = 40
+    left, right, top, bottom = 70, 80, 80, 95
+    width = left + right + n * slot
+    height = 520
+    plot_h = height - top - bottom
+    plot_bottom = top + plot_h
+
+    ranks = [m["move_rank"] for m in moves]
+    diffs = [abs(m["score_diff"]) for m in moves]
+    max_rank = max(ranks) + 1
+    max_diff = max(max(diffs), margin_cp) * 1.1 or 1
+
+    def x_center(i):
+        return left + (i + 0.5) * slot
+
+    def y_rank(rank):  # rank axis is inverted: 0 at the top
+        return top + rank / max_rank * plot_h
+
+    def y_diff(value):
+        return plot_bottom - value / max_diff * plot_h
+
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}" font-family="sans-serif">',
+        f'<rect width="{width}" height="{height}" fill="{BG}"/>',
+        f'<rect x="{left}" y="{top}" width="{n * slot}" height="{plot_h}" fill="{PLOT_BG}"/>',
+    ]
+
+    # Best streaks (2+ in a row) shaded behind everything
+    i = 0
+    while i < n:
+        if moves[i]["is_best"]:
+            j = i
+            while j < n and moves[j]["is_best"]:
+                j += 1
+            if j - i >= 2:
+                out.append(f'<rect x="{left + i * slot}" y="{top}" width="{(j - i) * slot}" '
+                           f'height="{plot_h}" fill="{GREEN}" fill-opacity="0.1"/>')
+            i = j
+        else:
+            i += 1
+
+    # Rank grid lines and left axis labels
+    for rank in range(1, max_rank):
+        y = y_rank(rank)
+        out.append(f'<line x1="{left}" x2="{left + n * slot}" y1="{y:.1f}" y2="{y:.1f}" '
+                   f'stroke="white" stroke-opacity="0.15"/>')
+        out.append(f'<text x="{left - 8}" y="{y + 4:.1f}" fill="white" font-size="11" '
+                   f'text-anchor="end">{rank}</text>')
+
+    # Tolerance zone on the eval-diff axis
+    y_margin = y_diff(margin_cp)
+    out.append(f'<rect x="{left}" y="{y_margin:.1f}" width="{n * slot}" height="{plot_bottom - y_margin:.1f}" '
+               f'fill="{GREEN}" fill-opacity="0.15"/>')
+    out.append(f'<line x1="{left}" x2="{left + n * slot}" y1="{y_margin:.1f}" y2="{y_margin:.1f}" '
+               f'stroke="{GREEN}" stroke-width="1.5" stroke-dasharray="6 4" stroke-opacity="0.7"/>')
+    out.append(f'<text x="{left + n * slot - 4}" y="{y_margin - 4:.1f}" fill="{GREEN}" font-size="11" '
+               f'font-style="italic" text-anchor="end">Tolerance: {margin_cp}cp</text>')
+
+    # Rank bars, hanging from the top (rank 1 = shortest bar)
+    for i, m in enumerate(moves):
+        color = GREEN if m["is_best"] else RED
+        bar_h = y_rank(m["move_rank"]) - top
+        out.append(f'<rect x="{x_center(i) - slot * 0.35:.1f}" y="{top}" width="{slot * 0.7:.1f}" '
+                   f'height="{bar_h:.1f}" fill="{color}" fill-opacity="0.85" stroke="white" stroke-width="0.5"/>')
+        out.append(f'<text x="{x_center(i):.1f}" y="{top + bar_h + 12:.1f}" fill="white" font-size="9" '
+                   f'font-weight="bold" text-anchor="middle">#{m["move_rank"]}</text>')
+        label = escape(f'{m["move_number"]}.{m["move"]}')
+        out.append(f'<text transform="translate({x_center(i) + 4:.1f},{plot_bottom + 12}) rotate(-55)" '
+                   f'fill="white" font-size="9" text-anchor="end">{label}</text>')
+
+    # Eval diff line and right axis
+    points = " ".join(f"{x_center(i):.1f},{y_diff(d):.1f}" for i, d in enumerate(diffs))
+    out.append(f'<polyline points="{points}" fill="none" stroke="{ORANGE}" stroke-width="2"/>')
+    for i, d in enumerate(diffs):
+        out.append(f'<circle cx="{x_center(i):.1f}" cy="{y_diff(d):.1f}" r="3.5" fill="{ORANGE}"/>')
+    for k in range(5):
+        value = max_diff * k / 4
+        out.append(f'<text x="{left + n * slot + 8}" y="{y_diff(value) + 4:.1f}" fill="{ORANGE}" '
+                   f'font-size="11">{value:.0f}</text>')
+
+    # Axis titles
+    out.append(f'<text transform="translate(20,{top + plot_h / 2:.1f}) rotate(-90)" fill="white" '
+               f'font-size="12" text-anchor="middle">Move Rank (1 = best)</text>')
+    out.append(f'<text transform="translate({width - 16},{top + plot_h / 2:.1f}) rotate(90)" fill="{ORANGE}" '
+               f'font-size="12" text-anchor="middle">Eval Difference (centipawns)</text>')
+
+    # Title with badge
+    badge = determine_badge(results["max_consecutive_best"])
+    line1 = f"Dr Lupo Challenge v2 -- {badge['name']}"
+    line2 = (f"Accuracy: {results['accuracy']:.1f}% ({results['best_moves']}/{results['total_moves_analyzed']}) "
+             f"| Best streak: {results['max_consecutive_best']} "
+             f"| {'COMPLETED' if results['challenge_completed'] else 'Not completed'}")
+    out.append(f'<text x="{width / 2:.1f}" y="30" fill="white" font-size="15" font-weight="bold" '
+               f'text-anchor="middle">{escape(line1)}</text>')
+    out.append(f'<text x="{width / 2:.1f}" y="52" fill="white" font-size="13" font-weight="bold" '
+               f'text-anchor="middle">{escape(line2)}</text>')
+
+    # Legend
+    legend = [(GREEN, "Best move"), (RED, "Not best move"), (ORANGE, "Eval diff (cp)"),
+              (GREEN, f"Tolerance zone ({margin_cp}cp)")]
+    x = left
+    for color, text in legend:
+        out.append(f'<rect x="{x}" y="{height - 22}" width="12" height="12" fill="{color}"/>')
+        out.append(f'<text x="{x + 17}" y="{height - 12}" fill="white" font-size="11">{escape(text)}</text>')
+        x += 30 + 7 * len(text)
+
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def cached_svg(results, margin_cp=5):
+    """render_svg, memoized by graph_key."""
+    key = graph_key(results, margin_cp)
+    with _cache_lock:
+        svg = _cache.get(key)
+        if svg is not None:
+            _cache.move_to_end(key)
+            cache_stats["hits"] += 1
+            return svg
+    svg = render_svg(results, margin_cp)
+    with _cache_lock:
+        _cache[key] = svg
+        cache_stats["renders"] += 1
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return svg
+
+
+def write_svg(results, output_path="dr_lupo_analysis.svg", margin_cp=5):
+    """Write the SVG graph to a file. Returns the path, or None if there are no moves."""
+    svg = cached_svg(results, margin_cp)
+    if svg is None:
+        return None
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(svg)
+    return output_path
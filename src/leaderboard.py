@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Leaderboard — Daily Challenge submissions with a live streak histogram.
+
+Submissions are persisted to local SQLite by a background writer that commits
+in batches, so a midnight-UTC spike costs one transaction per batch instead of
+one per player. A submission waits for its batch: the database row, not this
+process's memory, decides whether it is the player's first attempt of the day,
+so a second attempt through another gunicorn worker is rejected too. Failed
+batches are retried with backoff. Reads never scan the table: each day keeps
+an in-memory aggregate of
+
+    counts[s]   number of players with streak s (0..26)
+    buckets[s]  players with streak s, in submission order
+
+so "histogram for today" is O(1), "my rank" is O(27) = O(1) (players with a
+higher streak + earlier players with the same streak), and "top N" is O(N).
+Other processes sharing the database (e.g. gunicorn workers) are picked up by
+tailing new rows by rowid.
+
+Usage:
+    python -m src.leaderboard bench --submissions 200000 --threads 8
+"""
+
+import argparse
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+
+MAX_STREAK = 26
+
+# A batch that fails (e.g. "database is locked" under several workers) is retried
+# this many times, waiting WRITE_BACKOFF seconds and doubling the wait each time
+WRITE_RETRIES = 4
+WRITE_BACKOFF = 0.05
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_submissions (
+    day TEXT NOT NULL,
+    player TEXT NOT NULL,
+    streak INTEGER NOT NULL,
+    score REAL,
+    submitted_at REAL NOT NULL,
+    PRIMARY KEY (day, player)
+)
+"""
+
+
+class LeaderboardError(ValueError):
+    """A submission was rejected (duplicate player, bad streak, ...)."""
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class _DayBoard:
+    """In-memory aggregate of one day's submissions."""
+
+    def __init__(self):
+        self.counts = [0] * (MAX_STREAK + 1)
+        self.buckets = [[] for _ in range(MAX_STREAK + 1)]
+        self.players = {}  # player → (streak, index in bucket, score)
+
+    def add(self, player, streak, score):
+        bucket = self.buckets[streak]
+        self.players[player] = (streak, len(bucket), score)
+        bucket.append(player)
+        self.counts[streak] += 1
+
+    def rank(self, player):
+        entry = self.players.get(player)
+        if entry is None:
+            return None
+        streak, index, score = entry
+        better = sum(self.counts[streak + 1:])
+        return {"player": player, "rank": better + index + 1, "streak": streak,
+                "score": score, "total": len(self.players)}
+
+    def top(self, n):
+        result = []
+        for streak in range(MAX_STREAK, -1, -1):
+            for player in self.buckets[streak]:
+                if len(result) >= n:
+                    return result
+                result.append({"rank": len(result) + 1, "player": player, "streak": streak,
+                               "score": self.players[player][2]})
+        return result
+
+
+class DailyLeaderboard:
+    """Daily Challenge leaderboard: batched SQLite writes, in-memory reads."""
+
+    def __init__(self, db_path, batch_size=500, flush_interval=0.25, sync_interval=1.0, submit_timeout=10.0):
+        self.db_path = str(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.submit_timeout = submit_timeout
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+
+        self._days = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._last_rowid = 0
+        self._last_sync = 0.0
+        self._sync_from_db()
+
+        self._pending = queue.Queue()
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self._writer = threading.Thread(target=self._write_loop, name="leaderboard-writer", daemon=True)
+        self._writer.start()
+
+    # ---- writes ----
+
+    def submit(self, player, streak, score=None, day=None):
+        """
+        Record a player's one attempt for the day. Returns their rank entry.
+
+        Blocks until the submission's batch is committed. Raises LeaderboardError
+        if the player already has a row for the day (from any process) or the
+        write failed.
+        """
+        day = day or utc_today()
+        if not player:
+            raise LeaderboardError("player is required")
+        if not 0 <= streak <= MAX_STREAK:
+            raise LeaderboardError(f"streak must be between 0 and {MAX_STREAK}")
+        with self._lock:
+            board = self._days.get(day)
+            if board is not None and player in board.players:
+                raise LeaderboardError("already submitted today")
+
+        written = Future()
+        self._pending.put(((day, player, streak, score, time.time()), written))
+        try:
+            inserted = written.result(timeout=self.submit_timeout)
+        except FutureTimeoutError:
+            raise LeaderboardError("leaderboard is busy, try again") from None
+        except Exception as e:
+            raise LeaderboardError(f"submission could not be saved: {e}") from None
+        if not inserted:
+            raise LeaderboardError("already submitted today")
+
+        with self._lock:
+            board = self._days.setdefault(day, _DayBoard())
+            if player not in board.players:  # unless a sync already picked the row up
+                board.add(player, streak, score)
+                self._version += 1
+                self._changed.notify_all()
+            return board.rank(player)
+
+    def _write_loop(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self._pending.get(timeout=self.flush_interval))
+            except queue.Empty:
+                if self._closed:
+                    return
+                continue
+            # Submitters wait for their batch, so take what queued up meanwhile instead of waiting for more
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_with_retries(batch)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _write_with_retries(self, batch):
+        delay = WRITE_BACKOFF
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                inserted = self._write_batch([row for row, _ in batch])
+                break
+            except Exception as e:
+                if attempt == WRITE_RETRIES:
+                    self.failed += len(batch)
+                    print(f"leaderboard: dropped {len(batch)} submissions after {attempt + 1} attempts: {e} "
+                          f"({', '.join(f'{day}/{player}' for (day, player, *_), _ in batch[:5])}"
+                          f"{', ...' if len(batch) > 5 else ''})", file=sys.stderr)
+                    for _, written in batch:
+                        written.set_exception(e)
+                    return
+                time.sleep(delay)
+                delay *= 2
+        for (_, written), ok in zip(batch, inserted):
+            written.set_result(ok)
+
+    def _write_batch(self, rows):
+        """Insert rows in one transaction. Returns, per row, whether it was new."""
+        with self._db_lock:
+            try:
+                inserted = [self._conn.execute(
+                    "INSERT OR IGNORE INTO daily_submissions (day, player, streak, score, submitted_at) "
+                    "VALUES (?, ?, ?, ?, ?)", row).rowcount == 1 for row in rows]
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        self.written += sum(inserted)
+        self.batches += 1
+        return inserted
+
+    def flush(self, timeout=None):
+        """Block until every queued submission is written or dropped. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending.all_tasks_done:
+            while self._pending.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Stop the writer, waiting at most about `timeout` seconds for queued submissions."""
+        if not self.flush(timeout):
+            print(f"leaderboard: closing with {self._pending.unfinished_tasks} submissions unwritten", file=sys.stderr)
+        self._closed = True
+        self._writer.join(self.flush_interval + 1)
+        if not self._writer.is_alive():
+            self._conn.close()
+
+    # ---- reads ----
+
+    def _sync_from_db(self):
+        """Apply rows written by other processes since the last sync."""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT rowid, day, player, streak, score FROM daily_submissions WHERE rowid > ? ORDER BY rowid",
+                (self._last_rowid,)).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            for rowid, day, player, streak, score in rows:
+                board = self._days.setdefault(day, _DayBoard())
+                if player not in board.players:
+                    board.add(player, streak, score)
+                    self._version += 1
+                self._last_rowid = max(self._last_rowid, rowid)
+            self._changed.notify_all()
+
+    def _maybe_sync(self):
+        now = time.time()
+        if now - self._last_sync >= self.sync_interval:
+            self._last_sync = now
+            self._sync_from_db()
+
+    def histogram(self, day=None):
+        """Number of players per streak length, index 0..26."""
+        self._maybe_sync()
+        with self._lock:
+            board = self._days.get(day or utc_today())
+            return list(board.counts) if board else [0] * (MAX_STREAK + 1)
+
+    def rank(self, player, day=None):
+        self._maybe_sync()
+        with self._lock:
+            board = self._days.get(day or utc_today())
+            return board.rank(player) if board else None
+
+    def top(self, n=10, day=None):
+        self._maybe_sync()
+        with self._lock:
+            board = self._days.get(day or utc_today())
+            return board.top(n) if board else []
+
+    def wait_for_update(self, version, timeout=15.0):
+        """Block until the leaderboard changes past `version` (or timeout). Returns the current version."""
+        self._maybe_sync()
+        with self._lock:
+            self._changed.wait_for(lambda: self._version != version, timeout=timeout)
+            return self._version
+
+    def stats(self):
+        return {
+            "days": len(self._days),
+            "pending_writes": self._pending.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "version": self._version,
+        }
+
+
+def run_benchmark(submissions, threads, readers):
+    """Write-heavy benchmark: a midnight-UTC spike of submissions with concurrent readers."""
+    db_dir = tempfile.mkdtemp(prefix="lupo-bench-")
+    board = DailyLeaderboard(os.path.join(db_dir, "bench.sqlite3"))
+    day = utc_today()
+    latencies = []
+    latencies_lock = threading.Lock()
+    stop_reading = threading.Event()
+    reads = [0]
+
+    def writer(offset):
+        rng = random.Random(offset)
+        local = []
+        for i in range(offset, submissions, threads):
+            t0 = time.perf_counter()
+            board.submit(f"player{i}", min(MAX_STREAK, int(rng.expovariate(0.25))), day=day)
+            local.append(time.perf_counter() - t0)
+        with latencies_lock:
+            latencies.extend(local)
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while not stop_reading.is_set():
+            board.histogram(day)
+            board.top(10, day)
+            board.rank(f"player{rng.randrange(submissions)}", day)
+            reads[0] += 3
+
+    reader_threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in reader_threads + writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    accepted = time.perf_counter() - t0
+    board.flush()
+    committed = time.perf_counter() - t0
+    stop_reading.set()
+    for t in reader_threads:
+        t.join()
+
+    latencies.sort()
+    print(f"Submissions:   {submissions} from {threads} threads, {readers} concurrent readers")
+    print(f"Accepted:      {accepted:.2f}s ({submissions / accepted:,.0f}/s)")
+    print(f"Committed:     {committed:.2f}s ({submissions / committed:,.0f}/s, {board.batches} batches)")
+    print(f"Submit p50:    {latencies[len(latencies) // 2] * 1e6:.0f}µs")
+    print(f"Submit p99:    {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}µs")
+    print(f"Reads:         {reads[0]:,} during the spike")
+    print(f"Histogram:     {board.histogram(day)}")
+    board.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo Daily Challenge leaderboard tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Write-heavy benchmark")
+    bench.add_argument("--submissions", type=int, default=100000, help="Number of submissions (default: 100000)")
+    bench.add_argument("--threads", type=int, default=8, help="Submitting threads (default: 8)")
+    bench.add_argument("--readers", type=int, default=2, help="Concurrent reader threads (default: 2)")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.submissions, args.threads, args.readers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
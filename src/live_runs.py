@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Live Runs — Server-side Live Scoring runs: one committed move sequence per position.
+
+A run is created by the server when a player starts a challenge. Every move
+checked through the API is committed to the run before its verdict is sent,
+and the scoring rules decide what may follow it at that position (a retry
+after the game move, bonus moves after a best move). Anything else, such as a
+second main move at a position, is refused, so probing the verdicts of
+several moves costs a new run each time. Submissions score the committed
+moves, not a move list sent by the client.
+
+Runs live in SQLite so every gunicorn worker sees the same state. A commit
+is a compare-and-swap on the stored move list, so two workers racing on one
+run can't both win. A page reload resumes its run (state()) instead of
+starting another, and a cap on runs per client only counts runs that have
+a committed move, so opening the page costs nothing.
+
+Usage:
+    python -m src.live_runs stats [--db data/live_runs.sqlite3]
+"""
+
+import argparse
+import json
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+from src.scoring import commit_move, position_open
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "data" / "live_runs.sqlite3"
+
+# Runs are dropped this long after they were started
+MAX_RUN_AGE = 2 * 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS live_runs (
+    run_id TEXT PRIMARY KEY,
+    challenge_id TEXT NOT NULL,
+    client TEXT,
+    moves TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    submitted_at REAL
+);
+CREATE INDEX IF NOT EXISTS live_runs_by_client ON live_runs (challenge_id, client, created_at);
+"""
+
+
+class RunError(ValueError):
+    """A move or submission doesn't fit the run (unknown run, position already played, ...)."""
+
+
+class RunLimitReached(RunError):
+    """The run's client has already started the allowed number of runs on the challenge."""
+
+
+class RunStore:
+    """Live Scoring runs shared by all workers: run id → committed UCIs per position."""
+
+    def __init__(self, db_path=None, max_age=MAX_RUN_AGE):
+        self.db_path = str(db_path or DEFAULT_DB_PATH)
+        self.max_age = max_age
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def create(self, challenge_id, client=None):
+        """Start a run and return its id. Also drops runs older than max_age."""
+        run_id = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM live_runs WHERE created_at < ?", (now - self.max_age,))
+            self._conn.execute(
+                "INSERT INTO live_runs (run_id, challenge_id, client, moves, created_at) VALUES (?, ?, ?, ?, ?)",
+                (run_id, challenge_id, client, "[]", now))
+            self._conn.commit()
+        return run_id
+
+    def count(self, challenge_id, client, since):
+        """Runs with at least one committed move that a client started on a challenge since a timestamp."""
+        with self._lock:
+            return self._count(challenge_id, client, since)
+
+    def _count(self, challenge_id, client, since):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM live_runs WHERE challenge_id = ? AND client = ? AND created_at >= ? "
+            "AND moves != '[]'", (challenge_id, client, since)).fetchone()[0]
+
+    def _load(self, run_id, challenge_id):
+        """(stored moves JSON, client) of an open run."""
+        row = self._conn.execute(
+            "SELECT challenge_id, moves, submitted_at, client FROM live_runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None or row[0] != challenge_id:
+            raise RunError("unknown run")
+        if row[2] is not None:
+            raise RunError("run already submitted")
+        return row[1], row[3]
+
+    def state(self, run_id, challenge_id):
+        """Committed moves of an open run, to resume it (e.g. after a page reload)."""
+        with self._lock:
+            stored, _ = self._load(run_id, challenge_id)
+        return json.loads(stored)
+
+    def commit(self, run_id, challenge_id, table, index, uci, max_started=None, since=0):
+        """
+        Commit `uci` as the next move at position `index` of a run and return
+        its verdict (see scoring.commit_move). Positions are played in order;
+        moving on to the next position closes the current one.
+
+        With `max_started`, the run's first move is refused (RunLimitReached)
+        if its client already has that many runs with moves on the challenge
+        since `since`.
+
+        Raises RunError if the run doesn't accept the move, ScoringError if
+        the move isn't legal.
+        """
+        with self._lock:
+            stored, client = self._load(run_id, challenge_id)
+            moves = json.loads(stored)
+            if not moves and max_started is not None and self._count(challenge_id, client, since) >= max_started:
+                raise RunLimitReached("too many runs started on this challenge today")
+            if index > len(moves):
+                raise RunError("positions must be played in order")
+            played = moves[index] if index < len(moves) else []
+            if index < len(moves) - 1 or not position_open(table.positions[index], played):
+                raise RunError("position already played")
+            verdict = commit_move(table.positions[index], played, uci)
+            moves = moves[:index] + [played + [uci]]
+            cursor = self._conn.execute(
+                "UPDATE live_runs SET moves = ? WHERE run_id = ? AND moves = ? AND submitted_at IS NULL",
+                (json.dumps(moves), run_id, stored))
+            self._conn.commit()
+        if not cursor.rowcount:
+            raise RunError("run changed by another request, check the move again")
+        return verdict
+
+    def finish(self, run_id, challenge_id):
+        """Close a run for submission and return its committed moves. A run is submitted once."""
+        with self._lock:
+            stored, _ = self._load(run_id, challenge_id)
+            cursor = self._conn.execute(
+                "UPDATE live_runs SET submitted_at = ? WHERE run_id = ? AND submitted_at IS NULL",
+                (time.time(), run_id))
+            self._conn.commit()
+        if not cursor.rowcount:
+            raise RunError("run already submitted")
+        return json.loads(stored)
+
+    def stats(self):
+        with self._lock:
+            runs, submitted, oldest = self._conn.execute(
+                "SELECT COUNT(*), COUNT(submitted_at), MIN(created_at) FROM live_runs").fetchone()
+        return {
+            "runs": runs,
+            "submitted": submitted,
+            "oldest_age_seconds": round(time.time() - oldest) if oldest else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo Live Scoring run tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats = sub.add_parser("stats", help="Stored runs")
+    stats.add_argument("--db", default=str(DEFAULT_DB_PATH), help="Database path")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        if not Path(args.db).exists():
+            print(f"No run store at {args.db}", file=sys.stderr)
+            return 1
+        store = RunStore(args.db)
+        s = store.stats()
+        store.close()
+        print(f"Runs:        {s['runs']} ({s['submitted']} submitted)")
+        if s["oldest_age_seconds"] is not None:
+            print(f"Oldest:      {s['oldest_age_seconds'] / 3600:.1f}h (dropped after {MAX_RUN_AGE // 3600}h)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Opening Book — Precomputed engine evals for early positions, keyed by Zobrist hash.
+
+Every Dr Lupo game sacrifices the queen within the first 10 moves, so the
+sacrifice positions and the plies right after them repeat heavily across
+players. The book is built offline from PGN databases: every position that
+occurs often enough in the first plies is searched once with multipv over all
+legal moves, and the eval of each move is stored on disk.
+
+File format: a flat array of 16-byte big-endian records sorted by key and
+searched with binary search through mmap (the same idea as a Polyglot book):
+
+    key    uint64  chess.polyglot.zobrist_hash of the position
+    move   uint16  from_square | to_square << 6 | promotion << 12
+    eval   int32   centipawns for the side to move, mate = ±(100000 - plies)
+    depth  uint8   search depth of the eval
+    pad    1 byte
+
+Usage:
+    python -m src.opening_book build games.pgn --max-ply 30 --min-count 3 --depth 22
+    python -m src.opening_book probe "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+import chess
+import chess.polyglot
+
+BOOK_MATE_SCORE = 100000
+DEFAULT_BOOK_PATH = Path(__file__).resolve().parent.parent / "books" / "opening_book.bin"
+
+_RECORD = struct.Struct(">QHiBx")
+_KEY = struct.Struct(">Q")
+
+
+def encode_move(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(value):
+    promotion = (value >> 12) & 0x7
+    return chess.Move(value & 0x3F, (value >> 6) & 0x3F, promotion or None)
+
+
+def rescale_mate(eval_cp, mate_score):
+    """Convert a book eval (mate = ±(100000 - plies)) to another mate_score convention."""
+    if abs(eval_cp) <= BOOK_MATE_SCORE // 2 or mate_score == BOOK_MATE_SCORE:
+        return eval_cp
+    plies = BOOK_MATE_SCORE - abs(eval_cp)
+    return (mate_score - plies) if eval_cp > 0 else -(mate_score - plies)
+
+
+class OpeningBook:
+    """Read-only view of an on-disk opening book."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._count = size // _RECORD.size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def _key_at(self, index):
+        return _KEY.unpack_from(self._mm, index * _RECORD.size)[0]
+
+    def _first_index(self, key):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def entries(self, key):
+        """Yield (move, eval_cp, depth) for every record stored under a Zobrist key."""
+        i = self._first_index(key)
+        while i < self._count:
+            k, move, eval_cp, depth = _RECORD.unpack_from(self._mm, i * _RECORD.size)
+            if k != key:
+                break
+            yield decode_move(move), eval_cp, depth
+            i += 1
+
+    def lookup(self, board, depth, mate_score=BOOK_MATE_SCORE):
+        """
+        Return the book evals for every legal move of a position, or None.
+
+        A position only counts as a hit when it was searched at least as deep as
+        requested and the stored moves cover exactly the legal moves (which also
+        guards against Zobrist collisions).
+
+        Returns:
+            list: [{"move": chess.Move, "eval_cp": int}] sorted best first,
+            evals from the side to move.
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        found = []
+        for move, eval_cp, entry_depth in self.entries(key):
+            if entry_depth < depth:
+                found = None
+                break
+            found.append({"move": move, "eval_cp": rescale_mate(eval_cp, mate_score)})
+
+        legal = set(board.legal_moves)
+        if not found or len(found) != len(legal) or any(e["move"] not in legal for e in found):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        found.sort(key=lambda e: e["eval_cp"], reverse=True)
+        return found
+
+
+def load_book(path=None):
+    """Open the opening book at `path` (or the default location); None if there is none."""
+    path = Path(path) if path else DEFAULT_BOOK_PATH
+    if not path.exists():
+        return None
+    return OpeningBook(path)
+
+
+def collect_positions(pgn_paths, max_ply, min_count):
+    """Count early positions across PGN databases, reading games lazily."""
+    import chess.pgn
+
+    counts = {}
+    games = 0
+    for pgn_path in pgn_paths:
+        print(f"Reading {pgn_path} ...")
+        with open(pgn_path, encoding="utf-8", errors="replace") as f:
+            while True:
+                game = chess.pgn.read_game(f)
+                if game is None:
+                    break
+                games += 1
+                board = game.board()
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= max_ply:
+                        break
+                    key = chess.polyglot.zobrist_hash(board)
+                    entry = counts.get(key)
+                    if entry is None:
+                        counts[key] = [1, board.fen()]
+                    else:
+                        entry[0] += 1
+                    board.push(move)
+                if games % 1000 == 0:
+                    print(f"  {games} games, {len(counts)} distinct positions")
+
+    frequent = [(key, fen) for key, (count, fen) in counts.items() if count >= min_count]
+    print(f"Read {games} games: {len(counts)} distinct positions, {len(frequent)} seen ≥{min_count} times")
+    return frequent
+
+
+def build_book(positions, engine_path, depth, output_path):
+    """Search every position with multipv over all legal moves and write the book."""
+    import chess.engine
+
+    records = []
+    engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+    try:
+        for i, (key, fen) in enumerate(positions):
+            board = chess.Board(fen)
+            num_legal = board.legal_moves.count()
+            if num_legal == 0:
+                continue
+            t0 = time.time()
+            infos = engine.analyse(board, chess.engine.Limit(depth=depth), multipv=num_legal)
+            for info in infos:
+                eval_cp = info["score"].relative.score(mate_score=BOOK_MATE_SCORE)
+                records.append((key, encode_move(info["pv"][0]), eval_cp, depth))
+            print(f"[{i + 1}/{len(positions)}] {num_legal} moves in {time.time() - t0:.1f}s")
+    finally:
+        engine.quit()
+
+    records.sort()
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        for record in records:
+            f.write(_RECORD.pack(*record))
+    os.replace(tmp_path, output_path)
+    return len(records)
+
+
+def main():
+    from src.challenge_builder import find_stockfish
+
+    parser = argparse.ArgumentParser(description="Build or probe the Dr Lupo opening book")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build the book from PGN databases")
+    build.add_argument("pgn", nargs="+", help="PGN database file(s)")
+    build.add_argument("--max-ply", type=int, default=30, help="Only book positions before this ply (default: 30)")
+    build.add_argument("--min-count", type=int, default=3, help="Minimum occurrences to book a position (default: 3)")
+    build.add_argument("--depth", type=int, default=22, help="Stockfish depth (default: 22)")
+    build.add_argument("--engine", default=None, help="Path to Stockfish binary")
+    build.add_argument("--output", default=str(DEFAULT_BOOK_PATH), help=f"Output path (default: {DEFAULT_BOOK_PATH})")
+
+    probe = sub.add_parser("probe", help="Print the book entry for a FEN")
+    probe.add_argument("fen", help="Position FEN")
+    probe.add_argument("--book", default=str(DEFAULT_BOOK_PATH), help="Book path")
+
+    args = parser.parse_args()
+
+    if args.command == "probe":
+        book = load_book(args.book)
+        if book is None:
+            print(f"No book at {args.book}")
+            return 1
+        board = chess.Board(args.fen)
+        entries = list(book.entries(chess.polyglot.zobrist_hash(board)))
+        if not entries:
+            print("Position not in book")
+            return 1
+        for move, eval_cp, depth in sorted(entries, key=lambda e: e[1], reverse=True):
+            print(f"  {board.san(move):>8} {eval_cp:>+7}cp  (depth {depth})")
+        return 0
+
+    positions = collect_positions(args.pgn, args.max_ply, args.min_count)
+    engine_path = args.engine or find_stockfish()
+    count = build_book(positions, engine_path, args.depth, args.output)
+    print(f"\n✅ Book saved to {args.output} ({count} moves, {len(positions)} positions)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Positions — Position identity and a shared cache for deduplicating analysis.
+
+FEN strings carry the halfmove clock and fullmove number, so the same position
+reached by transposition looks different to anything keyed by FEN. Every
+analysis path (analyzer, challenge builder, Survival endpoint) keys its work by
+`position_key` instead: the Zobrist hash of pieces, side to move, castling
+rights and a capturable en passant square (chess.polyglot semantics).
+"""
+
+import threading
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+
+
+def position_key(board):
+    """Identity of a position, independent of move counters."""
+    return chess.polyglot.zobrist_hash(board)
+
+
+class PositionCache:
+    """
+    Results of engine work keyed by (kind, position, depth).
+
+    A result searched at depth d also answers requests for any depth <= d.
+    Thread-safe; optionally bounded (least recently used entries are evicted).
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # (kind, key) → (depth, value)
+        self._seen = {}             # (kind, key) → number of requests
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, kind, board, depth):
+        """Return the cached value for this position at >= depth, or None."""
+        k = (kind, position_key(board))
+        with self._lock:
+            self.lookups += 1
+            self._seen[k] = self._seen.get(k, 0) + 1
+            entry = self._data.get(k)
+            if entry is None or entry[0] < depth:
+                return None
+            self._data.move_to_end(k)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, kind, board, depth, value):
+        k = (kind, position_key(board))
+        with self._lock:
+            entry = self._data.get(k)
+            if entry is not None and entry[0] > depth:
+                return
+            self._data[k] = (depth, value)
+            self._data.move_to_end(k)
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self._seen.pop(evicted, None)
+                if len(self._seen) > 2 * self.maxsize:
+                    self._seen = {k: n for k, n in self._seen.items() if k in self._data}
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """How many distinct positions were requested, and how many were shared."""
+        with self._lock:
+            unique = len(self._seen)
+            shared = sum(1 for n in self._seen.values() if n > 1)
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "unique_positions": unique,
+                "shared_positions": shared,
+                "cached": len(self._data),
+            }
@@ -0,0 +1,183 @@
+"""
+Precompressed — Encoded variants of static payloads, built once and served from memory.
+
+Challenge JSON, the chessground vendor assets and the (context-free) page
+templates never change between requests, yet compressing them per response
+costs CPU every time. A Payload holds the identity bytes plus gzip (and, if
+the optional `brotli` package is installed, br) encodings, and a strong ETag
+per encoding. PrecompressedCache keeps one Payload per file and rebuilds it
+only when the file's mtime changes.
+
+The challenge builder writes `<file>.gz` / `<file>.br` next to each challenge
+when it saves it (write_precompressed), so the web app only reads them.
+
+Usage:
+    python -m src.precompressed challenges/*.json
+"""
+
+import gzip
+import hashlib
+import os
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def write_precompressed(path):
+    """Write the encoded variants of `path` next to it (<path>.gz, <path>.br)."""
+    path = str(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    written = []
+    for encoding in ENCODINGS:
+        out_path = path + SUFFIXES[encoding]
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compress(data, encoding))
+        os.replace(tmp_path, out_path)
+        written.append(out_path)
+    return written
+
+
+def choose_encoding(accept_encoding, available):
+    """Pick the best encoding the client accepts: br, then gzip, then identity."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+class Payload:
+    """One resource in every available encoding, with a strong ETag per encoding."""
+
+    def __init__(self, data, variants=None, version=None):
+        self.version = version
+        self.variants = {"identity": data}
+        self.variants.update(variants or {})
+        self._digest = hashlib.sha256(data).hexdigest()[:32]
+
+    def etag(self, encoding):
+        # Each encoding is a different representation, so it gets its own strong ETag
+        return self._digest if encoding == "identity" else f"{self._digest}-{encoding}"
+
+    @property
+    def size(self):
+        return sum(len(v) for v in self.variants.values())
+
+
+def build_payload(data, compressible=True, version=None, sidecar_path=None):
+    """Encode `data`, reusing up-to-date sidecar files next to `sidecar_path` if there are any."""
+    variants = {}
+    if compressible:
+        for encoding in ENCODINGS:
+            encoded = None
+            if sidecar_path is not None:
+                encoded = _read_sidecar(sidecar_path, encoding)
+            variants[encoding] = encoded if encoded is not None else compress(data, encoding)
+    return Payload(data, variants, version)
+
+
+def _read_sidecar(path, encoding):
+    sidecar = path + SUFFIXES[encoding]
+    try:
+        if os.stat(sidecar).st_mtime < os.stat(path).st_mtime:
+            return None  # stale: the source was rewritten after it
+        with open(sidecar, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class PrecompressedCache:
+    """Payloads keyed by name, rebuilt only when their version (e.g. file mtime) changes."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, key, version, build):
+        """Return the Payload for `key` at `version`, calling build() to create it if needed."""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None and payload.version == version:
+                self.hits += 1
+                return payload
+        payload = build()
+        payload.version = version
+        with self._lock:
+            self._entries[key] = payload
+            self.builds += 1
+        return payload
+
+    def get_file(self, path, compressible=True):
+        """Payload for a file on disk, or None if it doesn't exist."""
+        path = str(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+        def build():
+            with open(path, "rb") as f:
+                data = f.read()
+            return build_payload(data, compressible, sidecar_path=path)
+
+        return self.get(path, mtime, build)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(p.size for p in self._entries.values()),
+                "hits": self.hits,
+                "builds": self.builds,
+                "encodings": list(ENCODINGS),
+            }
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        print("Usage: python -m src.precompressed FILE [FILE ...]", file=sys.stderr)
+        return 1
+    for path in paths:
+        size = os.path.getsize(path)
+        for out_path in write_precompressed(path):
+            out_size = os.path.getsize(out_path)
+            print(f"{out_path}: {size:,} → {out_size:,} bytes ({size / max(out_size, 1):.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Profiling — Phase timers for the analyzer, the challenge builder and the web app.
+
+Code marks its phases (Lichess fetch, PGN parsing, engine search, SAN
+generation, serialization, ...) with `profiler.phase(name)`, and the
+positions it works on with `profiler.position(label)`. Phase names are
+single words; frames with a space ("game mfJW36UO", "position 14.") only
+label what is being worked on. Phases nest, and each one's self time (its
+time minus its sub-phases') is added to its stack, so the result is
+exactly a flame graph:
+
+    game mfJW36UO;analyze_moves;position 14.;search_top5 1523401
+
+which is the "collapsed stack" format read by flamegraph.pl, speedscope
+and inferno (values are microseconds). The summary adds self time up per
+phase and inclusive time per position.
+
+Phases opened in worker threads are timed on their own thread and attached
+with `under=` to the stack that started them, so with parallel searches
+the totals are thread time and add up to more than the wall time.
+
+A disabled profiler (NULL_PROFILER) hands out one shared no-op context
+manager, so instrumented code costs nothing measurable when not profiling.
+
+Usage:
+    python -m src.dr_lupo_analyzer https://lichess.org/XXXXXXXX --profile analyzer.folded
+    python -m src.challenge_builder https://lichess.org/mfJW36UO#14 --profile builder.folded
+    python -m src.profiling report analyzer.folded
+    flamegraph.pl analyzer.folded > analyzer.svg
+"""
+
+import argparse
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+POSITION_PREFIX = "position "
+
+
+class Profiler:
+    """Self time per phase stack, collected from any number of threads."""
+
+    enabled = True
+
+    def __init__(self):
+        self._self_time = defaultdict(float)  # stack (tuple of phase names) → seconds
+        self._calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _frames(self):
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def current_stack(self):
+        """The calling thread's open phases, to hand to `under=` in worker threads."""
+        frames = self._frames()
+        return frames[-1][0] if frames else ()
+
+    @contextmanager
+    def phase(self, name, under=()):
+        """Time the block as `name`, nested in the thread's open phase (or in `under`)."""
+        frames = self._frames()
+        stack = (frames[-1][0] if frames else tuple(under)) + (name,)
+        frame = [stack, 0.0]  # stack, time spent in sub-phases
+        frames.append(frame)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            frames.pop()
+            if frames:
+                frames[-1][1] += elapsed
+            with self._lock:
+                self._self_time[stack] += elapsed - frame[1]
+                self._calls[stack] += 1
+
+    def position(self, label, under=()):
+        """A phase for one analysed position, reported separately in the summary."""
+        return self.phase(POSITION_PREFIX + label, under)
+
+    def collapsed(self):
+        """Collapsed stack lines (`a;b;c <microseconds>`), one per stack."""
+        with self._lock:
+            items = sorted(self._self_time.items())
+        return [f"{';'.join(_frame_name(n) for n in stack)} {round(seconds * 1e6)}"
+                for stack, seconds in items if seconds > 0]
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in self.collapsed())
+        return path
+
+    def phase_totals(self):
+        """{phase: (self seconds, calls)}; self time of label frames ("game X", "position Y") counts as "other"."""
+        totals = defaultdict(lambda: [0.0, 0])
+        with self._lock:
+            for stack, seconds in self._self_time.items():
+                name = stack[-1]
+                if " " in name:
+                    name = "other"
+                totals[name][0] += seconds
+                totals[name][1] += self._calls.get(stack, 0)
+        return {name: tuple(v) for name, v in totals.items()}
+
+    def position_totals(self):
+        """{position stack: inclusive seconds}, keyed by the stack down to the position frame."""
+        totals = defaultdict(float)
+        with self._lock:
+            for stack, seconds in self._self_time.items():
+                for i, name in enumerate(stack):
+                    if name.startswith(POSITION_PREFIX):
+                        totals[stack[:i + 1]] += seconds
+                        break
+        return dict(totals)
+
+    def server_timing(self):
+        """The phase totals as a Server-Timing header value (shown by browser dev tools)."""
+        phases = sorted(self.phase_totals().items(), key=lambda kv: -kv[1][0])
+        return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', name)};dur={seconds * 1000:.1f}"
+                         for name, (seconds, _) in phases)
+
+    def print_report(self, out=sys.stderr, top=10):
+        phases = sorted(self.phase_totals().items(), key=lambda kv: -kv[1][0])
+        total = sum(seconds for seconds, _ in dict(phases).values()) or 1
+        print(f"\n{'phase':24} {'seconds':>9} {'share':>6} {'calls':>7}", file=out)
+        for name, (seconds, calls) in phases:
+            print(f"{name[:24]:24} {seconds:9.3f} {seconds / total:6.1%} {calls or '':>7}", file=out)
+        positions = sorted(self.position_totals().items(), key=lambda kv: -kv[1])
+        if positions:
+            print(f"\nSlowest positions ({min(top, len(positions))} of {len(positions)}):", file=out)
+            for stack, seconds in positions[:top]:
+                print(f"  {seconds:8.3f}s  {' > '.join(stack)}", file=out)
+
+    @classmethod
+    def load(cls, path):
+        """Read a collapsed-stack file back (call counts aren't stored in it)."""
+        profiler = cls()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, value = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    profiler._self_time[tuple(stack.split(";"))] += int(value) / 1e6
+        return profiler
+
+
+def _frame_name(name):
+    # ";" separates frames in the collapsed format
+    return name.replace(";", ",")
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off: every phase is the same no-op context manager."""
+
+    enabled = False
+    _noop = nullcontext()
+
+    def phase(self, name, under=()):
+        return self._noop
+
+    def position(self, label, under=()):
+        return self._noop
+
+    def current_stack(self):
+        return ()
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def position_label(board):
+    """Label of the position before a move: "14." (White to move) or "14..." (Black)."""
+    return f"{board.fullmove_number}{'.' if board.turn else '...'}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo profiling tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Per-phase and per-position summary of a collapsed-stack profile")
+    report.add_argument("profile", help="Collapsed-stack file written with --profile")
+    report.add_argument("--top", type=int, default=10, help="Slowest positions to list (default: 10)")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        Profiler.load(args.profile).print_report(out=sys.stdout, top=args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Scoring — Live Scoring rules as a Python engine, shared by the builder and the web app.
+
+Mirrors handleMainMove / handleRetryMove / handleBonusMove in challenge.html:
+
+  - A best move (one of the position's best_moves) scores +3 and opens a bonus
+    round: every further distinct best move scores +1, up to 3 best moves found
+    in total. The first miss ends the bonus round without a penalty.
+  - Any other move costs (best_eval - eval) / 100 points.
+  - If that move is the one played in the game, the player may retry once: a
+    best move then scores +3 (no bonus round) and the game move's penalty is
+    waived; a miss costs the retry move's penalty instead.
+
+A run is submitted as one list of UCIs per position, in the order they were
+played, e.g. [["e2e4", "d2d4"], ["g1f3"], ...]. Runs may stop early.
+
+ScoringTable precomputes per-position hash maps (UCI → eval, best rank,
+penalty) once per challenge, so scoring a run is a handful of dict lookups
+per move and thousands of submissions can be scored per second.
+"""
+
+from collections import namedtuple
+
+POINTS_BEST = 3
+POINTS_BONUS = 1
+MAX_BEST_FOUND = 3
+
+PositionTable = namedtuple("PositionTable", "evals best_ranks penalties game_move max_points")
+
+
+class ScoringError(ValueError):
+    """A submitted run does not fit the challenge (illegal move, too many moves, ...)."""
+
+
+def max_points_for_position(best_move_count):
+    """Same as calcMaxForPosition in challenge.html."""
+    bc = min(MAX_BEST_FOUND, best_move_count)
+    return POINTS_BEST + max(0, bc - 1) * POINTS_BONUS
+
+
+class ScoringTable:
+    """Precomputed lookup tables for scoring runs against one challenge."""
+
+    def __init__(self, challenge):
+        self.positions = []
+        for pos in challenge["positions"]:
+            evals = {m["uci"]: m["eval_cp"] for m in pos["all_moves"]}
+            best_moves = pos["best_moves"]
+            best_eval = best_moves[0]["eval_cp"]
+            self.positions.append(PositionTable(
+                evals=evals,
+                best_ranks={m["uci"]: rank for rank, m in enumerate(best_moves, start=1)},
+                penalties={uci: max(0, best_eval - ev) / 100 for uci, ev in evals.items()},
+                game_move=pos.get("game_move_uci"),
+                max_points=max_points_for_position(pos["best_move_count"]),
+            ))
+        self.max_score = sum(p.max_points for p in self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def check_move(table, uci):
+    """
+    Verdict for one move at one position (a PositionTable): no evals, and
+    nothing about the moves that weren't played. Raises ScoringError for a
+    move that isn't legal there.
+    """
+    if uci not in table.evals:
+        raise ScoringError(f"illegal move {uci}")
+    rank = table.best_ranks.get(uci)
+    return {
+        "uci": uci,
+        "is_best": rank is not None,
+        "best_rank": rank,
+        "penalty": table.penalties[uci],
+        "is_game_move": uci == table.game_move,
+    }
+
+
+def position_open(table, moves):
+    """Whether a position accepts another move after `moves` (a valid prefix, see _score_position)."""
+    if not moves:
+        return True
+    main = moves[0]
+    if main in table.best_ranks:
+        missed = len(set(moves)) < len(moves) or any(uci not in table.best_ranks for uci in moves)
+        return not missed and len(moves) < min(MAX_BEST_FOUND, len(table.best_ranks))
+    return main == table.game_move and len(moves) == 1
+
+
+def commit_move(table, moves, uci):
+    """
+    Judge `uci` as the next move played at a position where `moves` were
+    already committed. Returns the verdict plus "open" (whether a retry or
+    bonus move may follow). Raises ScoringError if the position is closed.
+    """
+    if not position_open(table, moves):
+        raise ScoringError("position already played")
+    verdict = check_move(table, uci)
+    verdict["open"] = position_open(table, moves + [uci])
+    return verdict
+
+
+def _score_position(table, moves):
+    """Score the moves played at one position. Returns (points, is_best, bonus_count, retried)."""
+    if not moves:
+        raise ScoringError("empty move list for a position")
+    for uci in moves:
+        if uci not in table.evals:
+            raise ScoringError(f"illegal move {uci}")
+
+    main = moves[0]
+    if main in table.best_ranks:
+        found = {main}
+        bonus = 0
+        i = 1
+        while i < len(moves) and len(found) < MAX_BEST_FOUND and len(found) < len(table.best_ranks):
+            uci = moves[i]
+            i += 1
+            if uci in table.best_ranks and uci not in found:
+                found.add(uci)
+                bonus += 1
+            else:
+                break  # a bonus miss ends the round
+        if i < len(moves):
+            raise ScoringError("moves after the bonus round ended")
+        return POINTS_BEST + bonus * POINTS_BONUS, True, bonus, False
+
+    if main == table.game_move and len(moves) > 1:
+        if len(moves) > 2:
+            raise ScoringError("only one retry is allowed")
+        retry = moves[1]
+        if retry in table.best_ranks:
+            return POINTS_BEST, True, 0, True
+        return -table.penalties[retry], False, 0, True
+
+    if len(moves) > 1:
+        raise ScoringError("only the game move can be retried")
+    return -table.penalties[main], False, 0, False
+
+
+def score_run(table, run):
+    """
+    Validate and score one run.
+
+    Returns:
+        dict: score, best_count, streak (consecutive best moves from the start),
+        max_streak, positions_played, max_score and per-position points.
+    """
+    if len(run) > len(table.positions):
+        raise ScoringError(f"run has {len(run)} positions, challenge has {len(table.positions)}")
+
+    score = 0.0
+    best_count = 0
+    streak = 0
+    max_streak = 0
+    leading_streak = 0
+    per_position = []
+    for index, (pos_table, moves) in enumerate(zip(table.positions, run)):
+        try:
+            points, is_best, bonus, retried = _score_position(pos_table, moves)
+        except ScoringError as e:
+            raise ScoringError(f"position {index + 1}: {e}") from None
+        score += points
+        if is_best:
+            best_count += 1
+            streak += 1
+            max_streak = max(max_streak, streak)
+            if streak == index + 1:
+                leading_streak = streak
+        else:
+            streak = 0
+        per_position.append({"points": round(points, 2), "is_best": is_best, "bonus": bonus, "retried": retried})
+
+    return {
+        "score": round(score, 2),
+        "best_count": best_count,
+        "streak": leading_streak,
+        "max_streak": max_streak,
+        "positions_played": len(run),
+        "max_score": table.max_score,
+        "positions": per_position,
+    }
+
+
+def game_run(challenge):
+    """The run made by the real player: the game move at every position, no retries or bonuses."""
+    return [[pos["game_move_uci"]] for pos in challenge["positions"]]
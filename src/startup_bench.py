@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Startup Bench — Import-time budget for the CLI entry points and the web app.
+
+Each target is run in a fresh interpreter with `-X importtime`, several
+times; the fastest run counts. Budgets are multiples of a bare
+`import chess`, measured the same way in the same rounds (baseline, then
+every target, repeated), so they hold on slow and fast hardware alike and
+a busy moment slows the baseline as much as the targets.
+
+A target fails if it loads a module it must not (e.g. the web app
+importing requests or chess.engine before a request needs them). Going over
+budget is reported, and only fails the run with --strict.
+
+Usage:
+    python -m src.startup_bench            # exit status 1 if a target imports a forbidden module
+    python -m src.startup_bench --strict   # ... or goes over its budget
+    python -m src.startup_bench --runs 10 --top 15
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+BASELINE = ("import chess", ["-c", "import chess"])
+
+# (name, interpreter arguments, import budget in multiples of the baseline, modules that must not be imported)
+TARGETS = [
+    ("import app", ["-c", "import app"], 5.0,
+     ["requests", "chess.engine", "chess.pgn", "src.dr_lupo_analyzer", "matplotlib", "numpy"]),
+    ("import src.dr_lupo_analyzer", ["-c", "import src.dr_lupo_analyzer"], 1.5,
+     ["requests", "chess.engine", "chess.pgn", "matplotlib"]),
+    ("analyzer --help", ["-m", "src.dr_lupo_analyzer", "--help"], 1.5,
+     ["requests", "chess.engine", "chess.pgn", "matplotlib"]),
+    ("import src.opening_book", ["-c", "import src.opening_book"], 1.3,
+     ["requests", "chess.engine", "chess.pgn"]),
+    ("import src.scoring", ["-c", "import src.scoring"], 0.2,
+     ["chess"]),
+]
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def run_target(args):
+    """Run one target. Returns (wall_ms, {module: (self_us, cumulative_us, level)})."""
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=REPO_DIR,
+                          capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            modules[m.group(4)] = (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+    return wall_ms, modules
+
+
+def import_ms(modules):
+    """Total import time of everything imported after interpreter startup (top-level entries)."""
+    startup = {"site", "encodings", "_frozen_importlib_external", "zipimport", "codecs", "io", "abc"}
+    return sum(cum for name, (_, cum, level) in modules.items()
+               if level == 0 and name not in startup) / 1000
+
+
+def fastest_runs(commands, runs):
+    """For each command, (import_ms, wall_ms, modules) of its run with the least import time."""
+    best = [None] * len(commands)
+    for _ in range(runs):
+        for i, args in enumerate(commands):
+            wall_ms, modules = run_target(args)
+            total = import_ms(modules)
+            if best[i] is None or total < best[i][0]:
+                best[i] = (total, wall_ms, modules)
+    return best
+
+
+def bench(runs, top, strict=False):
+    failures = 0
+    results = fastest_runs([BASELINE[1]] + [args for _, args, _, _ in TARGETS], runs)
+    baseline_ms, baseline_wall, _ = results[0]
+    print(f"{'target':32} {'imports':>9} {'budget':>14} {'wall':>8}")
+    print(f"{BASELINE[0]:32} {baseline_ms:7.1f}ms {'(baseline)':>14} {baseline_wall:6.0f}ms")
+    for (name, _, budget, forbidden), (total, wall_ms, modules) in zip(TARGETS, results[1:]):
+        budget_ms = budget * baseline_ms
+        loaded = [m for m in forbidden if m in modules]
+        over = total > budget_ms
+        failures += bool(loaded) or (strict and over)
+        status = "FORBIDDEN IMPORT" if loaded else "over budget" if over else "ok"
+        print(f"{name:32} {total:7.1f}ms {budget:4.1f}x {budget_ms:6.1f}ms {wall_ms:6.0f}ms  {status}")
+        if loaded:
+            print(f"    must not import: {', '.join(loaded)}")
+        if top:
+            heaviest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+            for module, (self_us, _, _) in heaviest:
+                print(f"    {self_us / 1000:7.1f}ms  {module}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo startup (import time) benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per target; the fastest counts (default: 5)")
+    parser.add_argument("--top", type=int, default=0, help="Show the N heaviest imports per target")
+    parser.add_argument("--strict", action="store_true", help="Also fail if a target goes over its budget")
+    args = parser.parse_args()
+    return 1 if bench(args.runs, args.top, args.strict) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
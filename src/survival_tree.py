@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Survival Tree — Explored Survival Mode branches, persisted and shared per challenge.
+
+Every branch a player walks off the main line costs an engine search (the
+opponent's reply plus a full multipv analysis of the resulting position).
+The tree stores each explored node in SQLite, keyed by
+
+    (challenge_id, path)   path = UCIs from the challenge's first position,
+                           ending with the player's move
+
+so the next player who walks the same branch gets the stored answer instantly
+instead of waiting for Stockfish. A node searched at depth d also answers
+requests for any depth <= d; deeper searches replace shallower ones.
+
+Lookups never write: hit counts are kept in memory and added to the stored
+counts in one transaction every few seconds by a background thread, and on
+close().
+
+Usage:
+    python -m src.survival_tree stats [--db data/survival_tree.sqlite3] [--challenge ID]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "data" / "survival_tree.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS survival_nodes (
+    challenge_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    ply INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    opponent_reply_uci TEXT NOT NULL,
+    all_moves TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (challenge_id, path)
+)
+"""
+
+
+def path_key(moves):
+    """Store a move path (list of UCIs) as one string."""
+    return " ".join(moves)
+
+
+class SurvivalTree:
+    """Persistent Survival Mode branches: (challenge, move path) → opponent reply + move list."""
+
+    def __init__(self, db_path=None, hit_flush_interval=5.0):
+        self.db_path = str(db_path or DEFAULT_DB_PATH)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.inserted = 0
+
+        self.hit_flush_interval = hit_flush_interval
+        self._pending_hits = Counter()  # (challenge_id, path) → hits not yet stored
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="survival-tree-hits", daemon=True)
+        self._flusher.start()
+
+    def get(self, challenge_id, moves, depth):
+        """
+        Return (opponent_reply_uci, all_moves) for an explored node searched at
+        >= depth, or None. all_moves is None if the opponent's reply ends the game.
+        """
+        key = path_key(moves)
+        with self._lock:
+            self.lookups += 1
+            row = self._conn.execute(
+                "SELECT depth, opponent_reply_uci, all_moves FROM survival_nodes "
+                "WHERE challenge_id = ? AND path = ?", (challenge_id, key)).fetchone()
+            if row is None or row[0] < depth:
+                return None
+            self.hits += 1
+            self._pending_hits[challenge_id, key] += 1
+        all_moves = json.loads(row[2]) if row[2] is not None else None
+        return row[1], all_moves
+
+    def put(self, challenge_id, moves, depth, opponent_reply_uci, all_moves):
+        """Store an explored node unless a deeper search of it is already stored."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO survival_nodes (challenge_id, path, ply, depth, opponent_reply_uci, all_moves, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (challenge_id, path) DO UPDATE SET "
+                "depth = excluded.depth, opponent_reply_uci = excluded.opponent_reply_uci, "
+                "all_moves = excluded.all_moves "
+                "WHERE excluded.depth > survival_nodes.depth",
+                (challenge_id, path_key(moves), len(moves), depth, opponent_reply_uci,
+                 json.dumps(all_moves) if all_moves is not None else None, time.time()))
+            self._conn.commit()
+            if cursor.rowcount:
+                self.inserted += 1
+
+    def flush_hits(self):
+        """Add the hits counted since the last flush to the stored counts, in one transaction."""
+        with self._lock:
+            if not self._pending_hits:
+                return
+            pending, self._pending_hits = self._pending_hits, Counter()
+            try:
+                self._conn.executemany(
+                    "UPDATE survival_nodes SET hits = hits + ? WHERE challenge_id = ? AND path = ?",
+                    [(count, challenge_id, key) for (challenge_id, key), count in pending.items()])
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                self._pending_hits.update(pending)  # retried on the next flush
+                print(f"survival tree: could not store {sum(pending.values())} hits: {e}", file=sys.stderr)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.hit_flush_interval):
+            self.flush_hits()
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        self.flush_hits()
+        with self._lock:
+            self._conn.close()
+
+    def storage_bytes(self):
+        """Size of the database on disk, including the write-ahead log."""
+        return sum(os.path.getsize(p) for p in (self.db_path, self.db_path + "-wal") if os.path.exists(p))
+
+    def stats(self, challenge_id=None):
+        """
+        Tree growth (nodes, deepest path, nodes added in the last day), hit
+        ratio of this process and storage size. Restricted to one challenge if
+        `challenge_id` is given.
+        """
+        where, params = ("WHERE challenge_id = ?", (challenge_id,)) if challenge_id else ("", ())
+        self.flush_hits()
+        with self._lock:
+            nodes, challenges, max_ply, stored_hits = self._conn.execute(
+                f"SELECT COUNT(*), COUNT(DISTINCT challenge_id), MAX(ply), SUM(hits) FROM survival_nodes {where}",
+                params).fetchone()
+            recent = self._conn.execute(
+                f"SELECT COUNT(*) FROM survival_nodes {where} {'AND' if where else 'WHERE'} created_at >= ?",
+                params + (time.time() - 86400,)).fetchone()[0]
+        return {
+            "nodes": nodes,
+            "challenges": challenges,
+            "max_ply": max_ply or 0,
+            "nodes_last_24h": recent,
+            "stored_hits": stored_hits or 0,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else None,
+            "inserted": self.inserted,
+            "storage_bytes": self.storage_bytes(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dr Lupo Survival tree tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats = sub.add_parser("stats", help="Show tree growth and storage size")
+    stats.add_argument("--db", default=None, help=f"Database path (default: {DEFAULT_DB_PATH})")
+    stats.add_argument("--challenge", default=None, help="Restrict to one challenge ID")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        db_path = args.db or DEFAULT_DB_PATH
+        if not os.path.exists(db_path):
+            print(f"No Survival tree at {db_path}", file=sys.stderr)
+            return 1
+        tree = SurvivalTree(db_path)
+        s = tree.stats(args.challenge)
+        tree.close()
+        print(f"Nodes:       {s['nodes']} across {s['challenges']} challenge(s)")
+        print(f"Deepest:     {s['max_ply']} plies from the challenge start")
+        print(f"Last 24h:    {s['nodes_last_24h']} new nodes")
+        print(f"Served:      {s['stored_hits']} answers from the tree")
+        print(f"Storage:     {s['storage_bytes'] / 1024:.1f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Tablebase — Optional Syzygy probing so simplified positions skip the engine.
+
+With few enough pieces on the board, a local Syzygy tablebase answers every
+legal move exactly (WDL + DTZ). Those answers are mapped onto the eval_cp
+scale used everywhere else:
+
+    win   →  TB_WIN_CP - |DTZ|    (faster conversion ranks higher)
+    draw  →  0                    (including cursed wins / blessed losses)
+    loss  → -(TB_WIN_CP - |DTZ|)  (longer resistance ranks higher)
+
+Tables are downloaded separately, e.g. from https://tablebase.lichess.ovh/tables/standard/
+"""
+
+import os
+
+import chess
+
+TB_WIN_CP = 20000
+
+
+class Tablebase:
+    """A Syzygy tablebase with counters for the engine searches it replaced."""
+
+    def __init__(self, path):
+        import chess.syzygy
+
+        self.path = path
+        self._tb = chess.syzygy.open_tablebase(path)
+        self._missing_table_error = chess.syzygy.MissingTableError
+        names = list(self._tb.wdl) + list(self._tb.dtz)
+        self.max_pieces = max((len(name) - 1 for name in names), default=0)
+        self.hits = 0
+        self.searches_avoided = 0
+
+    def close(self):
+        self._tb.close()
+
+    def covers(self, board):
+        """True if the position is small enough to be looked up."""
+        return (
+            chess.popcount(board.occupied) <= self.max_pieces
+            and not board.castling_rights
+        )
+
+    def score_moves(self, board):
+        """
+        Classify every legal move of a position from the side to move.
+
+        Returns:
+            list: [{"move": chess.Move, "eval_cp": int, "wdl": int, "dtz": int}]
+            sorted best first, or None if the position is not covered.
+        """
+        if not self.covers(board) or board.is_game_over():
+            return None
+
+        scored = []
+        try:
+            for move in board.legal_moves:
+                board.push(move)
+                try:
+                    # WDL/DTZ are from the opponent's perspective after the move
+                    wdl = -self._tb.probe_wdl(board)
+                    dtz = -self._tb.probe_dtz(board)
+                finally:
+                    board.pop()
+                scored.append({"move": move, "eval_cp": wdl_to_cp(wdl, dtz), "wdl": wdl, "dtz": dtz})
+        except (self._missing_table_error, KeyError):
+            return None
+
+        scored.sort(key=lambda e: e["eval_cp"], reverse=True)
+        self.hits += 1
+        return scored
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "max_pieces": self.max_pieces,
+            "hits": self.hits,
+            "searches_avoided": self.searches_avoided,
+        }
+
+
+def wdl_to_cp(wdl, dtz):
+    """Map a WDL/DTZ pair (side to move's perspective) onto the eval_cp scale."""
+    if wdl == 2:
+        return TB_WIN_CP - abs(dtz)
+    if wdl == -2:
+        return -(TB_WIN_CP - abs(dtz))
+    return 0
+
+
+def open_tablebase(path=None):
+    """Open the Syzygy tables at `path` (or $SYZYGY_PATH); None if there are none."""
+    path = path or os.environ.get("SYZYGY_PATH")
+    if not path or not os.path.isdir(path):
+        return None
+    tb = Tablebase(path)
+    if tb.max_pieces == 0:
+        tb.close()
+        return None
+    return tb